@@ -0,0 +1,199 @@
+"""Synthetic game data for benchmarks.
+
+Generates patch and dlc archives shaped like the real ones: XXTEA-encrypted
+LuaJIT master tables under src/Master/Data, gzip/CRPT-wrapped .pvr textures,
+and other binary assets.
+"""
+
+from __future__ import annotations
+
+import io
+import random
+import zipfile
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from relive_dm.dlc import DlcEntry
+from relive_dm.images import encode_pvr
+from relive_dm.lua import LuaValue, dump_lua_table
+from relive_dm.patch import PatchEntry
+from relive_dm.xxtea import encrypt_xxtea
+
+MASTER_DIR = "src/Master/Data"
+WORDS = [
+    "stage",
+    "revue",
+    "dress",
+    "memoir",
+    "skill",
+    "accessory",
+    "shine",
+    "brilliance",
+    "climax",
+    "position",
+]
+
+
+@dataclass
+class FixtureParams:
+    tables: int = 20
+    rows: int = 2000
+    patches: int = 10
+    textures: int = 100
+    texture_size: int = 64 * 1024
+    dlc_categories: int = 3
+    dlc_entries: int = 20
+    dlc_entry_size: int = 256 * 1024
+    seed: int = 0
+
+
+@dataclass
+class ServerFixtures:
+    """Archives for one server, laid out as the mock server serves them."""
+
+    name: str
+    lang_id: int
+    path: Path
+    patch_main: list[PatchEntry] = field(default_factory=list)
+    patch_main_localize: list[PatchEntry] = field(default_factory=list)
+    dlc_ver: int = 1
+    dlc_list: dict[str, list[DlcEntry]] = field(default_factory=dict)
+
+    @property
+    def patch_path(self) -> Path:
+        return self.path / "patch"
+
+    @property
+    def dlc_path(self) -> Path:
+        return self.path / "dlc"
+
+
+def make_row(
+    row_id: int, rng: random.Random, localized: bool
+) -> dict[LuaValue, LuaValue]:
+    name = " ".join(rng.choices(WORDS, k=3))
+    row: dict[LuaValue, LuaValue] = {
+        "id": row_id,
+        "name": {"en": name.title()} if localized else name,
+        "rarity": rng.randint(1, 6),
+        "attribute_type": rng.randint(1, 7),
+        "base_power": rng.random() * 10000,
+        "is_limited": rng.random() < 0.1,
+        "description": {"en": f"The {name}."} if localized else f"{name}。",
+        # Consecutive integer keys, converted to a list when merging
+        "skills": {i: rng.randint(1, 5000) for i in range(1, rng.randint(1, 6))},
+        "status": {
+            "hp": rng.randint(1000, 30000),
+            "atk": rng.randint(100, 3000),
+            "growth": {i: rng.randint(1, 100) for i in range(1, 6)},
+        },
+    }
+    return row
+
+
+def make_table(rows: int, rng: random.Random, localized: bool) -> LuaValue:
+    return {i: make_row(i, rng, localized) for i in range(1, rows + 1)}
+
+
+def encode_table(value: LuaValue) -> bytes:
+    return b"XXTEA" + encrypt_xxtea(dump_lua_table(value))
+
+
+def write_zip(path: Path, files: dict[str, bytes]) -> int:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as z:
+        for name, data in files.items():
+            z.writestr(name, data)
+    path.write_bytes(buffer.getvalue())
+    return len(buffer.getvalue())
+
+
+def generate_server(
+    out_path: Path, name: str, lang_id: int, params: FixtureParams
+) -> ServerFixtures:
+    rng = random.Random(f"{params.seed}-{name}")
+    fixtures = ServerFixtures(name=name, lang_id=lang_id, path=out_path / name)
+    localized = lang_id != 1
+
+    files: dict[str, bytes] = {}
+    for table in range(params.tables):
+        # Vary table sizes so there is a clear largest table
+        rows = max(1, params.rows * (table + 1) // params.tables)
+        files[f"{MASTER_DIR}/Table{table}.luac"] = encode_table(
+            make_table(rows, rng, localized)
+        )
+    for texture in range(params.textures):
+        data = rng.randbytes(params.texture_size // 2) * 2
+        key_index = texture % 16 if texture % 2 else None
+        files[f"images/texture{texture}.pvr"] = encode_pvr(data, key_index)
+
+    # Spread the files over the patches, with later patches also replacing
+    # some files from earlier ones
+    names = sorted(files)
+    per_patch = max(1, len(names) // params.patches)
+    for patch_id in range(1, params.patches + 1):
+        chunk = names[(patch_id - 1) * per_patch : patch_id * per_patch]
+        if patch_id == params.patches:
+            chunk = names[(patch_id - 1) * per_patch :]
+        patch_files = {name: files[name] for name in chunk}
+        if patch_id > 1:
+            replaced = f"{MASTER_DIR}/Table0.luac"
+            patch_files[replaced] = encode_table(
+                make_table(params.rows // 10, rng, localized)
+            )
+        entry = PatchEntry(patch_id, 1, 1, f"v{patch_id}", 0)
+        size = write_zip(fixtures.patch_path / entry.file_name(0), patch_files)
+        fixtures.patch_main.append(entry._replace(size=size))
+
+    localize_entry = PatchEntry(1, 1, 2, "v1", 0)
+    size = write_zip(
+        fixtures.patch_path / localize_entry.file_name(lang_id),
+        {
+            f"{MASTER_DIR}/Localize{lang_id}.luac": encode_table(
+                make_table(params.rows // 10, rng, localized)
+            )
+        },
+    )
+    fixtures.patch_main_localize.append(localize_entry._replace(size=size))
+
+    for category_index in range(params.dlc_categories):
+        category = f"category{category_index}"
+        entries = []
+        for entry_id in range(params.dlc_entries):
+            entry = DlcEntry(entry_id, "a", 0)
+            archive_files = {
+                f"dlc/{category}/{entry_id}/texture.pvr": encode_pvr(
+                    rng.randbytes(params.texture_size // 2) * 2, entry_id % 16
+                ),
+                f"dlc/{category}/{entry_id}/data.bin": rng.randbytes(
+                    params.dlc_entry_size
+                ),
+            }
+            size = write_zip(
+                fixtures.dlc_path
+                / f"{lang_id}_{category}_{entry.id}_{entry.version}.zip",
+                archive_files,
+            )
+            entries.append(entry._replace(size=size))
+        fixtures.dlc_list[category] = entries
+    return fixtures
+
+
+def generate_fixtures(out_path: Path, params: FixtureParams) -> list[ServerFixtures]:
+    return [
+        generate_server(out_path, "jp_ja", 1, params),
+        generate_server(out_path, "ww_en", 2, params),
+    ]
+
+
+def extract_fixtures(fixtures: ServerFixtures, out_path: Path):
+    """Extracts a server's patch archives in order, as download_patch would."""
+    for entry in fixtures.patch_main:
+        with zipfile.ZipFile(fixtures.patch_path / entry.file_name(0)) as z:
+            z.extractall(out_path)
+    for entry in fixtures.patch_main_localize:
+        with zipfile.ZipFile(
+            fixtures.patch_path / entry.file_name(fixtures.lang_id)
+        ) as z:
+            z.extractall(out_path)
@@ -0,0 +1,70 @@
+"""Measures CLI startup import cost.
+
+Run with `python benchmarks/import_time.py`. Exits with a non-zero status if
+importing the CLI pulls in a heavy dependency or exceeds the time budget, so it
+can be used to catch startup regressions. tests/test_import_time.py runs the
+same checks as part of the test suite.
+"""
+
+import argparse
+import re
+import subprocess
+import sys
+
+BUDGET_MS = 150.0
+
+# Modules that should only be imported once a command actually needs them
+HEAVY_MODULES = [
+    "httpx",
+    "pydantic",
+    "cryptography",
+    "msgpack",
+    "yaml",
+    "relive_dm.download",
+    "relive_dm.images",
+    "relive_dm.audio",
+    "relive_dm.masters",
+]
+
+
+def measure_import(module: str) -> tuple[float, dict[str, float]]:
+    """Returns the total import time of a module in ms and the cumulative time of
+    every module it imported, measured in a fresh interpreter."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+\s+\|\s+(\d+)\s+\|\s+(.+)", line)
+        if match:
+            times[match.group(2).strip()] = int(match.group(1)) / 1000
+    return times.get(module, 0.0), times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--module", default="relive_dm.main")
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    runs = [measure_import(args.module) for _ in range(args.runs)]
+    best = min(total for total, _ in runs)
+    imported = runs[0][1]
+    print(f"{args.module}: {best:.1f} ms (best of {args.runs})")
+    failed = False
+    for module in HEAVY_MODULES:
+        if module in imported:
+            print(f"  {module} imported at startup ({imported[module]:.1f} ms)")
+            failed = True
+    if best > args.budget_ms:
+        print(f"  exceeds budget of {args.budget_ms:.1f} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Local HTTP server that speaks the patch and dlc protocols for benchmarks.
+
+Each server's fixtures are served under /<name>/, so its entry_url is
+http://host:port/<name>/.
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import msgpack
+
+from benchmarks.fixtures import ServerFixtures
+from relive_dm.server import ServerInfo
+
+MIN_APP_VER = (1, 0, 62)
+TERMS_OF_SERVICE_VER = 3
+PRIVACY_POLICY_VER = 2
+
+
+class MockGameServer:
+    def __init__(self, fixtures: list[ServerFixtures], min_app_ver=MIN_APP_VER):
+        self.fixtures = {server.name: server for server in fixtures}
+        self.min_app_ver = min_app_ver
+        self.requests = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def servers(self) -> list[ServerInfo]:
+        return [
+            ServerInfo(
+                name=server.name,
+                entry_url=f"{self.url}/{server.name}/",
+                lang_id=server.lang_id,
+            )
+            for server in self.fixtures.values()
+        ]
+
+    def start(self) -> MockGameServer:
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> MockGameServer:
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def patch_response(self, server: ServerFixtures, params: dict[str, str]) -> dict:
+        app_ver = tuple(int(n) for n in params["app_ver"].split("."))
+        if app_ver < self.min_app_ver:
+            return {"force_update": 1}
+        if int(params["terms_of_service_ver"]) < TERMS_OF_SERVICE_VER:
+            return {"terms_of_service_ver": TERMS_OF_SERVICE_VER}
+        if int(params["privacy_policy_ver"]) < PRIVACY_POLICY_VER:
+            return {"privacy_policy_ver": PRIVACY_POLICY_VER}
+        patch_main = [
+            entry
+            for entry in server.patch_main
+            if entry.id > int(params["patch_main_id"])
+        ]
+        patch_main_localize = [
+            entry
+            for entry in server.patch_main_localize
+            if entry.id > int(params["patch_main_localize_id"])
+        ]
+        if not patch_main and not patch_main_localize:
+            return {"information_news_url": f"{self.url}/news"}
+        return {
+            "patch_main": patch_main,
+            "patch_main_localize": patch_main_localize,
+            "patch_server_url": f"{self.url}/{server.name}/patch",
+        }
+
+    def dlc_info(self, server: ServerFixtures) -> dict:
+        return {
+            "dlc_ver": server.dlc_ver,
+            "dlc_server_url": f"{self.url}/{server.name}/dlc",
+        }
+
+    def dlc_list(self, server: ServerFixtures) -> bytes:
+        return msgpack.packb(  # type: ignore
+            {
+                **self.dlc_info(server),
+                "dlc_list": {
+                    category: [list(entry) for entry in entries]
+                    for category, entries in server.dlc_list.items()
+                },
+            }
+        )
+
+    def _make_handler(self) -> type[BaseHTTPRequestHandler]:
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlsplit(self.path)
+                params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                name, _, rest = url.path.strip("/").partition("/")
+                server = mock.fixtures.get(name)
+                if server is None:
+                    self.send_error(404)
+                elif rest == "":
+                    self._send_json(mock.patch_response(server, params))
+                elif rest == "dlc":
+                    self._send_json(mock.dlc_info(server))
+                elif rest == f"dlc/dlc_{server.dlc_ver}_{server.lang_id}.json":
+                    self._send(mock.dlc_list(server), "application/octet-stream")
+                else:
+                    self._send_file(server.path / rest)
+
+            def _send_json(self, value: dict):
+                self._send(json.dumps(value).encode(), "application/json")
+
+            def _send_file(self, path: Path):
+                if ".." in path.parts or not path.is_file():
+                    self.send_error(404)
+                    return
+                self._send(path.read_bytes(), "application/zip")
+
+            def _send(self, data: bytes, content_type: str):
+                with mock._lock:
+                    mock.requests += 1
+                    mock.bytes_sent += len(data)
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,281 @@
+"""Offline benchmarks of the download, decode and merge pipeline.
+
+Run with `python -m benchmarks.run` from the repository root. Synthetic patch
+and dlc archives are generated and served by a local mock of the game servers,
+so no network access or real game data is needed. Results are written as JSON
+and, given --baseline, compared against an earlier run; the exit status is
+non-zero if any benchmark regressed by more than --threshold.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable
+
+from benchmarks.fixtures import (
+    MASTER_DIR,
+    FixtureParams,
+    extract_fixtures,
+    generate_fixtures,
+)
+from benchmarks.import_time import measure_import
+from benchmarks.mock_server import MockGameServer
+
+DEFAULT_OUTPUT = Path("benchmarks/results/latest.json")
+
+
+def timed(
+    func: Callable[[], object],
+    repeat: int,
+    setup: Callable[[], object] | None = None,
+) -> dict[str, float]:
+    """Runs func repeat times, calling setup untimed before each run, and returns
+    timing statistics in seconds."""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "max": max(times),
+        "runs": len(times),
+    }
+
+
+def reset_dir(path: Path):
+    shutil.rmtree(path, ignore_errors=True)
+    path.mkdir(parents=True)
+
+
+def largest_table_path(tree: Path) -> Path:
+    tables = sorted((tree / MASTER_DIR).glob("*.luac"), key=lambda p: p.stat().st_size)
+    return tables[-1]
+
+
+def largest_table(tree: Path) -> bytes:
+    return largest_table_path(tree).read_bytes()
+
+
+def merge_peak_memory(
+    trees: list[Path], masters_path: Path, table: str, repeat: int
+) -> dict[str, float]:
+    """Times merging one table of every tree, and records the peak memory traced
+    in each merge step. The higher of the decode and merge peaks, which include
+    the decoded tables of every server, is reported as peak_bytes."""
+    from relive_dm.masters import merge_all_masters
+    from relive_dm.profiling import PipelineProfiler
+
+    peaks: dict[str, int] = {}
+
+    def profiled_merge():
+        profiler = PipelineProfiler()
+        profiler.use_cprofile = False
+        with profiler:
+            merge_all_masters(trees, masters_path, {table})
+        for item in profiler.items:
+            assert item.peak_bytes is not None
+            peaks[item.stage] = max(peaks.get(item.stage, 0), item.peak_bytes)
+
+    result = timed(profiled_merge, repeat)
+    result["peak_bytes"] = max(peaks["merge.decode"], peaks["merge.merge"])
+    for stage, peak in peaks.items():
+        result[f"{stage.removeprefix('merge.')}_peak_bytes"] = peak
+    return result
+
+
+def run_benchmarks(
+    work_path: Path, params: FixtureParams, repeat: int, only: set[str]
+) -> dict[str, dict[str, float]]:
+    from relive_dm.download import DownloadItem, download_zips
+    from relive_dm.filters import SyncFilter
+    from relive_dm.lua import read_lua_table
+    from relive_dm.masters import merge_all_masters
+    from relive_dm.server import download_all
+    from relive_dm.xxtea import decrypt_xxtea
+
+    def enabled(name: str) -> bool:
+        return not only or name in only
+
+    results: dict[str, dict[str, float]] = {}
+    start = time.perf_counter()
+    fixtures = generate_fixtures(work_path / "fixtures", params)
+    print(f"Generated fixtures in {time.perf_counter() - start:.1f}s")
+
+    trees = [work_path / "trees" / server.name for server in fixtures]
+    for server, tree in zip(fixtures, trees):
+        extract_fixtures(server, tree)
+    table = largest_table(trees[0])
+
+    if enabled("import_cli"):
+        # Import time of the CLI as reported by -X importtime, in seconds
+        samples = [measure_import("relive_dm.main")[0] / 1000 for _ in range(repeat)]
+        results["import_cli"] = {
+            "min": min(samples),
+            "median": statistics.median(samples),
+            "max": max(samples),
+            "runs": len(samples),
+        }
+    if enabled("decrypt_xxtea"):
+        results["decrypt_xxtea"] = timed(
+            lambda: decrypt_xxtea(table[len(b"XXTEA") :]), repeat
+        )
+    if enabled("read_lua_table"):
+        results["read_lua_table"] = timed(lambda: read_lua_table(table), repeat)
+    if enabled("merge_all_masters"):
+        masters_path = work_path / "masters"
+        results["merge_all_masters"] = timed(
+            lambda: merge_all_masters(trees, masters_path),
+            repeat,
+            setup=lambda: reset_dir(masters_path),
+        )
+    if enabled("merge_peak_memory"):
+        masters_path = work_path / "masters_peak"
+        largest = largest_table_path(trees[0]).name
+        results["merge_peak_memory"] = merge_peak_memory(
+            trees, masters_path, largest, repeat
+        )
+
+    # Conversion tools such as PVRTexToolCLI are not needed for the benchmarks
+    sync_filter = SyncFilter(skip_conversion={".pvr", ".ckb"})
+    with MockGameServer(fixtures) as server:
+        if enabled("download_zips"):
+            patch_url = f"{server.url}/{fixtures[0].name}/patch"
+            items = [
+                DownloadItem(f"{patch_url}/{entry.file_name(0)}", entry.size)
+                for entry in fixtures[0].patch_main
+            ]
+            download_path = work_path / "download_zips"
+            results["download_zips"] = timed(
+                lambda: download_zips(
+                    items,
+                    download_path,
+                    max_download_threads=8,
+                    ordered=True,
+                    sync_filter=sync_filter,
+                ),
+                repeat,
+                setup=lambda: reset_dir(download_path),
+            )
+        if enabled("download_all"):
+            download_path = work_path / "download_all"
+            bytes_sent = server.bytes_sent
+            results["download_all"] = timed(
+                lambda: download_all(
+                    download_path,
+                    sync_filter=sync_filter,
+                    server_list=server.servers,
+                ),
+                repeat,
+                setup=lambda: reset_dir(download_path),
+            )
+            results["download_all"]["bytes_served"] = (
+                server.bytes_sent - bytes_sent
+            ) / repeat
+    return results
+
+
+def compare(
+    results: dict[str, dict[str, float]],
+    baseline: dict[str, dict[str, float]],
+    threshold: float,
+) -> list[str]:
+    """Prints each benchmark against the baseline and returns the names of those
+    slower by more than threshold (a ratio, e.g. 1.2 for 20%)."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name:20} {result['median']:10.4f}s  (no baseline)")
+            if "peak_bytes" in result:
+                print(f"{'':20} {result['peak_bytes'] / 1024 / 1024:9.1f}MiB")
+            continue
+        ratio = result["median"] / baseline[name]["median"]
+        flag = ""
+        if ratio > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(
+            f"{name:20} {result['median']:10.4f}s  "
+            f"baseline {baseline[name]['median']:10.4f}s  x{ratio:.2f}{flag}"
+        )
+        if "peak_bytes" in result and "peak_bytes" in baseline[name]:
+            ratio = result["peak_bytes"] / baseline[name]["peak_bytes"]
+            flag = ""
+            if ratio > threshold:
+                flag = "  REGRESSION"
+                if name not in regressions:
+                    regressions.append(name)
+            print(
+                f"{'':20} {result['peak_bytes'] / 1024 / 1024:9.1f}MiB "
+                f"baseline {baseline[name]['peak_bytes'] / 1024 / 1024:9.1f}MiB "
+                f"x{ratio:.2f}{flag}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT)
+    parser.add_argument("--baseline", type=Path)
+    parser.add_argument("--threshold", type=float, default=1.2)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", action="append", default=[], help="Benchmarks to run")
+    parser.add_argument("--work-dir", type=Path, help="Defaults to a temporary dir")
+    parser.add_argument("--tables", type=int, default=FixtureParams.tables)
+    parser.add_argument("--rows", type=int, default=FixtureParams.rows)
+    parser.add_argument("--patches", type=int, default=FixtureParams.patches)
+    parser.add_argument("--textures", type=int, default=FixtureParams.textures)
+    parser.add_argument("--seed", type=int, default=FixtureParams.seed)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    params = FixtureParams(
+        tables=args.tables,
+        rows=args.rows,
+        patches=args.patches,
+        textures=args.textures,
+        seed=args.seed,
+    )
+    if args.work_dir is not None:
+        args.work_dir.mkdir(parents=True, exist_ok=True)
+        results = run_benchmarks(args.work_dir, params, args.repeat, set(args.only))
+    else:
+        with tempfile.TemporaryDirectory(prefix="relive_dm_bench_") as work_dir:
+            results = run_benchmarks(
+                Path(work_dir), params, args.repeat, set(args.only)
+            )
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": vars(params),
+        "results": results,
+    }
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(report, indent=4))
+    print(f"Wrote results to {args.output}")
+
+    baseline = {}
+    if args.baseline is not None:
+        baseline = json.loads(args.baseline.read_text())["results"]
+    regressions = compare(results, baseline, args.threshold)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
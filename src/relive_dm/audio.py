@@ -4,6 +4,9 @@ import re
 import subprocess
 from pathlib import Path
 
+from relive_dm.metrics import metrics
+from relive_dm.processing import NothingToConvert
+
 logger = logging.getLogger(__name__)
 
 
@@ -17,18 +20,24 @@ def wav_to_opus(path: Path) -> Path | None:
             logger.warning("wav_to_opus is not supported on this platform, skipping")
             return None
     out_path = path.with_suffix(".opus")
-    result = subprocess.run(
-        [
-            f"{executable}",
-            "-y",
-            "-i",
-            f"{path}",
-            "-c:a",
-            "libopus",
-            "-b:a",
-            "128k",
-            f"{out_path}",
-        ],
+    with metrics.timer("relive_dm_subprocess_seconds", tool="ffmpeg"):
+        result = subprocess.run(
+            [
+                f"{executable}",
+                "-y",
+                "-i",
+                f"{path}",
+                "-c:a",
+                "libopus",
+                "-b:a",
+                "128k",
+                f"{out_path}",
+            ],
+        )
+    metrics.inc(
+        "relive_dm_subprocess_total",
+        tool="ffmpeg",
+        status="ok" if result.returncode == 0 else "failed",
     )
     if result.returncode == 0:
         logger.info(f"Converted {path} to {out_path}")
@@ -45,15 +54,20 @@ def process_ckb(path: Path, remove_original: bool = False) -> Path | None:
         case "Linux":
             executable = Path(__file__).parent / "external" / "cktool"
         case _:
-            logger.warning("ckb_to_wav is not supported on this platform, skipping")
-            return None
-    result = subprocess.run(
-        [
-            f"{executable}",
-            "extract",
-            f"{path}",
-        ],
-        capture_output=True,
+            raise NothingToConvert("ckb_to_wav is not supported on this platform")
+    with metrics.timer("relive_dm_subprocess_seconds", tool="cktool"):
+        result = subprocess.run(
+            [
+                f"{executable}",
+                "extract",
+                f"{path}",
+            ],
+            capture_output=True,
+        )
+    metrics.inc(
+        "relive_dm_subprocess_total",
+        tool="cktool",
+        status="ok" if result.returncode == 0 else "failed",
     )
     match = re.search(
         r"writing (.+\.wav)",
@@ -0,0 +1,32 @@
+from __future__ import annotations
+
+import threading
+
+import httpx
+
+_client: httpx.Client | None = None
+_lock = threading.Lock()
+
+
+def get_client() -> httpx.Client:
+    """Returns the shared HTTP client.
+
+    Reusing one client keeps connections to the patch and dlc servers alive
+    between requests and avoids building a new TLS context for every download.
+    The client is safe to use from several threads.
+    """
+    global _client
+    with _lock:
+        if _client is None or _client.is_closed:
+            _client = httpx.Client(
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=32)
+            )
+        return _client
+
+
+def close_client():
+    global _client
+    with _lock:
+        if _client is not None:
+            _client.close()
+            _client = None
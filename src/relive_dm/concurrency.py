@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import collections
+import contextlib
+import email.utils
+import logging
+import math
+import threading
+import time
+from typing import Iterator
+
+from relive_dm.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Latency this many times the best recent latency counts as congestion
+LATENCY_FACTOR = 3.0
+# Windows whose best latency is kept as the baseline, so one fast response
+# doesn't set it for the whole run
+LATENCY_WINDOWS = 8
+# A window this much slower than the previous one undoes the last increase
+THROUGHPUT_DROP = 0.9
+
+
+def is_throttling_status(status_code: int) -> bool:
+    return status_code == 429 or status_code >= 500
+
+
+def retry_after_delay(value: str) -> float | None:
+    """Returns the seconds to wait from a Retry-After header, given either as
+    seconds or as an HTTP date, or None if it can't be parsed."""
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
+
+
+class ConcurrencyController:
+    """Adjusts the number of in-flight downloads with additive-increase,
+    multiplicative-decrease.
+
+    After each window of completed downloads (one per allowed slot), the limit
+    grows by one unless latency has risen well above the best of recent windows,
+    in which case it is decreased, or throughput fell after the last increase,
+    in which case that increase is undone. Throttling responses (429 and 5xx)
+    and connection errors cut the limit by the decrease factor immediately, but
+    only once per window: requests sent before the last decrease were sent at
+    the old limit, so their throttling doesn't decrease it again.
+    """
+
+    def __init__(
+        self,
+        minimum: int = 1,
+        maximum: int = 32,
+        initial: int | None = None,
+        decrease_factor: float = 0.5,
+    ):
+        if minimum < 1 or maximum < minimum:
+            raise ValueError("Invalid concurrency bounds")
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = min(max(initial or minimum, minimum), maximum)
+        self.decrease_factor = decrease_factor
+        metrics.set("relive_dm_download_concurrency", self.limit)
+        self.in_flight = 0
+        self._condition = threading.Condition()
+        # Best latency of each recent window, oldest first
+        self._best_latencies: collections.deque[float] = collections.deque(
+            maxlen=LATENCY_WINDOWS
+        )
+        self._window_best_latency = math.inf
+        # Slots are numbered as they are taken, to tell which requests were sent
+        # before the last decrease
+        self._tickets = 0
+        self._decreased_at = 0
+        self._local = threading.local()
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._window_bytes = 0
+        self._window_latency = 0.0
+        self._previous_throughput: float | None = None
+        self._last_increased = False
+
+    @contextlib.contextmanager
+    def slot(self) -> Iterator[None]:
+        with self._condition:
+            self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+            self._local.ticket = self._tickets
+            self._tickets += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.in_flight -= 1
+                self._condition.notify_all()
+
+    def record_success(self, size: int, latency: float):
+        """Records a completed download and its time to first response."""
+        with self._condition:
+            self._window_best_latency = min(self._window_best_latency, latency)
+            self._window_count += 1
+            self._window_bytes += size
+            self._window_latency += latency
+            if self._window_count < self.limit:
+                return
+            elapsed = time.monotonic() - self._window_start
+            throughput = self._window_bytes / elapsed if elapsed > 0 else 0.0
+            average_latency = self._window_latency / self._window_count
+            best_latency = min(
+                min(self._best_latencies, default=math.inf), self._window_best_latency
+            )
+            self._best_latencies.append(self._window_best_latency)
+            if average_latency > LATENCY_FACTOR * best_latency:
+                self._decrease(f"latency rose to {average_latency:.2f}s")
+            elif (
+                self._last_increased
+                and self._previous_throughput is not None
+                and throughput < self._previous_throughput * THROUGHPUT_DROP
+            ):
+                self._set_limit(self.limit - 1, "throughput dropped")
+                self._last_increased = False
+            else:
+                self._last_increased = self._set_limit(
+                    self.limit + 1, f"throughput {throughput / 1024 / 1024:.1f} MiB/s"
+                )
+            self._previous_throughput = throughput
+            self._reset_window()
+
+    def record_throttled(self, reason: str):
+        """Records a throttling response or connection error, from the calling
+        thread's last slot."""
+        with self._condition:
+            ticket = getattr(self._local, "ticket", None)
+            if ticket is not None and ticket < self._decreased_at:
+                logger.debug(f"Not decreasing concurrency again ({reason})")
+                return
+            self._decrease(reason)
+            self._previous_throughput = None
+            self._reset_window()
+
+    def _decrease(self, reason: str):
+        self._set_limit(int(self.limit * self.decrease_factor), reason)
+        self._last_increased = False
+        self._decreased_at = self._tickets
+
+    def _set_limit(self, limit: int, reason: str) -> bool:
+        limit = min(max(limit, self.minimum), self.maximum)
+        if limit == self.limit:
+            return False
+        logger.info(f"Download concurrency {self.limit} -> {limit} ({reason})")
+        self.limit = limit
+        metrics.set("relive_dm_download_concurrency", limit)
+        self._condition.notify_all()
+        return True
+
+    def _reset_window(self):
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._window_bytes = 0
+        self._window_latency = 0.0
+        self._window_best_latency = math.inf
@@ -4,39 +4,117 @@ import logging
 from pathlib import Path
 from typing import NamedTuple
 
-import httpx
 import msgpack
-from pydantic import BaseModel
-
-from relive_dm.download import download_zips
+from pydantic import BaseModel, Field
+
+from relive_dm.client import get_client
+from relive_dm.download import (
+    DownloadError,
+    DownloadItem,
+    download_zips,
+    extract_existing,
+)
+from relive_dm.filters import SyncFilter
+from relive_dm.processing import Scheduler
 
 logger = logging.getLogger(__name__)
 
-
-def download_dlc(entry_url: str, lang_id: int, base_path: Path):
+MIN_DOWNLOAD_THREADS = 2
+MAX_DOWNLOAD_THREADS = 32
+
+
+def download_dlc(
+    entry_url: str,
+    lang_id: int,
+    base_path: Path,
+    lazy: bool = False,
+    dry_run: bool = False,
+    min_download_threads: int = MIN_DOWNLOAD_THREADS,
+    max_download_threads: int = MAX_DOWNLOAD_THREADS,
+    sync_filter: SyncFilter | None = None,
+    scheduler: Scheduler | None = None,
+) -> list[DownloadItem]:
+    """Downloads new dlc entries and returns what was (or, for a dry run, would be)
+    downloaded.
+
+    Categories excluded by the sync filter are not downloaded or recorded as
+    downloaded, so widening the filter later downloads just those categories.
+    If some entries fail to download, the others are still recorded and
+    DownloadError is raised, so the next run retries just the failed ones.
+    """
+    if sync_filter is None:
+        sync_filter = SyncFilter()
     config = load_dlc_config(base_path)
+    filter_changed = sync_filter != config.sync_filter
 
     info = get_dlc_info(entry_url, lang_id)
-    if info.dlc_ver <= config.version:
+    if info.dlc_ver <= config.version and not filter_changed:
         logger.info("No new dlc, skipping")
-        return
+        return []
+    if filter_changed and not dry_run:
+        # Files the previous filter left out of archives that are already here
+        extract_existing(base_path, sync_filter, scheduler)
     download_list = download_dlc_list(info, lang_id)
     logger.info(f"Downloaded dlc list from {info.dlc_server_url}")
 
-    urls = [
-        get_dlc_download_url(info.dlc_server_url, lang_id, category, entry)
+    items = [
+        DownloadItem(
+            get_dlc_download_url(info.dlc_server_url, lang_id, category, entry),
+            entry.size,
+            entry_name(category, entry),
+        )
         for category, entries in download_list.dlc_list.items()
+        if sync_filter.includes_category(category)
         for entry in entries
         if category not in config.downloaded or entry not in config.downloaded[category]
     ]
-
-    download_zips(urls, base_path, max_download_threads=16)
-    logger.info(f"Downloaded {len(urls)} dlc entries")
-
+    if dry_run:
+        return items
+
+    error: DownloadError | None = None
+    try:
+        download_zips(
+            items,
+            base_path,
+            max_download_threads=max_download_threads,
+            scheduler=scheduler,
+            lazy=lazy,
+            min_download_threads=min_download_threads,
+            sync_filter=sync_filter,
+        )
+        logger.info(f"Downloaded {len(items)} dlc entries")
+    except DownloadError as e:
+        error = e
+    failed = set() if error is None else {item.entry for item in error.failed}
+
+    downloaded = {
+        category: {
+            entry for entry in entries if entry_name(category, entry) not in failed
+        }
+        for category, entries in download_list.dlc_list.items()
+        if sync_filter.includes_category(category)
+    }
+    # Keep categories synced by an earlier, wider filter
+    for category, entries in config.downloaded.items():
+        if category not in downloaded:
+            downloaded[category] = entries
     save_dlc_config(
         base_path,
-        DlcConfig(version=download_list.dlc_ver, downloaded=download_list.dlc_list),
+        DlcConfig(
+            # Otherwise the next run would skip the failed entries as up to date
+            version=download_list.dlc_ver if error is None else config.version,
+            downloaded=downloaded,
+            sync_filter=sync_filter,
+        ),
     )
+    if error is not None:
+        raise error
+    return items
+
+
+def entry_name(category: str, entry: DlcEntry) -> str:
+    """Names an entry in the extract index catalog."""
+    return f"dlc:{category}:{entry.id}:{entry.version}"
 
 
 def get_dlc_download_url(
@@ -46,7 +124,7 @@ def get_dlc_download_url(
 
 
 def download_dlc_list(info: DlcInfo, lang_id: int) -> DlcDownloadList:
-    r = httpx.get(f"{info.dlc_server_url}/dlc_{info.dlc_ver}_{lang_id}.json")
+    r = get_client().get(f"{info.dlc_server_url}/dlc_{info.dlc_ver}_{lang_id}.json")
     r.raise_for_status()
     return DlcDownloadList.model_validate(msgpack.unpackb(r.content))
 
@@ -65,7 +143,7 @@ def save_dlc_config(base_path: Path, config: DlcConfig):
 
 
 def get_dlc_info(entry_url: str, lang_id: int) -> DlcInfo:
-    r = httpx.get(f"{entry_url}dlc", params={"lang_id": lang_id})
+    r = get_client().get(f"{entry_url}dlc", params={"lang_id": lang_id})
     r.raise_for_status()
     return DlcInfo.model_validate_json(r.text)
 
@@ -90,3 +168,5 @@ class DlcDownloadList(BaseModel):
 class DlcConfig(BaseModel):
     version: int
     downloaded: dict[str, set[DlcEntry]]
+    # What the last sync included
+    sync_filter: SyncFilter = Field(default_factory=SyncFilter)
@@ -1,85 +1,515 @@
 import concurrent.futures
-import io
 import logging
-import multiprocessing
+import threading
+import time
 import zipfile
 from pathlib import Path
-from typing import Callable, Iterable
+from typing import Any, Callable, NamedTuple
 from urllib.parse import urlparse
 
 import httpx
 
-from relive_dm.audio import process_ckb
-from relive_dm.images import process_pvr
-from relive_dm.lua import process_lua
+from relive_dm.client import get_client
+from relive_dm.concurrency import (
+    ConcurrencyController,
+    is_throttling_status,
+    retry_after_delay,
+)
+from relive_dm.filters import SyncFilter
+from relive_dm.index import ExtractIndex
+from relive_dm.metrics import metrics
+from relive_dm.processing import ProcessingScheduler, Scheduler, is_master_data
+from relive_dm.profiling import profile_stage
 
 logger = logging.getLogger(__name__)
 
 
-def process_file(path: Path):
-    logger.debug(f"Extracted {path}")
-    match path.suffix:
-        case ".pvr":
-            process_pvr(path)
-        case ".ckb":
-            process_ckb(path)
-        case ".lua" | ".luac":
-            if "Master" in path.parts and "Data" in path.parts:
-                process_lua(path)
-        case _:
-            pass
-
-
-def download_zip(url: str, base_path: Path, callback: Callable[[Path], None]):
-    r = httpx.get(url)
-    r.raise_for_status()
-    logger.info(f"Downloaded {url}")
+class DownloadItem(NamedTuple):
+    url: str
+    size: int = 0
+    # Patch or dlc entry the archive belongs to, recorded in the catalog
+    entry: str = ""
+
+
+class DownloadError(Exception):
+    """Some archives could not be downloaded, so they were not extracted."""
+
+    def __init__(self, failed: list[DownloadItem]):
+        super().__init__(f"Failed to download {len(failed)} archives")
+        self.failed = failed
+
+
+def format_size(size: float) -> str:
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02}:{seconds:02}"
+
+
+def plan_downloads(items: list[DownloadItem]) -> list[DownloadItem]:
+    """Orders downloads largest first so big archives don't leave a long tail."""
+    return sorted(items, key=lambda item: item.size, reverse=True)
+
+
+class DownloadProgress:
+    """Tracks bytes downloaded across all connections and estimates time left."""
+
+    def __init__(self, items: list[DownloadItem]):
+        self.total_bytes = sum(item.size for item in items)
+        self.total_count = len(items)
+        self.downloaded_bytes = 0
+        self.completed_count = 0
+        self.completed_bytes = 0
+        self.start_time = time.monotonic()
+        # Sum of per-download durations, to get the average per-connection rate
+        self.connection_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add_bytes(self, count: int):
+        with self._lock:
+            self.downloaded_bytes += count
+
+    @property
+    def remaining_bytes(self) -> int:
+        return max(self.total_bytes - self.downloaded_bytes, 0)
+
+    @property
+    def throughput(self) -> float:
+        """Overall bytes per second since the first download started."""
+        elapsed = time.monotonic() - self.start_time
+        return self.downloaded_bytes / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def connection_throughput(self) -> float:
+        """Average bytes per second of a single connection."""
+        if self.connection_seconds <= 0:
+            return 0.0
+        return self.completed_bytes / self.connection_seconds
+
+    def complete(self, url: str, size: int, seconds: float):
+        with self._lock:
+            self.completed_count += 1
+            self.completed_bytes += size
+            self.connection_seconds += seconds
+        throughput = self.throughput
+        eta = self.remaining_bytes / throughput if throughput > 0 else 0.0
+        logger.info(
+            f"Downloaded {url} ({format_size(size)} in {seconds:.1f}s), "
+            f"{self.completed_count}/{self.total_count} done, "
+            f"{format_size(self.remaining_bytes)} remaining at "
+            f"{format_size(throughput)}/s "
+            f"({format_size(self.connection_throughput)}/s per connection), "
+            f"ETA {format_duration(eta)}"
+        )
+
+
+# Attempts per archive when the server throttles or the connection fails
+MAX_FETCH_ATTEMPTS = 5
+
+
+def fetch_zip(
+    url: str,
+    base_path: Path,
+    progress: DownloadProgress | None = None,
+    controller: ConcurrencyController | None = None,
+) -> Path:
+    """Downloads an archive to the raw directory and returns its path.
+
+    With a controller, the download waits for a free slot, reports its latency
+    and size, and is retried with backoff on throttling responses and
+    connection errors.
+    """
+    if controller is None:
+        return fetch_zip_once(url, base_path, progress)
+    for attempt in range(MAX_FETCH_ATTEMPTS):
+        try:
+            with controller.slot():
+                return fetch_zip_once(url, base_path, progress, controller)
+        except httpx.HTTPStatusError as e:
+            if not is_throttling_status(e.response.status_code):
+                raise
+            if attempt == MAX_FETCH_ATTEMPTS - 1:
+                raise
+            controller.record_throttled(f"HTTP {e.response.status_code} from {url}")
+            delay = retry_after_delay(e.response.headers.get("Retry-After", ""))
+            if delay is None:
+                delay = 2**attempt
+        except httpx.TransportError as e:
+            if attempt == MAX_FETCH_ATTEMPTS - 1:
+                raise
+            controller.record_throttled(f"{type(e).__name__} from {url}")
+            delay = 2**attempt
+        logger.info(f"Retrying {url} in {delay:.0f}s")
+        time.sleep(delay)
+    raise AssertionError("unreachable")
+
+
+def fetch_zip_once(
+    url: str,
+    base_path: Path,
+    progress: DownloadProgress | None = None,
+    controller: ConcurrencyController | None = None,
+) -> Path:
     parsed_url = urlparse(url)
     zip_path = base_path / "raw" / parsed_url.path.lstrip("/")
     zip_path.parent.mkdir(parents=True, exist_ok=True)
-    zip_path.write_bytes(r.content)
-    with zipfile.ZipFile(io.BytesIO(r.content)) as z:
+    part_path = zip_path.with_name(f"{zip_path.name}.part")
+    start_time = time.monotonic()
+    size = 0
+    metrics.add("relive_dm_downloads_in_flight", 1)
+    try:
+        with profile_stage("download", url), get_client().stream("GET", url) as r:
+            latency = time.monotonic() - start_time
+            metrics.observe("relive_dm_download_latency_seconds", latency)
+            r.raise_for_status()
+            with part_path.open("wb") as f:
+                for chunk in r.iter_bytes():
+                    f.write(chunk)
+                    size += len(chunk)
+                    if progress is not None:
+                        progress.add_bytes(len(chunk))
+    except Exception as e:
+        # Don't count a failed attempt towards the progress
+        if progress is not None:
+            progress.add_bytes(-size)
+        status = "error"
+        if isinstance(e, httpx.HTTPStatusError) and is_throttling_status(
+            e.response.status_code
+        ):
+            status = "throttled"
+        metrics.inc("relive_dm_downloads_total", status=status)
+        raise
+    finally:
+        metrics.add("relive_dm_downloads_in_flight", -1)
+    part_path.replace(zip_path)
+    metrics.inc("relive_dm_downloads_total", status="ok")
+    metrics.inc("relive_dm_download_bytes_total", size)
+    metrics.observe("relive_dm_download_seconds", time.monotonic() - start_time)
+    if controller is not None:
+        controller.record_success(size, latency)
+    if progress is not None:
+        progress.complete(url, size, time.monotonic() - start_time)
+    else:
+        logger.info(f"Downloaded {url}")
+    return zip_path
+
+
+def download_zip(
+    url: str,
+    base_path: Path,
+    callback: Callable[[Path], Any],
+    index: ExtractIndex | None = None,
+    lazy: bool = False,
+    progress: DownloadProgress | None = None,
+    controller: ConcurrencyController | None = None,
+    sync_filter: SyncFilter | None = None,
+    entry: str = "",
+):
+    zip_path = fetch_zip(url, base_path, progress, controller)
+    source = zip_path.relative_to(base_path).as_posix()
+    if index is not None:
+        index.record_archive(source, url, entry or None, zip_path.stat().st_size)
+    with zipfile.ZipFile(zip_path) as z:
+        extract_zip(
+            z,
+            source,
+            base_path,
+            callback,
+            index,
+            lazy=lazy,
+            sync_filter=sync_filter,
+        )
+
+
+def extract_zip(
+    z: zipfile.ZipFile,
+    source: str,
+    base_path: Path,
+    callback: Callable[[Path], Any],
+    index: ExtractIndex | None = None,
+    names: set[str] | None = None,
+    lazy: bool = False,
+    sync_filter: SyncFilter | None = None,
+):
+    """Extracts the members of a downloaded archive and passes them to callback.
+
+    In lazy mode only master data is extracted. Other members, and those
+    excluded by the sync filter, are just recorded in the index so they can be
+    read from the archive on demand or extracted once the filter is widened.
+    """
+    start_time = time.monotonic()
+    with profile_stage("extract", source):
+        skipped = 0
         for info in z.infolist():
             if info.is_dir():
                 continue
+            if names is not None and info.filename not in names:
+                continue
+            if sync_filter is not None and not sync_filter.includes_path(info.filename):
+                if index is not None:
+                    index.mark_excluded(info.filename, source, info.CRC, info.file_size)
+                metrics.inc("relive_dm_extract_files_total", status="excluded")
+                continue
+            if lazy and index is not None and not is_master_data(Path(info.filename)):
+                index.mark_virtual(info.filename, source, info.CRC, info.file_size)
+                metrics.inc("relive_dm_extract_files_total", status="virtual")
+                continue
             path = base_path / info.filename
+            convert = sync_filter is None or sync_filter.converts(path.suffix)
+            if index is not None and index.is_current(
+                info.filename, info.CRC, info.file_size, convert
+            ):
+                skipped += 1
+                metrics.inc("relive_dm_extract_files_total", status="unchanged")
+                continue
             path.parent.mkdir(parents=True, exist_ok=True)
+            if index is not None:
+                index.mark_extracted(info.filename, source, info.CRC, info.file_size)
             with path.open("wb") as f:
                 f.write(z.read(info))
-            callback(path)
+            metrics.inc("relive_dm_extract_files_total", status="extracted")
+            metrics.inc("relive_dm_extract_bytes_total", info.file_size)
+            if not convert:
+                logger.debug(f"Extracted {path}, skipping conversion")
+                if index is not None:
+                    index.mark_skipped(info.filename)
+                continue
+            logger.debug(f"Extracted {path}")
+            result = callback(path)
+            if index is not None:
+                index.track(info.filename, result)
+    metrics.observe("relive_dm_extract_seconds", time.monotonic() - start_time)
+    if skipped:
+        logger.info(f"Skipped {skipped} unchanged files from {source}")
+
+
+def extract_existing(
+    base_path: Path,
+    sync_filter: SyncFilter,
+    scheduler: Scheduler | None = None,
+):
+    """Extracts files from archives already in raw that a previous, narrower sync
+    filter left out, without downloading anything.
+
+    Patch and dlc archives share the tree, so this does nothing if the tree was
+    already re-extracted with the same filter.
+    """
+    if scheduler is None:
+        with ProcessingScheduler() as new_scheduler:
+            extract_existing(base_path, sync_filter, new_scheduler)
+        return
+    with ExtractIndex(base_path) as index:
+        applied = index.applied_sync_filter()
+        if (
+            applied is not None
+            and SyncFilter.model_validate_json(applied) == sync_filter
+        ):
+            return
+        names_by_source: dict[str, set[str]] = {}
+        for path, (source, _, status) in index.find_archive_members().items():
+            if status not in ("excluded", "skipped"):
+                continue
+            if status == "skipped" and not sync_filter.converts(Path(path).suffix):
+                continue
+            if sync_filter.includes_path(path):
+                names_by_source.setdefault(source, set()).add(path)
+        for source, names in names_by_source.items():
+            logger.info(f"Extracting {len(names)} newly included files from {source}")
+            with zipfile.ZipFile(base_path / source) as z:
+                extract_zip(
+                    z,
+                    source,
+                    base_path,
+                    scheduler.submit,
+                    index,
+                    names,
+                    sync_filter=sync_filter,
+                )
+        scheduler.join()
+        index.record_applied_sync_filter(sync_filter.model_dump_json())
 
 
 def download_zips(
-    urls: Iterable[str],
+    items: list[DownloadItem],
     base_path: Path,
     max_download_threads: int,
-    max_processing_threads: int | None = None,
+    scheduler: Scheduler | None = None,
+    lazy: bool = False,
+    ordered: bool = False,
+    min_download_threads: int = 1,
+    sync_filter: SyncFilter | None = None,
 ):
-    if max_processing_threads is None:
-        max_processing_threads = multiprocessing.cpu_count()
-    if max_download_threads > 1:
-        with (
-            concurrent.futures.ThreadPoolExecutor(
-                max_workers=max_processing_threads
-            ) as processing_executor,
-            concurrent.futures.ThreadPoolExecutor(
-                max_workers=max_download_threads
-            ) as download_executor,
-        ):
+    """Downloads archives and extracts and processes their contents.
 
-            def callback(path: Path):
-                processing_executor.submit(process_file, path)
+    Archives are downloaded largest first. The number of concurrent downloads
+    starts halfway between the bounds and adapts to throughput, latency and
+    throttling. If ordered is set, files from later archives in the list
+    overwrite those from earlier ones, exactly as if the archives were extracted
+    one after another, while still downloading in parallel.
 
-            for url in urls:
-                download_executor.submit(download_zip, url, base_path, callback)
-    else:
-        # Ensure each zip is fully processed before moving on to the next one
-        for url in urls:
+    Raises DownloadError if any archive fails, listing those that were not
+    extracted: when downloading in parallel just the failed ones, once the rest
+    are done, and otherwise the failed one and every one after it.
+    """
+    if scheduler is None:
+        with ProcessingScheduler() as new_scheduler:
+            download_zips(
+                items,
+                base_path,
+                max_download_threads,
+                new_scheduler,
+                lazy,
+                ordered,
+                min_download_threads,
+                sync_filter,
+            )
+        return
+    controller = None
+    if max_download_threads > 1:
+        controller = ConcurrencyController(
+            minimum=min(min_download_threads, max_download_threads),
+            maximum=max_download_threads,
+            initial=max(min_download_threads, max_download_threads // 2),
+        )
+    progress = DownloadProgress(items)
+    logger.info(
+        f"Downloading {len(items)} archives ({format_size(progress.total_bytes)})"
+    )
+    with ExtractIndex(base_path) as index:
+        if ordered:
+            download_zips_ordered(
+                items,
+                base_path,
+                max_download_threads,
+                scheduler,
+                index,
+                lazy,
+                progress,
+                controller,
+                sync_filter,
+            )
+        elif max_download_threads > 1:
             with concurrent.futures.ThreadPoolExecutor(
-                max_workers=max_processing_threads
-            ) as processing_executor:
+                max_workers=max_download_threads
+            ) as download_executor:
+                futures = {
+                    download_executor.submit(
+                        download_zip,
+                        item.url,
+                        base_path,
+                        scheduler.submit,
+                        index,
+                        lazy,
+                        progress,
+                        controller,
+                        sync_filter,
+                        item.entry,
+                    ): item
+                    for item in plan_downloads(items)
+                }
+            scheduler.join()
+            failed: list[DownloadItem] = []
+            for future, item in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"Failed to download {item.url}: {e!r}")
+                    failed.append(item)
+            if failed:
+                raise DownloadError(failed)
+        else:
+            # Ensure each zip is fully processed before moving on to the next one
+            for i, item in enumerate(items):
+                try:
+                    download_zip(
+                        item.url,
+                        base_path,
+                        scheduler.submit,
+                        index,
+                        lazy,
+                        progress,
+                        sync_filter=sync_filter,
+                        entry=item.entry,
+                    )
+                except Exception as e:
+                    raise DownloadError(items[i:]) from e
+                scheduler.join()
+
 
-                def callback(path: Path):
-                    processing_executor.submit(process_file, path)
+def download_zips_ordered(
+    items: list[DownloadItem],
+    base_path: Path,
+    max_download_threads: int,
+    scheduler: Scheduler,
+    index: ExtractIndex,
+    lazy: bool = False,
+    progress: DownloadProgress | None = None,
+    controller: ConcurrencyController | None = None,
+    sync_filter: SyncFilter | None = None,
+):
+    """Downloads archives in parallel, then extracts them in order.
 
-                download_zip(url, base_path, callback)
+    Each path is only written and converted once, from the last archive that
+    contains it. If a download fails, the archives before it are still
+    extracted before the error is raised, matching sequential extraction.
+    """
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(max_download_threads, 1)
+    ) as download_executor:
+        submitted = {
+            item: download_executor.submit(
+                fetch_zip, item.url, base_path, progress, controller
+            )
+            for item in plan_downloads(items)
+        }
+        futures = [submitted[item] for item in items]
+        zip_paths: list[Path] = []
+        error: Exception | None = None
+        for item, future in zip(items, futures):
+            try:
+                zip_paths.append(future.result())
+                index.record_archive(
+                    zip_paths[-1].relative_to(base_path).as_posix(),
+                    item.url,
+                    item.entry or None,
+                    zip_paths[-1].stat().st_size,
+                )
+            except Exception as e:
+                error = e
+                for remaining in futures:
+                    remaining.cancel()
+                break
+    owners: dict[str, Path] = {}
+    for zip_path in zip_paths:
+        with zipfile.ZipFile(zip_path) as z:
+            for name in z.namelist():
+                owners[name] = zip_path
+    owned: dict[Path, set[str]] = {zip_path: set() for zip_path in zip_paths}
+    for name, owner in owners.items():
+        owned[owner].add(name)
+    for zip_path in zip_paths:
+        names = owned[zip_path]
+        if not names:
+            logger.info(f"Skipping {zip_path}, all files are overwritten later")
+            continue
+        with zipfile.ZipFile(zip_path) as z:
+            extract_zip(
+                z,
+                zip_path.relative_to(base_path).as_posix(),
+                base_path,
+                scheduler.submit,
+                index,
+                names,
+                lazy,
+                sync_filter,
+            )
+    scheduler.join()
+    if error is not None:
+        raise DownloadError(items[len(zip_paths) :]) from error
@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+import fnmatch
+
+from pydantic import BaseModel, Field, field_validator
+
+
+class SyncFilter(BaseModel):
+    """Selects which dlc categories and extracted paths are synced, and which file
+    types are converted.
+
+    Empty include lists include everything. Path patterns are globs matched
+    against paths as they appear in the archives, e.g. "src/Master/**".
+    """
+
+    include_categories: set[str] = Field(default_factory=set)
+    exclude_categories: set[str] = Field(default_factory=set)
+    include_paths: list[str] = Field(default_factory=list)
+    exclude_paths: list[str] = Field(default_factory=list)
+    # Suffixes, such as ".pvr", that are extracted but not converted
+    skip_conversion: set[str] = Field(default_factory=set)
+
+    @field_validator("skip_conversion")
+    @classmethod
+    def normalize_suffixes(cls, suffixes: set[str]) -> set[str]:
+        # Accept "pvr" and ".PVR" as well as ".pvr"
+        return {"." + suffix.strip().lstrip(".").lower() for suffix in suffixes}
+
+    def includes_category(self, category: str) -> bool:
+        if self.include_categories and category not in self.include_categories:
+            return False
+        return category not in self.exclude_categories
+
+    def includes_path(self, path: str) -> bool:
+        if self.include_paths and not any(
+            fnmatch.fnmatch(path, pattern) for pattern in self.include_paths
+        ):
+            return False
+        return not any(fnmatch.fnmatch(path, pattern) for pattern in self.exclude_paths)
+
+    def converts(self, suffix: str) -> bool:
+        return suffix.lower() not in self.skip_conversion
@@ -9,6 +9,9 @@ from pathlib import Path
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 
+from relive_dm.metrics import metrics
+from relive_dm.processing import NothingToConvert
+
 logger = logging.getLogger(__name__)
 
 
@@ -25,19 +28,25 @@ def pvr_to_png(path: Path, remove_original: bool = False) -> Path | None:
     for _ in range(3):
         try:
             # Sometimes this seems to hang, so there's a timeout
-            return_code = subprocess.call(
-                [
-                    f"{executable}",
-                    "-ics",
-                    "sRGB",
-                    "-f",
-                    "R8G8B8A8",
-                    "-d",
-                    out_path,
-                    "-i",
-                    f"{path}",
-                ],
-                timeout=60,
+            with metrics.timer("relive_dm_subprocess_seconds", tool="PVRTexToolCLI"):
+                return_code = subprocess.call(
+                    [
+                        f"{executable}",
+                        "-ics",
+                        "sRGB",
+                        "-f",
+                        "R8G8B8A8",
+                        "-d",
+                        out_path,
+                        "-i",
+                        f"{path}",
+                    ],
+                    timeout=60,
+                )
+            metrics.inc(
+                "relive_dm_subprocess_total",
+                tool="PVRTexToolCLI",
+                status="ok" if return_code == 0 else "failed",
             )
             if return_code != 0:
                 logger.warning(
@@ -51,8 +60,11 @@ def pvr_to_png(path: Path, remove_original: bool = False) -> Path | None:
                     temp_file_path.unlink()
                 if remove_original:
                     path.unlink()
-                return
+                return out_path
         except subprocess.TimeoutExpired:
+            metrics.inc(
+                "relive_dm_subprocess_total", tool="PVRTexToolCLI", status="timeout"
+            )
             logger.debug("pvr_to_png timed out, retrying")
     logger.warning("pvr_to_png timed out, skipping")
     return None
@@ -71,19 +83,25 @@ def png_to_pvr(path: Path, remove_original: bool = False) -> Path | None:
     for _ in range(3):
         try:
             # Sometimes this seems to hang, so there's a timeout
-            return_code = subprocess.call(
-                [
-                    f"{executable}",
-                    "-f",
-                    "BC3",
-                    "-q",
-                    "pvrtcbest",
-                    "-o",
-                    out_path,
-                    "-i",
-                    f"{path}",
-                ],
-                timeout=60,
+            with metrics.timer("relive_dm_subprocess_seconds", tool="PVRTexToolCLI"):
+                return_code = subprocess.call(
+                    [
+                        f"{executable}",
+                        "-f",
+                        "BC3",
+                        "-q",
+                        "pvrtcbest",
+                        "-o",
+                        out_path,
+                        "-i",
+                        f"{path}",
+                    ],
+                    timeout=60,
+                )
+            metrics.inc(
+                "relive_dm_subprocess_total",
+                tool="PVRTexToolCLI",
+                status="ok" if return_code == 0 else "failed",
             )
             if return_code != 0:
                 logger.warning(
@@ -94,8 +112,11 @@ def png_to_pvr(path: Path, remove_original: bool = False) -> Path | None:
                 logger.info(f"Converted {path} to {out_path}")
                 if remove_original:
                     path.unlink()
-                return
+                return out_path
         except subprocess.TimeoutExpired:
+            metrics.inc(
+                "relive_dm_subprocess_total", tool="PVRTexToolCLI", status="timeout"
+            )
             logger.debug("png_to_pvr timed out, retrying")
     logger.warning("png_to_pvr timed out, skipping")
     return None
@@ -148,21 +169,54 @@ ivs = [
 ]
 
 
+def decode_pvr(data: bytes) -> bytes:
+    """Decrypts and decompresses the contents of a downloaded .pvr file.
+
+    Returns the data unchanged if it is not gzip compressed.
+    """
+    if not data:
+        return data
+    decrypted = data
+    footer = data[-8:]
+    if footer.startswith(b"CRPT"):
+        key_ind = footer[5]
+        key = keys[key_ind]
+        iv = ivs[key_ind]
+        cipher = Cipher(
+            algorithms.AES(key), modes.CBC(iv), backend=default_backend()
+        ).decryptor()
+        decrypted = cipher.update(data[:128]) + data[128:-8]
+    out = BytesIO()
+    if try_decompress(BytesIO(decrypted), out):
+        return out.getvalue()
+    return data
+
+
+def encode_pvr(data: bytes, key_index: int | None = None) -> bytes:
+    """Compresses a .pvr file and, if a key index is given, encrypts it, the
+    reverse of decode_pvr."""
+    data = gzip.compress(data)
+    if key_index is None:
+        return data
+    if len(data) < 128:
+        raise ValueError("Data is too short to encrypt")
+    cipher = Cipher(
+        algorithms.AES(keys[key_index]),
+        modes.CBC(ivs[key_index]),
+        backend=default_backend(),
+    ).encryptor()
+    footer = b"CRPT" + bytes([0, key_index, 0, 0])
+    return cipher.update(data[:128]) + data[128:] + footer
+
+
 def process_pvr(path: Path, remove_original: bool = False) -> Path | None:
-    with path.open("rb+") as f:
-        data = f.read()
-        if not data:
-            return None
-        footer = data[-8:]
-        if footer.startswith(b"CRPT"):
-            key_ind = footer[5]
-            key = keys[key_ind]
-            iv = ivs[key_ind]
-            cipher = Cipher(
-                algorithms.AES(key), modes.CBC(iv), backend=default_backend()
-            ).decryptor()
-            data = cipher.update(data[:128]) + data[128:-8]
-        f.seek(0)
-        if try_decompress(BytesIO(data), f):
-            f.truncate()
+    data = path.read_bytes()
+    if not data:
+        raise NothingToConvert(f"{path} is empty")
+    # Decoded in place on every platform, since verify expects decoded files
+    decoded = decode_pvr(data)
+    if decoded is not data:
+        path.write_bytes(decoded)
+    if platform.system() not in ("Windows", "Linux"):
+        raise NothingToConvert("pvr_to_png is not supported on this platform")
     return pvr_to_png(path, remove_original)
@@ -0,0 +1,400 @@
+from __future__ import annotations
+
+import concurrent.futures
+import logging
+import sqlite3
+import threading
+import time
+import zipfile
+from pathlib import Path
+from typing import NamedTuple
+
+from relive_dm.processing import NothingToConvert
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE_NAME = "extract_index.sqlite3"
+
+
+class CatalogEntry(NamedTuple):
+    server: str
+    path: str
+    source: str
+    # Patch or dlc entry the source archive was downloaded for, if recorded
+    entry: str | None
+    crc: int
+    size: int
+    status: str
+    output: str | None
+
+
+def prefix_bounds(prefix: str) -> tuple[str, str]:
+    """Returns bounds such that lower <= path < upper exactly when path starts
+    with prefix, so prefix queries can use the primary key index."""
+    if not prefix:
+        return "", "\U0010ffff"
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class ExtractIndex:
+    """Records what was extracted from each archive and whether it was converted,
+    serving as the catalog of a server's assets.
+
+    Paths are stored relative to the base path, as they appear in the zip. The
+    CRC32 and size come from the zip's central directory, so a member can be
+    compared against the index without reading or decompressing it. Each
+    downloaded archive is recorded with the url and patch or dlc entry it came
+    from.
+
+    Status is one of "pending" (written but not yet processed), "done"
+    (processed, or no processing needed), "failed", "unconvertible" (its
+    processor can never convert it, see NothingToConvert), "skipped" (written,
+    but conversion of its file type was turned off), "virtual" (left in the
+    archive and read on demand, see relive_dm.vfs) or "excluded" (left in the
+    archive by a sync filter).
+
+    Once a file is processed, the size and mtime of the file and of its output
+    are recorded as its stamp, so a file is only considered current while both
+    are as they were left.
+    """
+
+    def __init__(self, base_path: Path):
+        self.base_path = base_path
+        base_path.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            base_path / INDEX_FILE_NAME, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                crc INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                output TEXT,
+                stamp TEXT
+            )
+            """
+        )
+        columns = {
+            row[1] for row in self._connection.execute("PRAGMA table_info(files)")
+        }
+        if "stamp" not in columns:
+            self._connection.execute("ALTER TABLE files ADD COLUMN stamp TEXT")
+        new_catalog = (
+            self._connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'archives'"
+            ).fetchone()
+            is None
+        )
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS archives (
+                source TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                entry TEXT,
+                size INTEGER NOT NULL,
+                downloaded REAL NOT NULL
+            )
+            """
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        if new_catalog:
+            # Archives already in the tree were extracted without being cataloged
+            cataloged = not (base_path / "raw").exists()
+            self._set_meta("cataloged", "1" if cataloged else "0")
+
+    @property
+    def server(self) -> str:
+        return self.base_path.name
+
+    def get(self, path: str) -> tuple[str, int, int, str, str | None] | None:
+        """Returns (source, crc, size, status, output) for a path."""
+        with self._lock:
+            return self._connection.execute(
+                "SELECT source, crc, size, status, output FROM files WHERE path = ?",
+                (path,),
+            ).fetchone()
+
+    def entries(self) -> list[tuple[str, str, int, int, str, str | None]]:
+        """Returns (path, source, crc, size, status, output) for every path."""
+        with self._lock:
+            return self._connection.execute(
+                "SELECT path, source, crc, size, status, output FROM files"
+            ).fetchall()
+
+    def crcs(self, prefix: str = "") -> dict[str, int]:
+        """Returns the CRC of every path starting with prefix."""
+        with self._lock:
+            return dict(
+                self._connection.execute(
+                    "SELECT path, crc FROM files WHERE path >= ? AND path < ?",
+                    prefix_bounds(prefix),
+                ).fetchall()
+            )
+
+    def paths(
+        self, prefix: str = "", suffix: str = "", extracted: bool = True
+    ) -> list[str]:
+        """Returns the paths starting with prefix and ending with suffix, by
+        default only those present in the tree."""
+        query = "SELECT path FROM files WHERE path >= ? AND path < ?"
+        if extracted:
+            query += " AND status NOT IN ('virtual', 'excluded')"
+        with self._lock:
+            rows = self._connection.execute(query, prefix_bounds(prefix)).fetchall()
+        return [path for (path,) in rows if path.endswith(suffix)]
+
+    def catalog(self, prefix: str = "") -> list[CatalogEntry]:
+        """Returns every path starting with prefix with its archive and entry."""
+        with self._lock:
+            rows = self._connection.execute(
+                """
+                SELECT files.path, files.source, archives.entry, files.crc,
+                    files.size, files.status, files.output
+                FROM files LEFT JOIN archives ON files.source = archives.source
+                WHERE files.path >= ? AND files.path < ?
+                ORDER BY files.path
+                """,
+                prefix_bounds(prefix),
+            ).fetchall()
+        return [CatalogEntry(self.server, *row) for row in rows]
+
+    def record_archive(
+        self,
+        source: str,
+        url: str,
+        entry: str | None,
+        size: int,
+        downloaded: float | None = None,
+    ):
+        """Records a downloaded archive. Archives must be recorded in the order they
+        are extracted, as that decides which archive a path comes from."""
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO archives VALUES (?, ?, ?, ?, ?)",
+                (source, url, entry, size, downloaded or time.time()),
+            )
+
+    def archives(self) -> list[tuple[str, str, str | None, int]]:
+        """Returns (source, url, entry, size) for every downloaded archive, in the
+        order they were extracted."""
+        with self._lock:
+            return self._connection.execute(
+                """
+                SELECT source, url, entry, size FROM archives
+                ORDER BY downloaded, rowid
+                """
+            ).fetchall()
+
+    def ensure_catalog(self):
+        """Catalogs the archives of a tree extracted before archives were recorded.
+
+        Only the first call on such a tree reads the archives. Members missing
+        from the index are recorded as pending if they are in the tree.
+        """
+        if self._get_meta("cataloged") == "1":
+            return
+        logger.info(f"Cataloging existing archives in {self.base_path}")
+        recorded = {source for source, *_ in self.archives()}
+        for zip_path in self._unrecorded_archives(recorded):
+            stat = zip_path.stat()
+            # The url isn't known, only the path it was saved under, and archives
+            # were downloaded one at a time back then, so mtime gives their order
+            self.record_archive(
+                zip_path.relative_to(self.base_path).as_posix(),
+                "",
+                None,
+                stat.st_size,
+                stat.st_mtime,
+            )
+        for path, (source, info, status) in self.find_archive_members().items():
+            if status is None and (self.base_path / path).exists():
+                self.mark_extracted(path, source, info.CRC, info.file_size)
+        self._set_meta("cataloged", "1")
+
+    def applied_sync_filter(self) -> str | None:
+        """Returns the sync filter, as JSON, that the archives in the tree were
+        last re-extracted with."""
+        return self._get_meta("sync_filter")
+
+    def record_applied_sync_filter(self, sync_filter: str):
+        self._set_meta("sync_filter", sync_filter)
+
+    def is_current(self, path: str, crc: int, size: int, convert: bool = True) -> bool:
+        """Whether the path was already extracted with these contents and, if
+        convert is set, converted."""
+        with self._lock:
+            entry = self._connection.execute(
+                "SELECT crc, size, status, output, stamp FROM files WHERE path = ?",
+                (path,),
+            ).fetchone()
+        if entry is None:
+            return False
+        indexed_crc, indexed_size, status, output, stamp = entry
+        if not (
+            indexed_crc == crc
+            and indexed_size == size
+            and (
+                status in ("done", "unconvertible")
+                or (status == "skipped" and not convert)
+            )
+        ):
+            return False
+        if stamp is None:
+            # Indexed before stamps were recorded
+            return (self.base_path / path).exists() and (
+                output is None or (self.base_path / output).exists()
+            )
+        return stamp == self._stamp(path, output)
+
+    def mark_extracted(self, path: str, source: str, crc: int, size: int):
+        self._insert(path, source, crc, size, "pending")
+
+    def mark_virtual(self, path: str, source: str, crc: int, size: int):
+        self._insert(path, source, crc, size, "virtual")
+
+    def mark_excluded(self, path: str, source: str, crc: int, size: int):
+        self._insert(path, source, crc, size, "excluded")
+
+    def mark_skipped(self, path: str):
+        self._set_status(path, "skipped", None)
+
+    def mark_processed(self, path: str, output: Path | None):
+        self._set_status(
+            path, "done", output and output.relative_to(self.base_path).as_posix()
+        )
+
+    def mark_unconvertible(self, path: str):
+        self._set_status(path, "unconvertible", None)
+
+    def mark_failed(self, path: str):
+        with self._lock:
+            self._connection.execute(
+                "UPDATE files SET status = 'failed', stamp = NULL WHERE path = ?",
+                (path,),
+            )
+
+    def track(self, path: str, result: concurrent.futures.Future | None):
+        """Updates the status of a path once its processing job, if any, completes."""
+        if result is None:
+            self.mark_processed(path, None)
+            return
+
+        def on_done(future: concurrent.futures.Future):
+            if future.cancelled():
+                self.mark_failed(path)
+            elif isinstance(future.exception(), NothingToConvert):
+                self.mark_unconvertible(path)
+            elif future.exception() is not None:
+                self.mark_failed(path)
+            elif future.result() is None:
+                # Processors return None when conversion failed
+                self.mark_failed(path)
+            else:
+                self.mark_processed(path, future.result())
+
+        result.add_done_callback(on_done)
+
+    def find_archive_members(
+        self,
+    ) -> dict[str, tuple[str, zipfile.ZipInfo, str | None]]:
+        """Maps each path to the raw archive member that last wrote it.
+
+        Returns (source, info, status) per path, where status is None for paths
+        missing from the index. Those are attributed to the last archive
+        containing them in the order archives were recorded, after any archives
+        that predate the catalog.
+        """
+        owners: dict[str, tuple[str, zipfile.ZipInfo, str | None]] = {}
+        recorded = [source for source, *_ in self.archives()]
+        zip_paths = self._unrecorded_archives(set(recorded)) + [
+            path for source in recorded if (path := self.base_path / source).exists()
+        ]
+        infos: dict[str, dict[str, zipfile.ZipInfo]] = {}
+        for zip_path in zip_paths:
+            source = zip_path.relative_to(self.base_path).as_posix()
+            try:
+                with zipfile.ZipFile(zip_path) as z:
+                    infos[source] = {
+                        info.filename: info
+                        for info in z.infolist()
+                        if not info.is_dir()
+                    }
+            except zipfile.BadZipFile:
+                logger.warning(f"Skipping corrupt archive {zip_path}")
+                continue
+            for name, info in infos[source].items():
+                owners[name] = (source, info, None)
+        for path, source, _, _, status, _ in self.entries():
+            if source in infos and path in infos[source]:
+                owners[path] = (source, infos[source][path], status)
+        return owners
+
+    def _unrecorded_archives(self, recorded: set[str]) -> list[Path]:
+        """Returns the archives under raw missing from the catalog, oldest first."""
+        zip_paths = [
+            path
+            for path in (self.base_path / "raw").glob("**/*.zip")
+            if path.relative_to(self.base_path).as_posix() not in recorded
+        ]
+        return sorted(zip_paths, key=lambda p: p.stat().st_mtime)
+
+    def _insert(self, path: str, source: str, crc: int, size: int, status: str):
+        with self._lock:
+            self._connection.execute(
+                """
+                INSERT OR REPLACE INTO files (path, source, crc, size, status)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (path, source, crc, size, status),
+            )
+
+    def _set_status(self, path: str, status: str, output: str | None):
+        stamp = self._stamp(path, output)
+        with self._lock:
+            self._connection.execute(
+                "UPDATE files SET status = ?, output = ?, stamp = ? WHERE path = ?",
+                (status, output, stamp, path),
+            )
+
+    def _stamp(self, path: str, output: str | None) -> str:
+        """Returns the size and mtime of a file and its output, if any."""
+        parts = []
+        for relative in [path] if output is None else [path, output]:
+            try:
+                stat = (self.base_path / relative).stat()
+            except FileNotFoundError:
+                parts.append("missing")
+            else:
+                parts.append(f"{stat.st_size}:{stat.st_mtime_ns}")
+        return "|".join(parts)
+
+    def _get_meta(self, key: str) -> str | None:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM meta WHERE key = ?", (key,)
+            ).fetchone()
+        return row and row[0]
+
+    def _set_meta(self, key: str, value: str):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value)
+            )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def __enter__(self) -> ExtractIndex:
+        return self
+
+    def __exit__(self, *args):
+        self.close()
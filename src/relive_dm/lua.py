@@ -5,13 +5,23 @@ import logging
 import struct
 from io import BytesIO
 from pathlib import Path
-from typing import TypeAlias
+from typing import Generator, Iterator, TypeAlias
 
 from relive_dm.xxtea import decrypt_xxtea_if_header
 
 logger = logging.getLogger(__name__)
 
 LuaValue: TypeAlias = bool | int | float | str | dict["LuaValue", "LuaValue"] | None
+# Keys of tables that can be streamed, see Prototype.stream_items
+LuaKey: TypeAlias = bool | int | float | str
+
+# Longer strings are rarely repeated, so they are not worth interning
+INTERN_MAX_LENGTH = 64
+
+# Instructions that overwrite their A slot
+_SLOT_WRITES = frozenset({0x27, 0x28, 0x29, 0x2A, 0x2B, 0x34, 0x35})
+# Instructions that set a key of the table in their B slot
+_TABLE_SETS = frozenset({0x3C, 0x3D, 0x3E})
 
 
 def process_lua(path: Path) -> Path | None:
@@ -26,11 +36,27 @@ def process_lua(path: Path) -> Path | None:
         return None
 
 
-def read_lua_table(data: bytes) -> LuaValue:
+class StreamError(Exception):
+    """The entries of a table cannot be yielded in their final form and order."""
+
+
+def read_lua_table(data: bytes, strings: dict[str, str] | None = None) -> LuaValue:
+    """Decodes LuaJIT bytecode returning a table.
+
+    Repeated strings such as keys and enum-like values are interned, through
+    strings if given so that several tables can share them. Tables that are
+    never changed after being copied from a constant template share the
+    template, so the result must not be changed in place.
+    """
+    return read_lua_prototype(data, strings).run()
+
+
+def read_lua_prototype(data: bytes, strings: dict[str, str] | None = None) -> Prototype:
+    """Parses LuaJIT bytecode without running it, see read_lua_table."""
     data = decrypt_xxtea_if_header(data)
     bio = BytesIO(data)
     skip_header(bio)
-    return get_prototype(bio).run()
+    return get_prototype(bio, {} if strings is None else strings)
 
 
 def skip_header(bio: BytesIO):
@@ -45,7 +71,7 @@ def skip_header(bio: BytesIO):
         raise ValueError("Invalid flags")
 
 
-def get_prototype(bio: BytesIO) -> Prototype:
+def get_prototype(bio: BytesIO, strings: dict[str, str] | None = None) -> Prototype:
     _size = get_uleb128(bio)
     _flags = bio.read(1)[0]
     argument_count = bio.read(1)[0]
@@ -63,7 +89,7 @@ def get_prototype(bio: BytesIO) -> Prototype:
         for _ in range(instructions_count)
     ]
     complex_constants = [
-        get_complex_constant(bio) for _ in range(complex_constant_count)
+        get_complex_constant(bio, strings) for _ in range(complex_constant_count)
     ]
     numeric_constants = [
         get_numeric_constant(bio) for _ in range(numeric_constant_count)
@@ -84,10 +110,76 @@ class Prototype:
         self.complex_constants = complex_constants
         self.numeric_constants = numeric_constants
 
-    def run(self):
+    def shared_templates(self) -> set[int]:
+        """Returns the indices of TDUP instructions whose table is never changed
+        afterwards, so it can be the constant template itself rather than a copy.
+
+        Only the slot a table is created in can refer to it, since instructions
+        that copy or read slots are not supported, so a table is changed only by
+        setting keys through that slot before it is overwritten.
+        """
+        shared = set()
+        # Slot -> index of the TDUP whose table the slot holds
+        pending: dict[int, int] = {}
+        for i, instr in enumerate(self.instructions):
+            op = instr.op
+            if op in _TABLE_SETS:
+                pending.pop(instr.b, None)
+            elif op in _SLOT_WRITES:
+                if instr.a in pending:
+                    shared.add(pending.pop(instr.a))
+                if op == 0x35:
+                    pending[instr.a] = i
+        shared.update(pending.values())
+        return shared
+
+    def run(self) -> LuaValue:
+        try:
+            next(self._execute(stream=False))
+        except StopIteration as stop:
+            return stop.value
+        raise AssertionError("Entries are only yielded when streaming")
+
+    def stream_items(self) -> Iterator[tuple[LuaKey, LuaValue]]:
+        """Runs the bytecode, yielding each entry of the returned table as soon as
+        it is set instead of building the table.
+
+        Raises StreamError if entries could not be yielded in their final form
+        and order: if keys are not set in ascending order, which also rules out
+        a key being set twice, or if a yielded table is changed afterwards.
+        Entries yielded before the error are then incomplete.
+        """
+        yield from self._execute(stream=True)
+
+    def _returned_table(self) -> tuple[int, int]:
+        """Returns the slot of the returned table and the index of the instruction
+        that creates it."""
+        for ret_index, instr in enumerate(self.instructions):
+            if instr.op == 0x4C:
+                break
+        else:
+            raise ValueError("No return statement")
+        for i in range(ret_index - 1, -1, -1):
+            created = self.instructions[i]
+            if created.op in _SLOT_WRITES and created.a == instr.a:
+                if created.op in (0x34, 0x35):
+                    return instr.a, i
+                break
+        raise StreamError("Only tables can be streamed")
+
+    def _execute(
+        self, stream: bool
+    ) -> Generator[tuple[LuaKey, LuaValue], None, LuaValue]:
         slot: list[LuaValue] = [None] * self.frame_size
         cc = len(self.complex_constants) - 1
-        for instr in self.instructions:
+        shared = self.shared_templates()
+        out_slot, out_index = self._returned_table() if stream else (-1, -1)
+        # Slots holding tables that may be part of an entry already yielded
+        frozen: set[int] = set()
+        keys = _AscendingKeys()
+        for i, instr in enumerate(self.instructions):
+            if frozen and instr.op in _SLOT_WRITES:
+                frozen.discard(instr.a)
             match instr.op:
                 case 0x27 | 0x28:
                     slot[instr.a] = self.complex_constants[cc - instr.d]
@@ -110,19 +202,32 @@ class Prototype:
                 case 0x35:
                     value = self.complex_constants[cc - instr.d]
                     assert isinstance(value, dict)
-                    slot[instr.a] = value.copy()
-                case 0x3C:
-                    target = slot[instr.b]
-                    assert isinstance(target, dict)
-                    target[slot[instr.c]] = slot[instr.a]
-                case 0x3D:
-                    target = slot[instr.b]
-                    assert isinstance(target, dict)
-                    target[self.complex_constants[cc - instr.c]] = slot[instr.a]
-                case 0x3E:
+                    if i == out_index:
+                        for key, item in value.items():
+                            yield keys.check(key), item
+                        slot[instr.a] = {}
+                    else:
+                        slot[instr.a] = value if i in shared else value.copy()
+                case 0x3C | 0x3D | 0x3E as op:
+                    if op == 0x3C:
+                        key = slot[instr.c]
+                    elif op == 0x3D:
+                        key = self.complex_constants[cc - instr.c]
+                    else:
+                        key = instr.c
+                    if instr.b == out_slot and i > out_index:
+                        yield keys.check(key), slot[instr.a]
+                        frozen = {
+                            s
+                            for s, value in enumerate(slot)
+                            if isinstance(value, dict) and s != out_slot
+                        }
+                        continue
+                    if instr.b in frozen:
+                        raise StreamError("A table was changed after being yielded")
                     target = slot[instr.b]
                     assert isinstance(target, dict)
-                    target[instr.c] = slot[instr.a]
+                    target[key] = slot[instr.a]
                 case 0x4C:
                     return slot[instr.a]
                 case _:
@@ -132,7 +237,28 @@ class Prototype:
         raise ValueError("No return statement")
 
 
+class _AscendingKeys:
+    def __init__(self):
+        self.last: LuaValue = None
+        self.seen = False
+
+    def check(self, key: LuaValue) -> LuaKey:
+        if not isinstance(key, (bool, int, float, str)):
+            raise StreamError(f"Key {key!r} can't be streamed")
+        try:
+            ascending = not self.seen or key > self.last  # type: ignore[operator]
+        except TypeError:
+            ascending = False
+        if not ascending:
+            raise StreamError(f"Key {key!r} is not in ascending order")
+        self.last = key
+        self.seen = True
+        return key
+
+
 class LuaInstruction:
+    __slots__ = ("value",)
+
     def __init__(self, value: int):
         self.value = value
 
@@ -157,12 +283,14 @@ class LuaInstruction:
         return (self.value >> 16) & 0xFFFF
 
 
-def get_complex_constant(bio: BytesIO) -> LuaValue:
+def get_complex_constant(
+    bio: BytesIO, strings: dict[str, str] | None = None
+) -> LuaValue:
     match get_uleb128(bio):
         case 0:
             raise NotImplementedError("Child prototypes are not supported")
         case 1:
-            return get_table(bio)
+            return get_table(bio, strings)
         case 2:
             return get_long(bio)
         case 3:
@@ -170,25 +298,27 @@ def get_complex_constant(bio: BytesIO) -> LuaValue:
         case 4:
             raise NotImplementedError("Complex numbers are not supported")
         case n:
-            return get_string(bio, n - 5)
+            return get_string(bio, n - 5, strings)
 
 
-def get_table(bio: BytesIO) -> dict[LuaValue, LuaValue]:
+def get_table(
+    bio: BytesIO, strings: dict[str, str] | None = None
+) -> dict[LuaValue, LuaValue]:
     array_count = get_uleb128(bio)
     hash_count = get_uleb128(bio)
     table = {}
     for i in range(array_count):
-        next_item = get_table_item(bio)
+        next_item = get_table_item(bio, strings)
         if next_item is not None:
             table[i] = next_item
     for i in range(hash_count):
-        key = get_table_item(bio)
-        value = get_table_item(bio)
+        key = get_table_item(bio, strings)
+        value = get_table_item(bio, strings)
         table[key] = value
     return table
 
 
-def get_table_item(bio: BytesIO) -> LuaValue:
+def get_table_item(bio: BytesIO, strings: dict[str, str] | None = None) -> LuaValue:
     match get_uleb128(bio):
         case 0:
             return None
@@ -201,24 +331,33 @@ def get_table_item(bio: BytesIO) -> LuaValue:
         case 4:
             return get_double(bio)
         case n:
-            return get_string(bio, n - 5)
+            return get_string(bio, n - 5, strings)
 
 
 def get_numeric_constant(bio: BytesIO) -> int | float:
     part = get_uleb128(bio)
     if (part & 1) == 0:
-        return part >> 1
+        return _int32(part >> 1)
     else:
         bits = get_uleb128(bio) << 32 | part >> 1
         return struct.unpack("<d", struct.pack("<Q", bits))[0]
 
 
-def get_string(bio: BytesIO, length: int) -> str:
-    return bio.read(length).decode("utf-8")
+def get_string(bio: BytesIO, length: int, strings: dict[str, str] | None = None) -> str:
+    value = bio.read(length).decode("utf-8")
+    if strings is None or length > INTERN_MAX_LENGTH:
+        return value
+    return strings.setdefault(value, value)
 
 
 def get_int(bio: BytesIO) -> int:
-    return get_uleb128(bio)
+    return _int32(get_uleb128(bio))
+
+
+def _int32(value: int) -> int:
+    # LuaJIT stores integer constants as signed 32-bit values, so -70000 is
+    # 0xFFFEEE90 and must not be read as 4294897296
+    return struct.unpack("<i", struct.pack("<I", value & 0xFFFFFFFF))[0]
 
 
 def get_double(bio: BytesIO) -> float:
@@ -249,3 +388,174 @@ def get_uleb128(bio: BytesIO) -> int:
             break
         shift += 7
     return result
+
+
+def dump_lua_table(value: LuaValue) -> bytes:
+    """Serializes a value as LuaJIT bytecode returning it, the reverse of
+    read_lua_table.
+
+    Only the subset of bytecode read_lua_table understands is emitted. Tables
+    are built from a TDUP template holding their constant entries, with nested
+    tables and other non-constant entries set afterwards. Integers outside the
+    range of a signed 32-bit value are not supported.
+    """
+    emitter = _Emitter()
+    emitter.emit_value(value, 0)
+    emitter.instructions.append((0x4C, 0, 0, 0, None, None))
+    return emitter.dump()
+
+
+def _is_constant_item(value: LuaValue) -> bool:
+    if isinstance(value, bool) or value is None:
+        return True
+    if isinstance(value, int):
+        return _is_int32(value)
+    return isinstance(value, (float, str))
+
+
+def _is_int32(value: int) -> bool:
+    return -(1 << 31) <= value < 1 << 31
+
+
+class _Emitter:
+    def __init__(self):
+        # (op, a, b, c, d, constant index), with d None for ABC instructions
+        self.instructions: list[tuple[int, int, int, int, int | None, int | None]] = []
+        self.complex_constants: list[LuaValue] = []
+        self.numeric_constants: list[int | float] = []
+        self._string_indices: dict[str, int] = {}
+        self.frame_size = 1
+
+    def string_constant(self, value: str) -> int:
+        if value not in self._string_indices:
+            self._string_indices[value] = len(self.complex_constants)
+            self.complex_constants.append(value)
+        return self._string_indices[value]
+
+    def emit_value(self, value: LuaValue, slot: int):
+        self.frame_size = max(self.frame_size, slot + 1)
+        if slot > 0xFF:
+            raise ValueError("Table nesting is too deep")
+        if isinstance(value, dict):
+            self.emit_table(value, slot)
+        elif value is None:
+            self.instructions.append((0x2B, slot, 0, 0, 0, None))
+        elif isinstance(value, bool):
+            self.instructions.append((0x2B, slot, 0, 0, 2 if value else 1, None))
+        elif isinstance(value, int) and -0x8000 <= value < 0x8000:
+            self.instructions.append((0x29, slot, 0, 0, value & 0xFFFF, None))
+        elif isinstance(value, (int, float)):
+            if isinstance(value, int) and not _is_int32(value):
+                raise ValueError(f"Integer {value} is out of range")
+            self.numeric_constants.append(value)
+            self.instructions.append(
+                (0x2A, slot, 0, 0, len(self.numeric_constants) - 1, None)
+            )
+        elif isinstance(value, str):
+            self.instructions.append(
+                (0x27, slot, 0, 0, None, self.string_constant(value))
+            )
+        else:
+            raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+    def emit_table(self, table: dict[LuaValue, LuaValue], slot: int):
+        template: dict[LuaValue, LuaValue] = {
+            k: v
+            for k, v in table.items()
+            if v is not None and _is_constant_item(k) and _is_constant_item(v)
+        }
+        if template:
+            self.complex_constants.append(template)
+            self.instructions.append(
+                (0x35, slot, 0, 0, None, len(self.complex_constants) - 1)
+            )
+        else:
+            self.instructions.append((0x34, slot, 0, 0, 0, None))
+        for key, value in table.items():
+            if key in template or value is None:
+                continue
+            self.emit_value(value, slot + 1)
+            if isinstance(key, int) and not isinstance(key, bool) and 0 <= key <= 0xFF:
+                self.instructions.append((0x3E, slot + 1, slot, key, None, None))
+            elif isinstance(key, str) and self.string_constant(key) <= 0xFF:
+                self.instructions.append(
+                    (0x3D, slot + 1, slot, 0, None, self.string_constant(key))
+                )
+            else:
+                self.emit_value(key, slot + 2)
+                self.instructions.append((0x3C, slot + 1, slot, slot + 2, None, None))
+
+    def dump(self) -> bytes:
+        # Constants are referenced counting back from the last one in the dump,
+        # so writing them in reverse makes each reference equal to its index
+        constants = self.complex_constants[::-1]
+        body = bytearray()
+        body.append(0)  # flags
+        body.append(0)  # argument count
+        body.append(self.frame_size)
+        body.append(0)  # up value count
+        body += _uleb128(len(constants))
+        body += _uleb128(len(self.numeric_constants))
+        body += _uleb128(len(self.instructions))
+        for op, a, b, c, d, constant in self.instructions:
+            if constant is not None:
+                if op == 0x3D:
+                    c = constant
+                else:
+                    d = constant
+            if d is not None:
+                b, c = d >> 8, d & 0xFF
+            body += struct.pack("<BBBB", op, a, c, b)
+        for constant in constants:
+            body += _dump_complex_constant(constant)
+        for constant in self.numeric_constants:
+            body += _dump_numeric_constant(constant)
+        return b"\x1bLJ\x02" + _uleb128(0x2) + _uleb128(len(body)) + bytes(body)
+
+
+def _dump_complex_constant(value: LuaValue) -> bytes:
+    if isinstance(value, dict):
+        out = bytearray(_uleb128(1))
+        out += _uleb128(0)  # array part
+        out += _uleb128(len(value))
+        for k, v in value.items():
+            out += _dump_table_item(k)
+            out += _dump_table_item(v)
+        return bytes(out)
+    assert isinstance(value, str)
+    encoded = value.encode("utf-8")
+    return _uleb128(len(encoded) + 5) + encoded
+
+
+def _dump_table_item(value: LuaValue) -> bytes:
+    if value is None:
+        return _uleb128(0)
+    if isinstance(value, bool):
+        return _uleb128(2 if value else 1)
+    if isinstance(value, int):
+        return _uleb128(3) + _uleb128(value & 0xFFFFFFFF)
+    if isinstance(value, float):
+        bits = struct.unpack("<Q", struct.pack("<d", value))[0]
+        return _uleb128(4) + _uleb128(bits & 0xFFFFFFFF) + _uleb128(bits >> 32)
+    assert isinstance(value, str)
+    encoded = value.encode("utf-8")
+    return _uleb128(len(encoded) + 5) + encoded
+
+
+def _dump_numeric_constant(value: int | float) -> bytes:
+    if isinstance(value, int):
+        return _uleb128((value & 0xFFFFFFFF) << 1)
+    bits = struct.unpack("<Q", struct.pack("<d", value))[0]
+    return _uleb128(((bits & 0xFFFFFFFF) << 1) | 1) + _uleb128(bits >> 32)
+
+
+def _uleb128(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
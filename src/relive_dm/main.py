@@ -1,17 +1,340 @@
+from __future__ import annotations
+
+import contextlib
+import functools
 import logging
+import sys
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import typer
+from typer.core import TyperGroup
 
 from relive_dm.server import download_all, servers
 
-app = typer.Typer()
+if TYPE_CHECKING:
+    from importlib.metadata import EntryPoint
+
+logger = logging.getLogger(__name__)
+
+
+@functools.cache
+def plugin_commands() -> dict[str, EntryPoint]:
+    from importlib.metadata import entry_points
+
+    return {
+        entry_point.name: entry_point
+        for entry_point in entry_points(group="relive_dm.commands")
+    }
+
+
+def load_plugin_command(name: str):
+    """Loads a command registered under the "relive_dm.commands" entry point group.
+
+    The entry point name is the command name and its value a function, which
+    becomes the command as with @app.command(), or a Typer app.
+    """
+    entry_point = plugin_commands().get(name)
+    if entry_point is None:
+        return None
+    command = entry_point.load()
+    if not isinstance(command, typer.Typer):
+        if not callable(command):
+            raise TypeError(f"Entry point {entry_point.value} is not a command")
+        plugin_app = typer.Typer()
+        plugin_app.command(name)(command)
+        command = plugin_app
+    click_command = typer.main.get_command(command)
+    click_command.name = name
+    return click_command
+
+
+class PluginGroup(TyperGroup):
+    """Adds plugin commands, which are only imported once they are run or help
+    is shown."""
+
+    def list_commands(self, ctx) -> list[str]:
+        names = super().list_commands(ctx)
+        return names + sorted(name for name in plugin_commands() if name not in names)
+
+    def get_command(self, ctx, cmd_name: str):
+        command = super().get_command(ctx, cmd_name)
+        if command is None:
+            command = load_plugin_command(cmd_name)
+            if command is not None:
+                self.add_command(command, cmd_name)
+        return command
+
+
+app = typer.Typer(cls=PluginGroup)
+
+
+@app.command()
+def download(
+    path: Path = Path("assets"),
+    patch: bool = True,
+    dlc: bool = True,
+    lazy: bool = False,
+    dry_run: bool = False,
+    min_downloads: int | None = None,
+    max_downloads: int | None = None,
+    include_category: list[str] = typer.Option([], help="DLC categories to sync"),
+    exclude_category: list[str] = typer.Option([], help="DLC categories to skip"),
+    include_path: list[str] = typer.Option([], help="Globs of paths to extract"),
+    exclude_path: list[str] = typer.Option([], help="Globs of paths to skip"),
+    skip_conversion: list[str] = typer.Option(
+        [], help="Suffixes to extract without converting, e.g. .pvr"
+    ),
+    metrics_file: Path | None = typer.Option(
+        None, help="Prometheus textfile to update with pipeline metrics"
+    ),
+    metrics_interval: float = 15.0,
+    report: Path | None = typer.Option(
+        None, help="JSON run report, defaults to run_report.json under path"
+    ),
+    profile: bool = typer.Option(
+        False, help="Profile each pipeline stage and report the slowest files"
+    ),
+    profile_dir: Path | None = typer.Option(
+        None, help="Where to write profiles, defaults to profile under path"
+    ),
+    queue: bool = typer.Option(
+        False, help="Queue conversions for `relive-dm worker` processes"
+    ),
+    image_variants: bool = typer.Option(
+        False, help="Make thumbnails and WebP copies of converted images"
+    ),
+):
+    from relive_dm.filters import SyncFilter
+    from relive_dm.metrics import MetricsExporter
+    from relive_dm.profiling import PipelineProfiler
+
+    logging.basicConfig(level=logging.INFO)
+    sync_filter = SyncFilter(
+        include_categories=set(include_category),
+        exclude_categories=set(exclude_category),
+        include_paths=include_path,
+        exclude_paths=exclude_path,
+        skip_conversion=set(skip_conversion),
+    )
+    if report is None and not dry_run:
+        report = path / "run_report.json"
+    if image_variants:
+        from relive_dm.variants import require_pillow
+
+        # Fail before downloading rather than after
+        try:
+            require_pillow()
+        except RuntimeError as e:
+            raise typer.BadParameter(str(e))
+    profiler = PipelineProfiler() if profile else None
+    work_queue = None
+    scheduler = None
+    if queue and not dry_run:
+        from relive_dm.workqueue import QueueScheduler, WorkQueue
+
+        work_queue = WorkQueue(path)
+        scheduler = QueueScheduler(work_queue)
+    with (
+        MetricsExporter(metrics_file, report, metrics_interval),
+        profiler or contextlib.nullcontext(),
+        work_queue or contextlib.nullcontext(),
+        scheduler or contextlib.nullcontext(),
+    ):
+        try:
+            download_all(
+                path,
+                patch=patch,
+                dlc=dlc,
+                lazy=lazy,
+                dry_run=dry_run,
+                min_downloads=min_downloads,
+                max_downloads=max_downloads,
+                sync_filter=sync_filter,
+                scheduler=scheduler,
+            )
+            if image_variants and not dry_run:
+                from relive_dm.variants import generate_variants
+
+                for server in servers:
+                    if (path / server.name).exists():
+                        generate_variants(path / server.name)
+        finally:
+            if profiler is not None:
+                profiler.write_report(profile_dir or path / "profile")
+
+
+@app.command()
+def watch(
+    path: Path = Path("assets"),
+    interval: float = typer.Option(600.0, help="Seconds between polls"),
+    patch: bool = True,
+    dlc: bool = True,
+    lazy: bool = False,
+    min_downloads: int | None = None,
+    max_downloads: int | None = None,
+    webhook: str | None = typer.Option(
+        None, help="URL to POST changed master tables to"
+    ),
+    hook_file: Path | None = typer.Option(
+        None, help="File to append changed master tables to, one JSON line each"
+    ),
+    metrics_file: Path | None = typer.Option(
+        None, help="Prometheus textfile to update with pipeline metrics"
+    ),
+    metrics_interval: float = 15.0,
+):
+    """Stays running and syncs whenever the patch or dlc version changes, using
+    the sync filter of the last download."""
+    from relive_dm.metrics import MetricsExporter
+    from relive_dm.watch import Watcher
+
+    logging.basicConfig(level=logging.INFO)
+    watcher = Watcher(
+        path,
+        interval,
+        patch=patch,
+        dlc=dlc,
+        lazy=lazy,
+        min_downloads=min_downloads,
+        max_downloads=max_downloads,
+        webhook=webhook,
+        hook_file=hook_file,
+    )
+    with MetricsExporter(metrics_file, interval=metrics_interval):
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            logger.info("Stopped watching")
+
+
+@app.command()
+def worker(
+    path: Path = Path("assets"),
+    workers: int | None = typer.Option(None, help="Jobs to run at once"),
+    lease: float = typer.Option(
+        120.0,
+        help="Seconds a job is leased for, well above the clock skew between hosts",
+    ),
+    exit_when_empty: bool = typer.Option(
+        False, help="Exit once the queue has no pending jobs"
+    ),
+):
+    """Processes conversions queued by `download --queue`, from this or another
+    host sharing the same path."""
+    from relive_dm.workqueue import QueueWorker, WorkQueue
+
+    logging.basicConfig(level=logging.INFO)
+    with WorkQueue(path) as work_queue:
+        queue_worker = QueueWorker(work_queue, workers, lease)
+        try:
+            queue_worker.run(exit_when_empty)
+        except KeyboardInterrupt:
+            # run() has already let the jobs in progress finish
+            logger.info("Stopped worker")
 
 
 @app.command()
-def download(path: Path = Path("assets"), patch: bool = True, dlc: bool = True):
+def verify(
+    path: Path = Path("assets"), repair: bool = True, workers: int | None = None
+):
+    from relive_dm.verify import verify_tree
+
     logging.basicConfig(level=logging.INFO)
-    download_all(path, patch=patch, dlc=dlc)
+    for server in servers:
+        if (path / server.name).exists():
+            verify_tree(path / server.name, repair=repair, max_workers=workers)
+
+
+@app.command()
+def cat(server: str, asset: str, path: Path = Path("assets"), converted: bool = False):
+    from relive_dm.vfs import AssetFileSystem
+
+    with AssetFileSystem(path / server) as fs:
+        if converted:
+            out_path = fs.convert(asset)
+            if out_path is None:
+                raise typer.BadParameter(f"Could not convert {asset}")
+            data = out_path.read_bytes()
+        else:
+            data = fs.read_decoded(asset)
+    sys.stdout.buffer.write(data)
+
+
+@app.command()
+def export(
+    server: str,
+    pattern: str,
+    out: Path,
+    path: Path = Path("assets"),
+    convert: bool = False,
+):
+    from relive_dm.vfs import AssetFileSystem
+
+    logging.basicConfig(level=logging.INFO)
+    with AssetFileSystem(path / server) as fs:
+        for asset in fs.list(pattern):
+            out_path = fs.export(asset, out / asset, convert=convert)
+            logger.info(f"Exported {asset} to {out_path}")
+
+
+@app.command()
+def repack(
+    server: str,
+    edits: Path,
+    out: Path,
+    path: Path = Path("assets"),
+    workers: int | None = None,
+    cache: bool = typer.Option(True, help="Reuse files encoded by earlier runs"),
+):
+    """Encodes edited .png, .json and Lua table files and builds archives laid out
+    like the patch archives that replace the originals."""
+    from relive_dm.repack import repack as repack_edits
+
+    logging.basicConfig(level=logging.INFO)
+    report = repack_edits(path / server, edits, out, workers, cache)
+    if report.failed:
+        raise typer.Exit(1)
+
+
+@app.command()
+def variants(
+    path: Path = Path("assets"),
+    size: list[int] = typer.Option(
+        [], help="Longest edge of each thumbnail, defaults to the last used"
+    ),
+    webp: bool | None = typer.Option(
+        None, help="Write WebP rather than PNG, defaults to the last used"
+    ),
+    quality: int | None = typer.Option(None, help="WebP quality"),
+    workers: int | None = None,
+):
+    """Makes thumbnails and WebP copies of converted PNGs, and a manifest of them
+    under variants in each server directory."""
+    from relive_dm.variants import generate_variants, load_manifest
+
+    logging.basicConfig(level=logging.INFO)
+    overrides: dict = {}
+    if size:
+        overrides["sizes"] = size
+    if webp is not None:
+        overrides["webp"] = webp
+    if quality is not None:
+        overrides["quality"] = quality
+    failed = False
+    for server in servers:
+        base_path = path / server.name
+        if not base_path.exists():
+            continue
+        config = load_manifest(base_path).config.model_copy(update=overrides)
+        try:
+            report = generate_variants(base_path, config, workers)
+        except RuntimeError as e:
+            typer.echo(str(e), err=True)
+            raise typer.Exit(1)
+        failed = failed or bool(report.failed)
+    if failed:
+        raise typer.Exit(1)
 
 
 @app.command()
@@ -6,23 +6,44 @@ from typing import Any, TypeAlias, cast
 import msgpack
 import yaml
 
-from relive_dm.lua import read_lua_table
+from relive_dm.index import INDEX_FILE_NAME, ExtractIndex
+from relive_dm.lua import Prototype, StreamError, read_lua_prototype, read_lua_table
+from relive_dm.metrics import metrics
+from relive_dm.profiling import profile_stage
 
 logger = logging.getLogger(__name__)
 
 MasterDict: TypeAlias = dict[int, dict[str, Any]]
 
+MASTER_PREFIX = "src/Master/Data/"
+
+
+class NoAliasDumper(yaml.Dumper):
+    """Writes tables shared by several rows in full, rather than as anchors and
+    aliases."""
+
+    def ignore_aliases(self, data: Any) -> bool:
+        return True
+
 
 def merge_values(primary: Any, other: Any, default_key="ja") -> Any:
+    """Merges other into primary. Decoded tables may be shared, so tables are
+    copied when they change rather than changed in place."""
     if isinstance(primary, str) and isinstance(other, dict):
         primary = {default_key: primary}
     if isinstance(primary, dict) and isinstance(other, dict):
+        merged = primary
         for k, v in other.items():
             if k in primary:
-                primary[k] = merge_values(primary[k], v, default_key)
+                value = merge_values(primary[k], v, default_key)
+                if value is primary[k]:
+                    continue
             else:
-                primary[k] = v
-        return primary
+                value = v
+            if merged is primary:
+                merged = primary.copy()
+            merged[k] = value
+        return merged
     return primary
 
 
@@ -44,32 +65,172 @@ def convert_dicts_to_lists(data: MasterDict) -> MasterDict:
         if not isinstance(sv, dict):
             return data
         keys |= set(sv.keys())
+    list_keys = []
     for sub_key in keys:
         sub_values = [v[sub_key] for v in data.values() if sub_key in v]
-        for sv in sub_values:
-            if not (
-                isinstance(sv, dict)
-                and all(isinstance(i, int) for i in sv.keys())
-                and min(sv.keys(), default=1) == 1
-                and max(sv.keys(), default=0) == len(sv)
-            ):
-                break
-        else:  # no break
-            for v in data.values():
-                if sub_key in v:
-                    v[sub_key] = [v[sub_key][i] for i in range(1, len(v[sub_key]) + 1)]
+        if all(is_list_like(sv) for sv in sub_values):
+            list_keys.append(sub_key)
+    if not list_keys:
+        return data
+    for k, v in data.items():
+        data[k] = convert_row(v, list_keys)
     return data
 
 
+def is_list_like(value: Any) -> bool:
+    return (
+        isinstance(value, dict)
+        and all(isinstance(i, int) for i in value.keys())
+        and min(value.keys(), default=1) == 1
+        and max(value.keys(), default=0) == len(value)
+    )
+
+
+def convert_row(row: dict[str, Any], list_keys: list[Any]) -> dict[str, Any]:
+    if not any(sub_key in row for sub_key in list_keys):
+        return row
+    # Rows may be shared, so they are copied rather than changed in place
+    row = row.copy()
+    for sub_key in list_keys:
+        if sub_key in row:
+            row[sub_key] = [row[sub_key][i] for i in range(1, len(row[sub_key]) + 1)]
+    return row
+
+
+def same_data(path: Path, data: bytes) -> bool:
+    return path.stat().st_size == len(data) and path.read_bytes() == data
+
+
+def stream_master(
+    prototype: Prototype,
+    table: str,
+    size: int,
+    out_file: Path,
+    out_file_yaml: Path,
+    out_file_msgpack: Path,
+) -> bool:
+    """Writes a table that needs no merging straight from its bytecode, a row at
+    a time, without building the table in memory.
+
+    The bytecode runs twice, first to count the rows and find the values to
+    convert to lists, then to write the rows. The output is the same as for a
+    merged table. Returns False, having written nothing, if the rows can't be
+    streamed, see Prototype.stream_items.
+    """
+    with (
+        metrics.timer("relive_dm_merge_seconds", step="merge"),
+        profile_stage("merge.merge", table, size),
+    ):
+        count = 0
+        rows_are_dicts = True
+        list_like: dict[Any, bool] = {}
+        try:
+            for _, row in prototype.stream_items():
+                count += 1
+                if not isinstance(row, dict):
+                    rows_are_dicts = False
+                    continue
+                for sub_key, value in row.items():
+                    list_like[sub_key] = list_like.get(sub_key, True) and is_list_like(
+                        value
+                    )
+        except StreamError as e:
+            logger.debug(f"Merging {table} in memory, it can't be streamed: {e}")
+            return False
+        list_keys = [k for k, v in list_like.items() if v] if rows_are_dicts else []
+    with (
+        metrics.timer("relive_dm_merge_seconds", step="write"),
+        profile_stage("merge.write", table, size),
+    ):
+        for path in [out_file, out_file_yaml, out_file_msgpack]:
+            path.parent.mkdir(parents=True, exist_ok=True)
+        with (
+            out_file.open("w", encoding="utf-8") as json_file,
+            out_file_yaml.open("w", encoding="utf-8") as yaml_file,
+            out_file_msgpack.open("wb") as msgpack_file,
+        ):
+            packer = msgpack.Packer()
+            msgpack_file.write(packer.pack_map_header(count))
+            json_file.write("{")
+            for i, (key, row) in enumerate(prototype.stream_items()):
+                if list_keys:
+                    row = convert_row(cast(dict[str, Any], row), list_keys)
+                entry = {key: row}
+                # Strings in JSON can't contain newlines, so the entry's lines
+                # are indented as they would be in the whole table
+                json_entry = json.dumps(
+                    entry, ensure_ascii=False, indent=4, sort_keys=True
+                )
+                json_file.write(("," if i else "") + json_entry[1:-2])
+                yaml_file.write(
+                    yaml.dump(
+                        entry, Dumper=NoAliasDumper, allow_unicode=True, sort_keys=True
+                    )
+                )
+                msgpack_file.write(packer.pack(key))
+                msgpack_file.write(packer.pack(row))
+            json_file.write("\n}" if count else "}")
+            if not count:
+                yaml_file.write(yaml.dump({}, Dumper=NoAliasDumper))
+    return True
+
+
+def record_merged(master_path: Path, *out_files: Path):
+    metrics.inc("relive_dm_merge_tables_total")
+    metrics.inc(
+        "relive_dm_merge_bytes_total", sum(path.stat().st_size for path in out_files)
+    )
+    logger.info(f"Updated {master_path}")
+
+
 def get_masters_path(base_path: Path) -> Path:
     return base_path / "src" / "Master" / "Data"
 
 
-def merge_all_masters(base_paths: list[Path], out_path: Path):
+def find_master_tables(base_path: Path) -> set[str]:
+    """Returns the master tables in a tree, as paths relative to the master data
+    directory, from the extract index rather than by walking the tree.
+
+    Trees without an index, such as read-only copies of master data, are
+    walked instead, without creating one.
+    """
+    tables: set[str] = set()
+    if (base_path / INDEX_FILE_NAME).exists():
+        with ExtractIndex(base_path) as index:
+            index.ensure_catalog()
+            tables = {
+                path.removeprefix(MASTER_PREFIX)
+                for path in index.paths(MASTER_PREFIX, ".luac")
+            }
+    if not tables:
+        # Tables copied in by hand rather than extracted
+        masters_path = get_masters_path(base_path)
+        tables = {
+            path.relative_to(masters_path).as_posix()
+            for path in masters_path.glob("**/*.luac")
+        }
+    return tables
+
+
+def merge_all_masters(
+    base_paths: list[Path], out_path: Path, tables: set[str] | None = None
+) -> list[str]:
+    """Merges master tables from each base path and returns the tables written.
+
+    If tables is given, only those tables, as paths relative to the master data
+    directory such as "Chara.luac", are merged.
+    """
     if len(base_paths) == 0:
         raise ValueError("Must specify at least one base path.")
     primary, *others = [get_masters_path(base_path) for base_path in base_paths]
-    for master_path in primary.glob("**/*.luac"):
+    primary_tables, *other_tables = [
+        find_master_tables(base_path) for base_path in base_paths
+    ]
+    merged = []
+    for table in sorted(primary_tables):
+        if tables is not None and table not in tables:
+            continue
+        master_path = primary / table
         out_file = out_path / master_path.relative_to(primary).with_suffix(".json")
         out_file_yaml = (
             out_path / "yaml" / master_path.relative_to(primary).with_suffix(".yaml")
@@ -88,27 +249,75 @@ def merge_all_masters(base_paths: list[Path], out_path: Path):
             ):
                 logger.debug(f"Skipping {master_path} since it is up to date.")
                 continue
-        data = cast(MasterDict, read_lua_table(master_path.read_bytes()))
-        for other in others:
-            other_path = other / master_path.relative_to(primary)
-            if other_path.exists():
-                data = merge_masters(
-                    data, cast(MasterDict, read_lua_table(other_path.read_bytes()))
+        size = master_path.stat().st_size
+        with (
+            metrics.timer("relive_dm_merge_seconds", step="decode"),
+            profile_stage("merge.decode", table, size),
+        ):
+            # Servers share most keys and enum-like values
+            strings: dict[str, str] = {}
+            master_data = master_path.read_bytes()
+            prototype = read_lua_prototype(master_data, strings)
+        # Merging a table into itself changes nothing, so servers with the same
+        # table, such as ones it isn't localized for, are left out
+        other_paths = [
+            other / table
+            for other, other_table_set in zip(others, other_tables)
+            if table in other_table_set and not same_data(other / table, master_data)
+        ]
+        del master_data
+        if not other_paths and stream_master(
+            prototype, table, size, out_file, out_file_yaml, out_file_msgpack
+        ):
+            record_merged(master_path, out_file, out_file_yaml, out_file_msgpack)
+            merged.append(table)
+            continue
+        with (
+            metrics.timer("relive_dm_merge_seconds", step="merge"),
+            profile_stage("merge.merge", table, size),
+        ):
+            data = cast(MasterDict, prototype.run())
+            # The constant templates aren't needed once the table is built
+            del prototype
+        for other_path in other_paths:
+            # Only one other server's table is decoded at a time, and it is
+            # released once merged
+            other_size = other_path.stat().st_size
+            with (
+                metrics.timer("relive_dm_merge_seconds", step="decode"),
+                profile_stage("merge.decode", table, other_size),
+            ):
+                other_data = cast(
+                    MasterDict, read_lua_table(other_path.read_bytes(), strings)
                 )
-        data = convert_dicts_to_lists(data)
-        out_file.parent.mkdir(parents=True, exist_ok=True)
-        out_file.write_text(
-            json.dumps(data, ensure_ascii=False, indent=4, sort_keys=True),
-            encoding="utf-8",
-        )
-        out_file_yaml.parent.mkdir(parents=True, exist_ok=True)
-        out_file_yaml.write_text(
-            yaml.dump(data, allow_unicode=True, sort_keys=True),
-            encoding="utf-8",
-        )
-        out_file_msgpack.parent.mkdir(parents=True, exist_ok=True)
-        out_file_msgpack.write_bytes(
-            msgpack.packb(data),  # type: ignore
-        )
-        logger.info(f"Updated {master_path}")
+            with (
+                metrics.timer("relive_dm_merge_seconds", step="merge"),
+                profile_stage("merge.merge", table, other_size),
+            ):
+                data = merge_masters(data, other_data)
+            del other_data
+        with (
+            metrics.timer("relive_dm_merge_seconds", step="merge"),
+            profile_stage("merge.merge", table, size),
+        ):
+            data = convert_dicts_to_lists(data)
+        with (
+            metrics.timer("relive_dm_merge_seconds", step="write"),
+            profile_stage("merge.write", table, size),
+        ):
+            out_file.parent.mkdir(parents=True, exist_ok=True)
+            json_data = json.dumps(data, ensure_ascii=False, indent=4, sort_keys=True)
+            out_file.write_text(json_data, encoding="utf-8")
+            out_file_yaml.parent.mkdir(parents=True, exist_ok=True)
+            yaml_data = yaml.dump(
+                data, Dumper=NoAliasDumper, allow_unicode=True, sort_keys=True
+            )
+            out_file_yaml.write_text(yaml_data, encoding="utf-8")
+            out_file_msgpack.parent.mkdir(parents=True, exist_ok=True)
+            out_file_msgpack.write_bytes(
+                msgpack.packb(data),  # type: ignore
+            )
+        record_merged(master_path, out_file, out_file_yaml, out_file_msgpack)
+        merged.append(table)
     logger.info(f"Merged masters to {out_path}")
+    return merged
@@ -0,0 +1,348 @@
+from __future__ import annotations
+
+import bisect
+import contextlib
+import json
+import logging
+import math
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Iterator
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds, from fast table decodes to slow converter runs
+DEFAULT_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+    math.inf,
+)
+
+Labels = tuple[tuple[str, str], ...]
+
+DESCRIPTIONS = {
+    "relive_dm_downloads_total": "Archive downloads by outcome",
+    "relive_dm_download_bytes_total": "Bytes of archives downloaded",
+    "relive_dm_download_seconds": "Time to download an archive",
+    "relive_dm_download_latency_seconds": "Time to the first response of a download",
+    "relive_dm_downloads_in_flight": "Downloads in progress",
+    "relive_dm_download_concurrency": "Allowed concurrent downloads",
+    "relive_dm_extract_files_total": "Archive members by what extraction did",
+    "relive_dm_extract_bytes_total": "Bytes written by extraction",
+    "relive_dm_extract_seconds": "Time to extract an archive",
+    "relive_dm_process_total": "Processed files by suffix and outcome",
+    "relive_dm_process_bytes_total": "Bytes of files processed by suffix",
+    "relive_dm_process_seconds": "Time to process a file by suffix",
+    "relive_dm_processing_queue_depth": "Files waiting to be processed",
+    "relive_dm_processing_running": "Files being processed",
+    "relive_dm_subprocess_total": "External converter runs by tool and outcome",
+    "relive_dm_subprocess_seconds": "Time an external converter ran",
+    "relive_dm_merge_tables_total": "Master tables merged",
+    "relive_dm_merge_bytes_total": "Bytes of merged master data written",
+    "relive_dm_merge_seconds": "Time per master table by merge step",
+    "relive_dm_last_update_time_seconds": "When these metrics were last written",
+}
+
+
+def _labels(labels: dict[str, Any]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: tuple[str, str] | None = None) -> str:
+    pairs = list(labels) + ([extra] if extra is not None else [])
+    if not pairs:
+        return ""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pairs
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+@dataclass
+class Histogram:
+    buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    counts: list[int] = field(default_factory=list)
+    count: int = 0
+    sum: float = 0.0
+    max: float = 0.0
+
+    def __post_init__(self):
+        if not self.counts:
+            self.counts = [0] * len(self.buckets)
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Estimates a quantile by interpolating within its bucket, as Prometheus'
+        histogram_quantile does."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = min(self.buckets[i], self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.max
+
+    def summary(self) -> dict[str, float]:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": self.max,
+        }
+
+
+class MetricsRegistry:
+    """Thread-safe counters, gauges and histograms, keyed by name and labels."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: dict[str, dict[Labels, float]] = {}
+        self._gauges: dict[str, dict[Labels, float]] = {}
+        self._histograms: dict[str, dict[Labels, Histogram]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels: Any):
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels: Any):
+        with self._lock:
+            self._gauges.setdefault(name, {})[_labels(labels)] = value
+
+    def add(self, name: str, value: float, **labels: Any):
+        """Adds to a gauge, e.g. to track work in progress."""
+        key = _labels(labels)
+        with self._lock:
+            series = self._gauges.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: Any):
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels: Any) -> Iterator[None]:
+        """Observes how long the block took, including when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def to_prometheus(self) -> str:
+        """Renders every metric in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for kind, metrics in [
+                ("counter", self._counters),
+                ("gauge", self._gauges),
+            ]:
+                for name, series in sorted(metrics.items()):
+                    lines += self._header(name, kind)
+                    for labels, value in sorted(series.items()):
+                        lines.append(
+                            f"{name}{_format_labels(labels)} {_format_value(value)}"
+                        )
+            for name, series in sorted(self._histograms.items()):
+                lines += self._header(name, "histogram")
+                for labels, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        bucket_labels = _format_labels(
+                            labels, ("le", _format_value(bound))
+                        )
+                        lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                    lines.append(
+                        f"{name}_sum{_format_labels(labels)} "
+                        f"{_format_value(histogram.sum)}"
+                    )
+                    lines.append(
+                        f"{name}_count{_format_labels(labels)} {histogram.count}"
+                    )
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: Path):
+        """Writes the metrics for node_exporter's textfile collector.
+
+        The file is replaced atomically so a scrape never sees a partial file.
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(f"{path.name}.tmp")
+        temp_path.write_text(self.to_prometheus())
+        temp_path.replace(path)
+
+    def summary(self) -> dict[str, Any]:
+        """Returns every metric as plain data, with histograms summarized."""
+
+        def label_key(labels: Labels) -> str:
+            return ",".join(f"{k}={v}" for k, v in labels) or "total"
+
+        with self._lock:
+            return {
+                "counters": {
+                    name: {label_key(k): v for k, v in sorted(series.items())}
+                    for name, series in sorted(self._counters.items())
+                },
+                "gauges": {
+                    name: {label_key(k): v for k, v in sorted(series.items())}
+                    for name, series in sorted(self._gauges.items())
+                },
+                "histograms": {
+                    name: {
+                        label_key(k): histogram.summary()
+                        for k, histogram in sorted(series.items())
+                    }
+                    for name, series in sorted(self._histograms.items())
+                },
+            }
+
+    @staticmethod
+    def _header(name: str, kind: str) -> list[str]:
+        lines = []
+        if name in DESCRIPTIONS:
+            lines.append(f"# HELP {name} {DESCRIPTIONS[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+        return lines
+
+
+metrics = MetricsRegistry()
+
+
+class MetricsExporter:
+    """Writes the metrics as a Prometheus textfile every interval seconds while
+    active, and a JSON run report when done."""
+
+    def __init__(
+        self,
+        textfile_path: Path | None = None,
+        report_path: Path | None = None,
+        interval: float = 15.0,
+        registry: MetricsRegistry = metrics,
+    ):
+        self.textfile_path = textfile_path
+        self.report_path = report_path
+        self.interval = interval
+        self.registry = registry
+        self.started_at = datetime.now(timezone.utc)
+        self._start_time = time.monotonic()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> MetricsExporter:
+        if self.textfile_path is not None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, error: BaseException | None = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.write_textfile()
+        if self.report_path is not None:
+            self.write_report(error)
+
+    def __enter__(self) -> MetricsExporter:
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop(exc)
+
+    def write_textfile(self):
+        if self.textfile_path is None:
+            return
+        self.registry.set("relive_dm_last_update_time_seconds", time.time())
+        try:
+            self.registry.write_textfile(self.textfile_path)
+        except OSError as e:
+            logger.warning(f"Failed to write metrics to {self.textfile_path}: {e}")
+
+    def write_report(self, error: BaseException | None = None):
+        assert self.report_path is not None
+        report = {
+            "started_at": self.started_at.isoformat(),
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "wall_seconds": time.monotonic() - self._start_time,
+            "status": "ok" if error is None else "failed",
+            "error": None if error is None else repr(error),
+            "stages": self.stages(),
+            **self.registry.summary(),
+        }
+        self.report_path.parent.mkdir(parents=True, exist_ok=True)
+        self.report_path.write_text(json.dumps(report, indent=4))
+        logger.info(f"Wrote run report to {self.report_path}")
+
+    def stages(self) -> dict[str, dict[str, float]]:
+        """Summarizes the time spent in each stage of the pipeline.
+
+        Busy seconds are summed across workers, so a stage whose busy time is
+        close to wall time multiplied by its worker count is the bottleneck.
+        """
+        histograms = self.registry.summary()["histograms"]
+        stages = {}
+        for stage, name in [
+            ("download", "relive_dm_download_seconds"),
+            ("extract", "relive_dm_extract_seconds"),
+            ("process", "relive_dm_process_seconds"),
+            ("subprocess", "relive_dm_subprocess_seconds"),
+            ("merge", "relive_dm_merge_seconds"),
+        ]:
+            for labels, summary in histograms.get(name, {}).items():
+                key = stage if labels == "total" else f"{stage}:{labels}"
+                stages[key] = {
+                    "count": summary["count"],
+                    "busy_seconds": summary["sum"],
+                    "p50": summary["p50"],
+                    "p95": summary["p95"],
+                }
+        return stages
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write_textfile()
@@ -1,53 +1,58 @@
 from __future__ import annotations
 
+import concurrent.futures
 import logging
 from pathlib import Path
-from typing import NamedTuple
+from typing import Callable, NamedTuple, TypeAlias
 
-import httpx
 from pydantic import BaseModel, Field
 
-from relive_dm.download import download_zips
+from relive_dm.client import get_client
+from relive_dm.download import DownloadItem, download_zips, extract_existing
+from relive_dm.filters import SyncFilter
+from relive_dm.processing import Scheduler
 
 logger = logging.getLogger(__name__)
 
+MIN_DOWNLOAD_THREADS = 1
+MAX_DOWNLOAD_THREADS = 16
 
-def download_patch(entry_url: str, lang_id: int, base_path: Path):
+
+def download_patch(
+    entry_url: str,
+    lang_id: int,
+    base_path: Path,
+    lazy: bool = False,
+    max_probe_threads: int = 4,
+    dry_run: bool = False,
+    min_download_threads: int = MIN_DOWNLOAD_THREADS,
+    max_download_threads: int = MAX_DOWNLOAD_THREADS,
+    sync_filter: SyncFilter | None = None,
+    scheduler: Scheduler | None = None,
+) -> list[DownloadItem]:
+    """Downloads new patch entries and returns what was (or, for a dry run, would
+    be) downloaded."""
+    if sync_filter is None:
+        sync_filter = SyncFilter()
     config = load_patch_config(base_path)
+    if sync_filter != config.sync_filter and not dry_run:
+        # Files the previous filter left out of archives that are already here
+        extract_existing(base_path, sync_filter, scheduler)
+        config.sync_filter = sync_filter
+        save_patch_config(base_path, config)
     max_iters = 100
     for _ in range(max_iters):
-        r = httpx.get(
-            entry_url,
-            params={
-                "package_type": config.app_config.package_type,
-                "app_ver": config.app_config.app_ver_str,
-                "lang_id": lang_id,
-                "terms_of_service_ver": config.terms_of_service_ver,
-                "privacy_policy_ver": config.privacy_policy_ver,
-                "maintenance_check": 0,
-                "player_id": "nil",
-                "super_user_hash": "nil",
-                "patch_main_id": config.patch.patch_main_id,
-                "patch_main_ver": config.patch.patch_main_ver,
-                "patch_main_localize_id": config.patch.patch_main_localize_id,
-                "patch_main_localize_ver": config.patch.patch_main_localize_ver,
-                "patch_extra_id": config.patch.patch_extra_id,
-                "patch_extra_ver": config.patch.patch_extra_ver,
-                "patch_extra_localize_id": config.patch.patch_extra_localize_id,
-                "patch_extra_localize_ver": config.patch.patch_extra_localize_ver,
-            },
-        )
-        r.raise_for_status()
-        data = r.json()
+        data = request_patch_list(entry_url, lang_id, config)
         if "force_update" in data:
             logger.info(
                 f"App update required after trying {config.app_config.app_ver_str}"
             )
-            config.app_config.app_ver = (
-                config.app_config.app_ver[0],
-                config.app_config.app_ver[1],
-                config.app_config.app_ver[2] + 1,
+            config.app_config.app_ver = find_app_ver(
+                entry_url, lang_id, config, max_probe_threads
             )
+            logger.info(f"Found app version {config.app_config.app_ver_str}")
+            if not dry_run:
+                save_patch_config(base_path, config)
         elif "terms_of_service_ver" in data:
             logger.info(
                 f"Terms of service update to version {data['terms_of_service_ver']}"
@@ -62,26 +67,38 @@ def download_patch(entry_url: str, lang_id: int, base_path: Path):
             download_list = PatchDownloadList.model_validate(data)
             logger.info("Downloaded patch list")
 
-            urls = []
-            urls.extend(
-                f"{download_list.patch_server_url}/{entry.file_name(0)}"
-                for entry in download_list.patch_main
-            )
-            urls.extend(
-                f"{download_list.patch_server_url}/{entry.file_name(lang_id)}"
-                for entry in download_list.patch_main_localize
-            )
-            urls.extend(
-                f"{download_list.patch_server_url}/{entry.file_name(0)}"
-                for entry in download_list.patch_extra
-            )
-            urls.extend(
-                f"{download_list.patch_server_url}/{entry.file_name(lang_id)}"
-                for entry in download_list.patch_extra_localize
-            )
+            items = [
+                DownloadItem(
+                    f"{download_list.patch_server_url}/{entry.file_name(entry_lang_id)}",
+                    entry.size,
+                    f"{kind}:{entry.id}:{entry.version}",
+                )
+                for kind, entries, entry_lang_id in [
+                    ("patch_main", download_list.patch_main, 0),
+                    ("patch_main_localize", download_list.patch_main_localize, lang_id),
+                    ("patch_extra", download_list.patch_extra, 0),
+                    (
+                        "patch_extra_localize",
+                        download_list.patch_extra_localize,
+                        lang_id,
+                    ),
+                ]
+                for entry in entries
+            ]
+            if dry_run:
+                return items
 
-            download_zips(urls, base_path, max_download_threads=-1)
-            logger.info(f"Downloaded {len(urls)} patch entries")
+            download_zips(
+                items,
+                base_path,
+                max_download_threads=max_download_threads,
+                scheduler=scheduler,
+                lazy=lazy,
+                ordered=True,
+                min_download_threads=min_download_threads,
+                sync_filter=sync_filter,
+            )
+            logger.info(f"Downloaded {len(items)} patch entries")
             if download_list.patch_main:
                 config.patch.patch_main_id = download_list.patch_main[-1].id
                 config.patch.patch_main_ver = download_list.patch_main[-1].version
@@ -103,16 +120,146 @@ def download_patch(entry_url: str, lang_id: int, base_path: Path):
                     download_list.patch_extra_localize[-1].version
                 )
             save_patch_config(base_path, config)
-            return
+            return items
         elif "information_news_url" in data:
             logger.info("No updates available")
-            return
+            if not dry_run:
+                save_patch_config(base_path, config)
+            return []
         else:
             raise ValueError("Unknown response")
     logger.error(f"Failed to download patch list from {entry_url}")
     raise RuntimeError("Failed to download patch list")
 
 
+def request_patch_list(entry_url: str, lang_id: int, config: PathConfig) -> dict:
+    r = get_client().get(
+        entry_url,
+        params={
+            "package_type": config.app_config.package_type,
+            "app_ver": config.app_config.app_ver_str,
+            "lang_id": lang_id,
+            "terms_of_service_ver": config.terms_of_service_ver,
+            "privacy_policy_ver": config.privacy_policy_ver,
+            "maintenance_check": 0,
+            "player_id": "nil",
+            "super_user_hash": "nil",
+            "patch_main_id": config.patch.patch_main_id,
+            "patch_main_ver": config.patch.patch_main_ver,
+            "patch_main_localize_id": config.patch.patch_main_localize_id,
+            "patch_main_localize_ver": config.patch.patch_main_localize_ver,
+            "patch_extra_id": config.patch.patch_extra_id,
+            "patch_extra_ver": config.patch.patch_extra_ver,
+            "patch_extra_localize_id": config.patch.patch_extra_localize_id,
+            "patch_extra_localize_ver": config.patch.patch_extra_localize_ver,
+        },
+    )
+    r.raise_for_status()
+    return r.json()
+
+
+AppVersion: TypeAlias = tuple[int, int, int]
+
+# How far past the current version to look within a single version component
+MAX_VERSION_STEP = 256
+# How many minor or major version bumps to try
+MAX_VERSION_BUMPS = 3
+
+
+def find_app_ver(
+    entry_url: str, lang_id: int, config: PathConfig, max_probe_threads: int = 1
+) -> AppVersion:
+    """Finds the lowest app version newer than the current one the server accepts.
+
+    Assumes the server accepts every version from some minimum onwards. Versions
+    with a higher patch component are searched first, then minor and major
+    bumps. Each is searched with exponentially growing steps followed by a
+    search of the last gap, probing up to max_probe_threads versions at a time.
+    """
+
+    def is_accepted(app_ver: AppVersion) -> bool:
+        probe_config = config.model_copy(
+            update={
+                "app_config": config.app_config.model_copy(update={"app_ver": app_ver})
+            }
+        )
+        data = request_patch_list(entry_url, lang_id, probe_config)
+        logger.debug(f"Probed app version {app_ver}: {'force_update' not in data}")
+        return "force_update" not in data
+
+    major, minor, patch = config.app_config.app_ver
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(max_probe_threads, 1)
+    ) as executor:
+
+        def probe_all(versions: list[AppVersion]) -> list[bool]:
+            return list(executor.map(is_accepted, versions))
+
+        # (version for a given last component, last rejected value of it)
+        searches: list[tuple[Callable[[int], AppVersion], int]] = [
+            (lambda n: (major, minor, n), patch)
+        ]
+        searches.extend(
+            (lambda n, bump=bump: (major, minor + bump, n), -1)
+            for bump in range(1, MAX_VERSION_BUMPS + 1)
+        )
+        searches.extend(
+            (lambda n, bump=bump: (major + bump, 0, n), -1)
+            for bump in range(1, MAX_VERSION_BUMPS + 1)
+        )
+        for make_version, rejected in searches:
+            found = search_version_component(
+                make_version, rejected, probe_all, max_probe_threads
+            )
+            if found is not None:
+                return found
+    raise RuntimeError(f"Failed to find a supported app version for {entry_url}")
+
+
+def search_version_component(
+    make_version: Callable[[int], AppVersion],
+    rejected: int,
+    probe_all: Callable[[list[AppVersion]], list[bool]],
+    max_probe_threads: int,
+) -> AppVersion | None:
+    """Finds the smallest n > rejected for which make_version(n) is accepted."""
+    limit = rejected + MAX_VERSION_STEP
+    batch_size = max(max_probe_threads, 1)
+    accepted: int | None = None
+    step = 1
+    while accepted is None:
+        candidates: list[int] = []
+        while len(candidates) < batch_size and rejected < limit:
+            # The last probe is clamped to limit, so every value up to it is covered
+            n = min(rejected + step, limit)
+            if candidates and n == candidates[-1]:
+                break
+            candidates.append(n)
+            step *= 2
+        if not candidates:
+            return None
+        results = probe_all([make_version(n) for n in candidates])
+        for n, result in zip(candidates, results):
+            if result:
+                accepted = n
+                break
+            rejected = n
+    while accepted - rejected > 1:
+        # Split the remaining gap evenly between the probes
+        gap = accepted - rejected
+        candidates = sorted(
+            {rejected + gap * (i + 1) // (batch_size + 1) for i in range(batch_size)}
+            - {rejected, accepted}
+        )
+        results = probe_all([make_version(n) for n in candidates])
+        for n, result in zip(candidates, results):
+            if result:
+                accepted = n
+                break
+            rejected = n
+    return make_version(accepted)
+
+
 def load_patch_config(base_path: Path) -> PathConfig:
     path = base_path / "patch_config.json"
     if path.exists():
@@ -156,6 +303,8 @@ class PathConfig(BaseModel):
     patch: PatchVersion
     terms_of_service_ver: int
     privacy_policy_ver: int
+    # What the last sync included
+    sync_filter: SyncFilter = Field(default_factory=SyncFilter)
 
 
 class PatchEntry(NamedTuple):
@@ -0,0 +1,344 @@
+from __future__ import annotations
+
+import collections
+import concurrent.futures
+import functools
+import importlib
+import logging
+import multiprocessing
+import threading
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Protocol
+
+from relive_dm.metrics import metrics
+from relive_dm.profiling import profile_stage
+
+if TYPE_CHECKING:
+    from importlib.metadata import EntryPoint
+
+logger = logging.getLogger(__name__)
+
+
+class ResourceClass(Enum):
+    SUBPROCESS = "subprocess"
+    CPU = "cpu"
+    IO = "io"
+
+
+class NothingToConvert(Exception):
+    """Raised by a processor for a file it can never convert, e.g. because it is
+    empty or the converter isn't available on this platform. Unlike a failure,
+    the file isn't processed again until it changes."""
+
+
+@functools.cache
+def resolve(ref: str) -> Callable:
+    """Imports a "module:attribute" reference."""
+    module_name, _, attribute = ref.partition(":")
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+@dataclass(frozen=True)
+class Processor:
+    """A file processor.
+
+    The handler may be given as a "module:function" string, in which case its
+    module (and any heavy dependencies it pulls in) is only imported the first
+    time a matching file is processed.
+    """
+
+    handler: str | Callable[[Path], Path | None]
+    resource_class: ResourceClass
+    predicate: Callable[[Path], bool] | None = None
+    # Suffix of the converted file written next to the source
+    output_suffix: str | None = None
+    # "module:function" reference mapping the archived bytes to the bytes the
+    # handler leaves behind, for handlers that rewrite their source in place
+    transform: str | None = None
+
+    def matches(self, path: Path) -> bool:
+        return self.predicate is None or self.predicate(path)
+
+    def run(self, path: Path) -> Path | None:
+        handler = (
+            resolve(self.handler) if isinstance(self.handler, str) else self.handler
+        )
+        suffix = path.suffix
+        status = "error"
+        try:
+            size = path.stat().st_size
+        except OSError:
+            size = 0
+        try:
+            with (
+                metrics.timer("relive_dm_process_seconds", suffix=suffix),
+                profile_stage(f"process{suffix}", str(path), size),
+            ):
+                result = handler(path)
+            status = "ok" if result is not None else "failed"
+            return result
+        except NothingToConvert:
+            status = "unconvertible"
+            raise
+        finally:
+            metrics.inc("relive_dm_process_total", suffix=suffix, status=status)
+            metrics.inc("relive_dm_process_bytes_total", size, suffix=suffix)
+
+    def output_path(self, path: Path) -> Path | None:
+        if self.output_suffix is None:
+            return None
+        return path.with_suffix(self.output_suffix)
+
+    def transform_source(self, data: bytes) -> bytes:
+        if self.transform is None:
+            return data
+        return resolve(self.transform)(data)
+
+
+processors: dict[str, Processor] = {}
+# Processors provided by other packages, loaded when a matching suffix is first seen
+_plugin_processors: dict[str, EntryPoint] | None = None
+
+
+def register_processor(suffixes: str | list[str], processor: Processor):
+    if isinstance(suffixes, str):
+        suffixes = [suffixes]
+    for suffix in suffixes:
+        processors[suffix] = processor
+
+
+def get_processor(path: Path) -> Processor | None:
+    processor = processors.get(path.suffix)
+    if processor is None:
+        processor = load_plugin_processor(path.suffix)
+    if processor is None or not processor.matches(path):
+        return None
+    return processor
+
+
+def load_plugin_processor(suffix: str) -> Processor | None:
+    """Loads a processor registered under the "relive_dm.processors" entry point group.
+
+    The entry point name is the suffix it handles and its value a Processor.
+    """
+    global _plugin_processors
+    if _plugin_processors is None:
+        from importlib.metadata import entry_points
+
+        _plugin_processors = {
+            entry_point.name: entry_point
+            for entry_point in entry_points(group="relive_dm.processors")
+        }
+    entry_point = _plugin_processors.pop(suffix, None)
+    if entry_point is None:
+        return None
+    processor = entry_point.load()
+    if not isinstance(processor, Processor):
+        raise TypeError(f"Entry point {entry_point.value} is not a Processor")
+    register_processor(suffix, processor)
+    return processor
+
+
+def is_master_data(path: Path) -> bool:
+    return "Master" in path.parts and "Data" in path.parts
+
+
+register_processor(
+    ".pvr",
+    Processor(
+        "relive_dm.images:process_pvr",
+        ResourceClass.SUBPROCESS,
+        output_suffix=".png",
+        transform="relive_dm.images:decode_pvr",
+    ),
+)
+register_processor(
+    ".ckb",
+    Processor(
+        "relive_dm.audio:process_ckb", ResourceClass.SUBPROCESS, output_suffix=".opus"
+    ),
+)
+register_processor(
+    [".lua", ".luac"],
+    Processor(
+        "relive_dm.lua:process_lua",
+        ResourceClass.CPU,
+        is_master_data,
+        output_suffix=".json",
+    ),
+)
+
+
+def process_file(path: Path) -> Path | None:
+    processor = get_processor(path)
+    if processor is None:
+        return None
+    try:
+        return processor.run(path)
+    except NothingToConvert:
+        return None
+
+
+class Scheduler(Protocol):
+    """Runs processing jobs for extracted files, see ProcessingScheduler."""
+
+    def submit(self, path: Path) -> concurrent.futures.Future | None: ...
+
+    def join(self): ...
+
+    def shutdown(self, wait: bool = True): ...
+
+
+@dataclass(frozen=True)
+class ResourceLimit:
+    workers: int
+    priority: int
+
+
+def default_resource_limits() -> dict[ResourceClass, ResourceLimit]:
+    cpu_count = multiprocessing.cpu_count()
+    return {
+        # External converters each run on their own core
+        ResourceClass.SUBPROCESS: ResourceLimit(workers=cpu_count, priority=0),
+        # In-process decoding holds the GIL, so extra threads only add contention
+        ResourceClass.CPU: ResourceLimit(workers=2, priority=1),
+        ResourceClass.IO: ResourceLimit(workers=4, priority=2),
+    }
+
+
+class ProcessingScheduler:
+    """Runs process_file jobs on a shared set of workers.
+
+    Each resource class may occupy at most its own number of workers at once, and
+    when several classes have pending work, a free worker takes the job from the
+    class with the lowest priority value. Within a class, suffixes are served
+    round-robin so a burst of one file type cannot starve another.
+    """
+
+    def __init__(
+        self,
+        max_workers: int | None = None,
+        limits: dict[ResourceClass, ResourceLimit] | None = None,
+    ):
+        self.limits = default_resource_limits()
+        if limits is not None:
+            self.limits.update(limits)
+        if max_workers is None:
+            max_workers = multiprocessing.cpu_count() + 2
+        self.max_workers = max_workers
+        self._condition = threading.Condition()
+        self._pending: dict[
+            ResourceClass, collections.OrderedDict[str, collections.deque]
+        ] = {
+            resource_class: collections.OrderedDict()
+            for resource_class in ResourceClass
+        }
+        self._running = {resource_class: 0 for resource_class in ResourceClass}
+        self._unfinished = 0
+        self._shutdown = False
+        self._threads = [
+            threading.Thread(target=self._worker, daemon=True)
+            for _ in range(max_workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, path: Path) -> concurrent.futures.Future | None:
+        processor = get_processor(path)
+        if processor is None:
+            return None
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("Scheduler has been shut down")
+            queues = self._pending[processor.resource_class]
+            queues.setdefault(path.suffix, collections.deque()).append(
+                (processor, path, future)
+            )
+            self._unfinished += 1
+            self._update_metrics(processor.resource_class)
+            self._condition.notify()
+        return future
+
+    def join(self):
+        """Blocks until every submitted job has finished."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._unfinished == 0)
+
+    def shutdown(self, wait: bool = True):
+        if wait:
+            self.join()
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def __enter__(self) -> ProcessingScheduler:
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def _next_job(self):
+        candidates = [
+            resource_class
+            for resource_class, queues in self._pending.items()
+            if queues
+            and self._running[resource_class] < self.limits[resource_class].workers
+        ]
+        if not candidates:
+            return None
+        resource_class = min(candidates, key=lambda c: self.limits[c].priority)
+        queues = self._pending[resource_class]
+        suffix, queue = next(iter(queues.items()))
+        job = queue.popleft()
+        # Rotate the suffix to the back so other suffixes get the next turn
+        del queues[suffix]
+        if queue:
+            queues[suffix] = queue
+        self._running[resource_class] += 1
+        self._update_metrics(resource_class)
+        return job
+
+    def _update_metrics(self, resource_class: ResourceClass):
+        metrics.set(
+            "relive_dm_processing_queue_depth",
+            sum(len(queue) for queue in self._pending[resource_class].values()),
+            resource_class=resource_class.value,
+        )
+        metrics.set(
+            "relive_dm_processing_running",
+            self._running[resource_class],
+            resource_class=resource_class.value,
+        )
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                job = None
+                while not self._shutdown or self._unfinished:
+                    job = self._next_job()
+                    if job is not None:
+                        break
+                    self._condition.wait()
+                if job is None:
+                    return
+            processor, path, future = job
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(processor.run(path))
+                except NothingToConvert as e:
+                    logger.debug(f"Not converting {path}: {e}")
+                    future.set_exception(e)
+                except Exception as e:
+                    logger.warning(f"Failed to process {path}: {e!r}")
+                    future.set_exception(e)
+            with self._condition:
+                self._running[processor.resource_class] -= 1
+                self._update_metrics(processor.resource_class)
+                self._unfinished -= 1
+                self._condition.notify_all()
@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import contextlib
+import cProfile
+import io
+import json
+import logging
+import pstats
+import threading
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import ContextManager, Iterator, TextIO
+
+logger = logging.getLogger(__name__)
+
+# Stages whose allocations are traced, since decoded master tables dominate memory
+DEFAULT_TRACED_STAGES = frozenset(
+    {"process.lua", "process.luac", "merge.decode", "merge.merge", "merge.write"}
+)
+
+
+@dataclass
+class ItemTiming:
+    stage: str
+    item: str
+    seconds: float
+    size: int
+    # Peak traced memory while the item was handled, for traced stages
+    peak_bytes: int | None = None
+
+
+class PipelineProfiler:
+    """Profiles each pipeline stage separately across worker threads.
+
+    Every thread gets its own cProfile profiler per stage, which is only enabled
+    while that thread is inside the stage, so the merged profile of a stage
+    covers all its workers and nothing else. Nested stages pause the outer one.
+
+    tracemalloc's peak is process-wide, so only one item at a time is traced.
+    Items of traced stages that start while another is being traced run
+    untraced rather than waiting, and a traced item's peak also counts what
+    items running alongside it allocated.
+    """
+
+    def __init__(
+        self,
+        traced_stages: frozenset[str] = DEFAULT_TRACED_STAGES,
+        top: int = 25,
+    ):
+        self.traced_stages = traced_stages
+        self.top = top
+        self.items: list[ItemTiming] = []
+        self.use_cprofile = True
+        self._lock = threading.Lock()
+        self._trace_lock = threading.Lock()
+        self._local = threading.local()
+        self._profiles: list[tuple[str, cProfile.Profile]] = []
+        # Snapshot taken when the item with the highest peak so far finished
+        self._snapshots: dict[str, tuple[int, tracemalloc.Snapshot]] = {}
+        self._started_tracemalloc = False
+
+    def start(self) -> PipelineProfiler:
+        global _profiler
+        if self.traced_stages and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        _profiler = self
+        return self
+
+    def stop(self):
+        global _profiler
+        _profiler = None
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def __enter__(self) -> PipelineProfiler:
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @contextlib.contextmanager
+    def stage(self, stage: str, item: str, size: int = 0) -> Iterator[None]:
+        traced = (
+            stage in self.traced_stages
+            and tracemalloc.is_tracing()
+            and self._trace_lock.acquire(blocking=False)
+        )
+        try:
+            if traced:
+                tracemalloc.reset_peak()
+            stack: list[cProfile.Profile] = self._stack()
+            if stack:
+                stack[-1].disable()
+            profile = self._thread_profile(stage)
+            enabled = self._enable(profile)
+            stack.append(profile)
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                seconds = time.perf_counter() - start
+                if enabled:
+                    profile.disable()
+                stack.pop()
+                if stack:
+                    self._enable(stack[-1])
+                peak = None
+                if traced:
+                    _, peak = tracemalloc.get_traced_memory()
+                    self._record_snapshot(stage, peak)
+                with self._lock:
+                    self.items.append(ItemTiming(stage, item, seconds, size, peak))
+        finally:
+            if traced:
+                self._trace_lock.release()
+
+    def stage_stats(self, stream: TextIO | None = None) -> dict[str, pstats.Stats]:
+        """Merges the profiles of every thread by stage, printing to stream."""
+        stats: dict[str, pstats.Stats] = {}
+        with self._lock:
+            for stage, profile in self._profiles:
+                try:
+                    if stage in stats:
+                        stats[stage].add(profile)
+                    else:
+                        stats[stage] = pstats.Stats(profile, stream=stream)
+                except TypeError:
+                    # The profiler was never enabled, so there are no stats
+                    continue
+        return stats
+
+    def slowest(self, stage: str) -> list[ItemTiming]:
+        items = [item for item in self.items if item.stage == stage]
+        return sorted(items, key=lambda item: item.seconds, reverse=True)[: self.top]
+
+    def write_report(self, out_path: Path):
+        """Writes a .prof file per stage, loadable with pstats or snakeviz, and a
+        text and JSON summary of the hottest functions and slowest files."""
+        out_path.mkdir(parents=True, exist_ok=True)
+        stages = sorted({item.stage for item in self.items})
+        text = io.StringIO()
+        stats = self.stage_stats(text)
+        report: dict[str, dict] = {}
+        for stage in stages:
+            items = [item for item in self.items if item.stage == stage]
+            total = sum(item.seconds for item in items)
+            text.write(f"=== {stage}: {len(items)} items, {total:.2f}s busy ===\n\n")
+            report[stage] = {
+                "items": len(items),
+                "busy_seconds": total,
+                "slowest": [asdict(item) for item in self.slowest(stage)],
+            }
+            text.write("Slowest items:\n")
+            for item in self.slowest(stage):
+                peak = (
+                    f", peak {item.peak_bytes / 1024 / 1024:.1f} MiB"
+                    if item.peak_bytes is not None
+                    else ""
+                )
+                size = f"{item.size / 1024:10.1f} KiB" if item.size else f"{'-':>14}"
+                text.write(f"  {item.seconds:8.3f}s  {size}{peak}  {item.item}\n")
+            text.write("\n")
+            if stage in stats:
+                stats[stage].dump_stats(out_path / f"{stage}.prof")
+                stats[stage].sort_stats("cumulative").print_stats(self.top)
+            if stage in self._snapshots:
+                peak, snapshot = self._snapshots[stage]
+                text.write(
+                    f"Memory held at the end of the item with the highest peak "
+                    f"({peak / 1024 / 1024:.1f} MiB):\n"
+                )
+                allocations = []
+                for statistic in self._allocation_statistics(snapshot):
+                    text.write(f"  {statistic}\n")
+                    allocations.append(str(statistic))
+                report[stage]["peak_bytes"] = peak
+                report[stage]["allocations"] = allocations
+                text.write("\n")
+        (out_path / "profile_report.txt").write_text(text.getvalue())
+        (out_path / "profile_report.json").write_text(json.dumps(report, indent=4))
+        logger.info(f"Wrote profile report to {out_path}")
+
+    def _stack(self) -> list[cProfile.Profile]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+            self._local.profiles = {}
+        return self._local.stack
+
+    def _thread_profile(self, stage: str) -> cProfile.Profile:
+        profiles: dict[str, cProfile.Profile] = self._local.profiles
+        if stage not in profiles:
+            profiles[stage] = cProfile.Profile()
+            with self._lock:
+                self._profiles.append((stage, profiles[stage]))
+        return profiles[stage]
+
+    def _enable(self, profile: cProfile.Profile) -> bool:
+        if not self.use_cprofile:
+            return False
+        try:
+            profile.enable()
+            return True
+        except ValueError:
+            # Python 3.12+ allows only one active profiler per process
+            logger.warning(
+                "cProfile cannot profile threads concurrently on this Python, "
+                "recording timings only"
+            )
+            self.use_cprofile = False
+            return False
+
+    def _record_snapshot(self, stage: str, peak: int):
+        if stage in self._snapshots and self._snapshots[stage][0] >= peak:
+            return
+        self._snapshots[stage] = (peak, tracemalloc.take_snapshot())
+
+    def _allocation_statistics(
+        self, snapshot: tracemalloc.Snapshot
+    ) -> list[tracemalloc.Statistic]:
+        snapshot = snapshot.filter_traces(
+            [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            ]
+        )
+        return snapshot.statistics("lineno")[: self.top]
+
+
+_profiler: PipelineProfiler | None = None
+
+
+def profile_stage(stage: str, item: str, size: int = 0) -> ContextManager[None]:
+    """Profiles the block as one item of a stage if profiling is active."""
+    if _profiler is None:
+        return contextlib.nullcontext()
+    return _profiler.stage(stage, item, size)
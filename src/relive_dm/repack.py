@@ -0,0 +1,255 @@
+from __future__ import annotations
+
+import concurrent.futures
+import hashlib
+import json
+import logging
+import re
+import tempfile
+import time
+import zipfile
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, NamedTuple
+
+from relive_dm.images import decode_pvr, encode_pvr, png_to_pvr
+from relive_dm.lua import LuaValue, dump_lua_table, read_lua_table
+from relive_dm.vfs import AssetFileSystem
+from relive_dm.xxtea import decrypt_xxtea_if_header, encrypt_xxtea
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR_NAME = ".repack_cache"
+MANIFEST_FILE_NAME = "repack_manifest.json"
+
+# Suffixes of edited files and the suffixes of the originals they replace
+TARGET_SUFFIXES = {
+    ".png": [".pvr"],
+    ".json": [".luac", ".lua"],
+    ".luac": [".luac"],
+    ".lua": [".lua"],
+}
+
+_INT_KEY = re.compile(r"-?[0-9]+")
+
+
+class Framing(NamedTuple):
+    """How an original file was wrapped in its archive."""
+
+    gzip: bool = False
+    # AES key of the CRPT footer, if the file was encrypted
+    key_index: int | None = None
+    xxtea: bool = False
+
+
+@dataclass
+class RepackReport:
+    encoded: int = 0
+    cached: int = 0
+    failed: list[str] = field(default_factory=list)
+    skipped: list[str] = field(default_factory=list)
+    archives: list[Path] = field(default_factory=list)
+
+
+def detect_framing(path: str, data: bytes) -> Framing:
+    if path.endswith(".pvr"):
+        key_index = data[-3] if data[-8:-4] == b"CRPT" else None
+        gzip = decode_pvr(data) is not data
+        return Framing(gzip, key_index if gzip else None)
+    return Framing(xxtea=data.startswith(b"XXTEA"))
+
+
+def find_target(fs: AssetFileSystem, edit: str) -> str | None:
+    """Returns the path of the original file an edited file replaces."""
+    path = Path(edit)
+    for suffix in TARGET_SUFFIXES.get(path.suffix, []):
+        target = path.with_suffix(suffix).as_posix()
+        if fs.exists(target):
+            return target
+    return None
+
+
+def _json_key(key: LuaValue) -> str:
+    return key if isinstance(key, str) else json.dumps(key)
+
+
+def json_to_lua(value: Any, original: LuaValue = None) -> LuaValue:
+    """Converts a table exported as JSON back to a Lua value.
+
+    JSON turns every key into a string, so keys are typed as they were in the
+    original table where it has them, and otherwise decimal integer keys become
+    integers. Lists become tables indexed from 1.
+    """
+    if isinstance(value, list):
+        value = {str(i + 1): item for i, item in enumerate(value)}
+    if not isinstance(value, dict):
+        return value
+    original_keys = (
+        {_json_key(key): key for key in original} if isinstance(original, dict) else {}
+    )
+    result: dict[LuaValue, LuaValue] = {}
+    for key, item in value.items():
+        if key in original_keys:
+            lua_key = original_keys[key]
+        elif _INT_KEY.fullmatch(key) and str(int(key)) == key:
+            lua_key = int(key)
+        else:
+            lua_key = key
+        original_item = original.get(lua_key) if isinstance(original, dict) else None
+        result[lua_key] = json_to_lua(item, original_item)
+    return result
+
+
+def encode_edit(
+    edit_path: Path, target: str, framing: Framing, original: bytes
+) -> bytes:
+    """Encodes an edited file as the original was stored in its archive. Runs in
+    a worker process."""
+    if edit_path.suffix == ".png":
+        with tempfile.TemporaryDirectory() as temp_dir:
+            png_path = Path(temp_dir) / edit_path.name
+            png_path.write_bytes(edit_path.read_bytes())
+            pvr_path = png_to_pvr(png_path)
+            if pvr_path is None:
+                raise RuntimeError(f"Failed to convert {edit_path} to .pvr")
+            data = pvr_path.read_bytes()
+        if framing.gzip:
+            data = encode_pvr(data, framing.key_index)
+        return data
+    if edit_path.suffix == ".json":
+        value = json.loads(edit_path.read_text("utf-8"))
+        data = dump_lua_table(json_to_lua(value, read_lua_table(original)))
+    else:
+        data = decrypt_xxtea_if_header(edit_path.read_bytes())
+    if framing.xxtea:
+        data = b"XXTEA" + encrypt_xxtea(data)
+    return data
+
+
+def cache_key(target: str, framing: Framing, original: bytes, edit: bytes) -> str:
+    digest = hashlib.sha256(f"{target}\0{tuple(framing)}\0".encode())
+    # JSON edits take their key types from the original
+    digest.update(hashlib.sha256(original).digest())
+    digest.update(edit)
+    return digest.hexdigest()
+
+
+def repack(
+    base_path: Path,
+    edits_path: Path,
+    out_path: Path,
+    max_workers: int | None = None,
+    use_cache: bool = True,
+) -> RepackReport:
+    """Encodes edited files and builds archives that replace the originals.
+
+    Edited files are laid out like the tree, e.g. an edited
+    "src/Master/Data/Chara.json" replaces "src/Master/Data/Chara.luac" and an
+    edited "Textures/Icon.png" replaces "Textures/Icon.pvr". Each is encoded in
+    parallel, with the compression and encryption of the original re-applied.
+    Every archive containing an original is rewritten with the edited files
+    under out_path, at the path it is served from. Encoded files are cached by
+    content hash, and archives whose edits did not change are not rewritten.
+    """
+    report = RepackReport()
+    cache_path = out_path / CACHE_DIR_NAME
+    cache_path.mkdir(parents=True, exist_ok=True)
+    manifest_path = out_path / MANIFEST_FILE_NAME
+    manifest: dict[str, dict[str, str]] = {}
+    if use_cache and manifest_path.exists():
+        manifest = json.loads(manifest_path.read_text())
+
+    with AssetFileSystem(base_path) as fs:
+        # Archive -> target path -> cache key of its encoded data
+        archives: dict[str, dict[str, str]] = {}
+        jobs: dict[str, tuple[Path, str, Framing, bytes]] = {}
+        for edit_path in sorted(edits_path.rglob("*")):
+            if not edit_path.is_file():
+                continue
+            edit = edit_path.relative_to(edits_path).as_posix()
+            target = find_target(fs, edit)
+            if target is None:
+                logger.warning(f"No original for {edit}, skipping")
+                report.skipped.append(edit)
+                continue
+            original = fs.read(target)
+            framing = detect_framing(target, original)
+            key = cache_key(target, framing, original, edit_path.read_bytes())
+            archives.setdefault(fs.source(target), {})[target] = key
+            if use_cache and (cache_path / key).exists():
+                report.cached += 1
+            else:
+                jobs[key] = (edit_path, target, framing, original)
+
+        logger.info(f"Encoding {len(jobs)} files, {report.cached} cached")
+        failed: set[str] = set()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = {
+                pool.submit(encode_edit, *job): (key, job) for key, job in jobs.items()
+            }
+            for future in concurrent.futures.as_completed(futures):
+                key, (edit_path, target, _, _) = futures[future]
+                try:
+                    data = future.result()
+                except Exception as e:
+                    logger.warning(f"Failed to encode {edit_path}: {e!r}")
+                    report.failed.append(target)
+                    failed.add(key)
+                    continue
+                temp_path = cache_path / f"{key}.tmp"
+                temp_path.write_bytes(data)
+                temp_path.replace(cache_path / key)
+                report.encoded += 1
+
+        for source, members in sorted(archives.items()):
+            members = {
+                target: key for target, key in members.items() if key not in failed
+            }
+            if not members:
+                continue
+            archive_path = out_path / Path(source).relative_to("raw")
+            if manifest.get(source) == members and archive_path.exists():
+                logger.info(f"Skipping {archive_path}, no edits changed")
+                continue
+            write_archive(fs, source, members, cache_path, archive_path)
+            manifest[source] = members
+            report.archives.append(archive_path)
+
+    manifest_path.write_text(json.dumps(manifest, indent=4, sort_keys=True))
+    logger.info(
+        f"Repacked {len(report.archives)} archives: {report.encoded} files encoded, "
+        f"{report.cached} cached, {len(report.failed)} failed, "
+        f"{len(report.skipped)} skipped"
+    )
+    return report
+
+
+def write_archive(
+    fs: AssetFileSystem,
+    source: str,
+    members: dict[str, str],
+    cache_path: Path,
+    archive_path: Path,
+):
+    """Writes a copy of a raw archive with the given members replaced by cached
+    encoded files."""
+    archive_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = archive_path.with_name(f"{archive_path.name}.tmp")
+    date_time = time.localtime()[:6]
+    with (
+        zipfile.ZipFile(fs.base_path / source) as z,
+        zipfile.ZipFile(temp_path, "w") as out,
+    ):
+        for info in z.infolist():
+            new_info = zipfile.ZipInfo(info.filename, info.date_time)
+            new_info.compress_type = info.compress_type
+            new_info.external_attr = info.external_attr
+            if info.filename in members:
+                new_info.date_time = date_time
+                out.writestr(
+                    new_info, (cache_path / members[info.filename]).read_bytes()
+                )
+            else:
+                out.writestr(new_info, z.read(info))
+    temp_path.replace(archive_path)
+    logger.info(f"Wrote {archive_path} with {len(members)} edited files")
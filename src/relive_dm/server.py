@@ -1,10 +1,13 @@
+from __future__ import annotations
+
 import logging
 from dataclasses import dataclass
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-from relive_dm.dlc import download_dlc
-from relive_dm.masters import merge_all_masters
-from relive_dm.patch import download_patch
+if TYPE_CHECKING:
+    from relive_dm.filters import SyncFilter
+    from relive_dm.processing import Scheduler
 
 logger = logging.getLogger(__name__)
 
@@ -40,12 +43,68 @@ servers = [
 ]
 
 
-def download_all(path: Path, patch: bool = True, dlc: bool = True):
-    for server in servers:
+def download_all(
+    path: Path,
+    patch: bool = True,
+    dlc: bool = True,
+    lazy: bool = False,
+    dry_run: bool = False,
+    min_downloads: int | None = None,
+    max_downloads: int | None = None,
+    sync_filter: SyncFilter | None = None,
+    server_list: list[ServerInfo] | None = None,
+    scheduler: Scheduler | None = None,
+):
+    # Imported here so commands that only need the server list start quickly
+    from relive_dm.dlc import download_dlc
+    from relive_dm.download import format_size
+    from relive_dm.masters import merge_all_masters
+    from relive_dm.patch import download_patch
+
+    if server_list is None:
+        server_list = servers
+    download_limits = {}
+    if min_downloads is not None:
+        download_limits["min_download_threads"] = min_downloads
+    if max_downloads is not None:
+        download_limits["max_download_threads"] = max_downloads
+    total_bytes = 0
+    for server in server_list:
         logger.info(f"Downloading {server.name}")
+        items = []
         if patch:
-            download_patch(server.entry_url, server.lang_id, path / server.name)
+            items += download_patch(
+                server.entry_url,
+                server.lang_id,
+                path / server.name,
+                lazy,
+                dry_run=dry_run,
+                sync_filter=sync_filter,
+                scheduler=scheduler,
+                **download_limits,
+            )
         if dlc:
-            download_dlc(server.entry_url, server.lang_id, path / server.name)
+            items += download_dlc(
+                server.entry_url,
+                server.lang_id,
+                path / server.name,
+                lazy,
+                dry_run=dry_run,
+                sync_filter=sync_filter,
+                scheduler=scheduler,
+                **download_limits,
+            )
+        server_bytes = sum(item.size for item in items)
+        total_bytes += server_bytes
+        if dry_run:
+            logger.info(
+                f"{server.name}: would download {len(items)} archives "
+                f"({format_size(server_bytes)})"
+            )
+    if dry_run:
+        logger.info(f"Would download {format_size(total_bytes)} in total")
+        return
     if patch:
-        merge_all_masters([path / server.name for server in servers], path / "masters")
+        merge_all_masters(
+            [path / server.name for server in server_list], path / "masters"
+        )
@@ -0,0 +1,249 @@
+from __future__ import annotations
+
+import concurrent.futures
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from pydantic import BaseModel, Field
+
+from relive_dm.index import ExtractIndex
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+VARIANTS_DIR_NAME = "variants"
+MANIFEST_FILE_NAME = "manifest.json"
+
+# Directories of generated files that may contain PNGs
+GENERATED_DIRS = {VARIANTS_DIR_NAME, "cache"}
+
+
+class VariantConfig(BaseModel):
+    # Longest edge of each thumbnail in pixels
+    sizes: list[int] = Field(default_factory=lambda: [128, 512])
+    # Write WebP, including a full-size copy, rather than PNG
+    webp: bool = True
+    quality: int = 80
+
+
+class AssetVariants(BaseModel):
+    size: int
+    mtime_ns: int
+    hash: str
+    width: int
+    height: int
+    # "full" or a thumbnail size -> path relative to the base path
+    variants: dict[str, str]
+
+
+class VariantManifest(BaseModel):
+    config: VariantConfig = Field(default_factory=VariantConfig)
+    # Converted PNG -> its variants, paths relative to the base path
+    assets: dict[str, AssetVariants] = Field(default_factory=dict)
+
+
+@dataclass
+class VariantReport:
+    generated: int = 0
+    unchanged: int = 0
+    failed: list[str] = field(default_factory=list)
+
+
+def require_pillow():
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        raise RuntimeError(
+            "Image variants require Pillow, install it with `pdm install -G images`"
+        ) from None
+
+
+def load_manifest(base_path: Path) -> VariantManifest:
+    path = base_path / VARIANTS_DIR_NAME / MANIFEST_FILE_NAME
+    if path.exists():
+        return VariantManifest.model_validate_json(path.read_text())
+    return VariantManifest()
+
+
+def save_manifest(base_path: Path, manifest: VariantManifest):
+    path = base_path / VARIANTS_DIR_NAME / MANIFEST_FILE_NAME
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f"{path.name}.tmp")
+    temp_path.write_text(manifest.model_dump_json(indent=4))
+    temp_path.replace(path)
+
+
+def find_pngs(base_path: Path) -> list[str]:
+    """Returns the PNGs converted in a tree, from the extract index."""
+    with ExtractIndex(base_path) as index:
+        pngs = {
+            entry.output
+            for entry in index.catalog()
+            if entry.status == "done"
+            and entry.output is not None
+            and entry.output.endswith(".png")
+        }
+    if not pngs:
+        # Trees converted before outputs were indexed
+        pngs = {
+            relative
+            for path in base_path.glob("**/*.png")
+            if (relative := path.relative_to(base_path).as_posix()).split("/")[0]
+            not in GENERATED_DIRS
+        }
+    return sorted(pngs)
+
+
+def file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_variants(
+    base_path: Path,
+    png: str,
+    config: VariantConfig,
+    previous: AssetVariants | None = None,
+) -> AssetVariants:
+    """Writes the variants of a converted PNG, unless its contents are the same as
+    when previous was made. Runs in a worker process.
+
+    Thumbnails are never scaled up, so sizes at least as large as the image
+    refer to the full-size variant, which is the PNG itself without WebP.
+    """
+    from PIL import Image
+
+    path = base_path / png
+    stat = path.stat()
+    digest = file_hash(path)
+    if previous is not None and previous.hash == digest:
+        return previous.model_copy(
+            update={"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        )
+    stem = base_path / VARIANTS_DIR_NAME / Path(png).with_suffix("")
+    stem.parent.mkdir(parents=True, exist_ok=True)
+    suffix, image_format = (".webp", "WEBP") if config.webp else (".png", "PNG")
+    variants: dict[str, str] = {}
+    with Image.open(path) as image:
+        image.load()
+        width, height = image.size
+        if config.webp:
+            out_path = stem.with_name(f"{stem.name}.full{suffix}")
+            save_image(image, out_path, image_format, config.quality)
+            variants["full"] = out_path.relative_to(base_path).as_posix()
+        else:
+            variants["full"] = png
+        for size in sorted(set(config.sizes)):
+            if size >= max(width, height):
+                variants[str(size)] = variants["full"]
+                continue
+            thumbnail = image.copy()
+            thumbnail.thumbnail((size, size), Image.Resampling.LANCZOS)
+            out_path = stem.with_name(f"{stem.name}.{size}{suffix}")
+            save_image(thumbnail, out_path, image_format, config.quality)
+            variants[str(size)] = out_path.relative_to(base_path).as_posix()
+    return AssetVariants(
+        size=stat.st_size,
+        mtime_ns=stat.st_mtime_ns,
+        hash=digest,
+        width=width,
+        height=height,
+        variants=variants,
+    )
+
+
+def save_image(image: Image.Image, out_path: Path, image_format: str, quality: int):
+    temp_path = out_path.with_name(f"{out_path.name}.tmp")
+    if image_format == "WEBP":
+        image.save(temp_path, format=image_format, quality=quality, method=4)
+    else:
+        image.save(temp_path, format=image_format, optimize=True)
+    temp_path.replace(out_path)
+
+
+def generate_variants(
+    base_path: Path,
+    config: VariantConfig | None = None,
+    max_workers: int | None = None,
+) -> VariantReport:
+    """Makes thumbnails and WebP copies of every converted PNG in a tree and
+    writes a manifest mapping each PNG to its variants.
+
+    Only PNGs whose contents changed since the last run are processed, across
+    worker processes. The config defaults to that of the last run; changing it
+    makes every variant again. Variants of PNGs that are gone are removed, while
+    those of PNGs that fail are kept until they can be made again.
+    """
+    require_pillow()
+    report = VariantReport()
+    manifest = load_manifest(base_path)
+    if config is None:
+        config = manifest.config
+    previous_assets = manifest.assets if config == manifest.config else {}
+    assets: dict[str, AssetVariants] = {}
+    pending: list[str] = []
+    for png in find_pngs(base_path):
+        try:
+            stat = (base_path / png).stat()
+        except FileNotFoundError:
+            continue
+        previous = previous_assets.get(png)
+        if (
+            previous is not None
+            and previous.size == stat.st_size
+            and previous.mtime_ns == stat.st_mtime_ns
+        ):
+            assets[png] = previous
+            report.unchanged += 1
+        else:
+            pending.append(png)
+
+    logger.info(
+        f"Making variants of {len(pending)} images in {base_path}, "
+        f"{report.unchanged} unchanged"
+    )
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(
+                make_variants, base_path, png, config, previous_assets.get(png)
+            ): png
+            for png in pending
+        }
+        for future in concurrent.futures.as_completed(futures):
+            png = futures[future]
+            try:
+                assets[png] = future.result()
+            except Exception as e:
+                logger.warning(f"Failed to make variants of {png}: {e!r}")
+                report.failed.append(png)
+                # Keep the variants from the last run, but retry it next time
+                if png in manifest.assets:
+                    assets[png] = manifest.assets[png].model_copy(
+                        update={"mtime_ns": 0, "hash": ""}
+                    )
+                continue
+            previous = previous_assets.get(png)
+            if previous is not None and previous.hash == assets[png].hash:
+                report.unchanged += 1
+            else:
+                report.generated += 1
+
+    current = {path for asset in assets.values() for path in asset.variants.values()}
+    for asset in manifest.assets.values():
+        for path in asset.variants.values():
+            if path not in current and path.startswith(f"{VARIANTS_DIR_NAME}/"):
+                (base_path / path).unlink(missing_ok=True)
+    save_manifest(base_path, VariantManifest(config=config, assets=assets))
+    logger.info(
+        f"Made variants of {report.generated} images in {base_path}, "
+        f"{report.unchanged} unchanged, {len(report.failed)} failed"
+    )
+    return report
@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import concurrent.futures
+import logging
+import mmap
+import zipfile
+import zlib
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import NamedTuple
+
+from relive_dm.dlc import load_dlc_config
+from relive_dm.download import extract_zip
+from relive_dm.filters import SyncFilter
+from relive_dm.index import ExtractIndex
+from relive_dm.patch import load_patch_config
+from relive_dm.processing import ProcessingScheduler, get_processor
+
+logger = logging.getLogger(__name__)
+
+# Number of files checked per worker task
+CHUNK_SIZE = 256
+
+
+class ExpectedFile(NamedTuple):
+    path: str
+    crc: int
+    size: int
+    # Whether the file should have been converted
+    converted: bool = True
+
+
+@dataclass
+class VerifyReport:
+    checked: int = 0
+    missing: list[str] = field(default_factory=list)
+    corrupt: list[str] = field(default_factory=list)
+    unconverted: list[str] = field(default_factory=list)
+
+    @property
+    def bad(self) -> list[str]:
+        return self.missing + self.corrupt + self.unconverted
+
+
+def file_crc(path: Path) -> int:
+    with path.open("rb") as f:
+        if path.stat().st_size == 0:
+            return 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return zlib.crc32(m)
+
+
+def check_files(
+    base_path: Path, source: str, files: list[ExpectedFile]
+) -> list[tuple[str, str]]:
+    """Checks extracted files against the archive they came from.
+
+    Returns (path, problem) for each file that is "missing", "corrupt" or
+    "unconverted". Runs in a worker process.
+    """
+    problems = []
+    z: zipfile.ZipFile | None = None
+    try:
+        for expected in files:
+            path = base_path / expected.path
+            processor = get_processor(path)
+            if not path.exists():
+                problems.append((expected.path, "missing"))
+                continue
+            if processor is not None and processor.transform is not None:
+                # The file was rewritten in place, so compare against the
+                # transformed archive member instead
+                if z is None:
+                    z = zipfile.ZipFile(base_path / source)
+                data = processor.transform_source(z.read(expected.path))
+                crc, size = zlib.crc32(data), len(data)
+            else:
+                crc, size = expected.crc, expected.size
+            if path.stat().st_size != size or file_crc(path) != crc:
+                problems.append((expected.path, "corrupt"))
+                continue
+            output_path = processor and processor.output_path(path)
+            if (
+                expected.converted
+                and output_path is not None
+                and not output_path.exists()
+            ):
+                problems.append((expected.path, "unconverted"))
+    finally:
+        if z is not None:
+            z.close()
+    return problems
+
+
+def find_expected_files(
+    base_path: Path, index: ExtractIndex
+) -> dict[str, list[ExpectedFile]]:
+    """Maps each raw archive to the files in the tree that should come from it."""
+    expected: dict[str, list[ExpectedFile]] = {}
+    for name, (source, info, status) in index.find_archive_members().items():
+        if status in ("virtual", "excluded"):
+            continue
+        # Skipped files were extracted with conversion turned off
+        converted = status not in ("unconvertible", "skipped")
+        expected.setdefault(source, []).append(
+            ExpectedFile(name, info.CRC, info.file_size, converted=converted)
+        )
+    return expected
+
+
+def saved_sync_filter(base_path: Path) -> SyncFilter:
+    """Returns the sync filter the tree was last downloaded with."""
+    if (base_path / "patch_config.json").exists():
+        return load_patch_config(base_path).sync_filter
+    return load_dlc_config(base_path).sync_filter
+
+
+def verify_tree(
+    base_path: Path,
+    repair: bool = True,
+    max_workers: int | None = None,
+    sync_filter: SyncFilter | None = None,
+) -> VerifyReport:
+    """Checks the tree against its archives and, with repair, extracts bad files
+    again using the sync filter, by default the one the tree was downloaded with."""
+    if sync_filter is None:
+        sync_filter = saved_sync_filter(base_path)
+    report = VerifyReport()
+    with ExtractIndex(base_path) as index:
+        expected = find_expected_files(base_path, index)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = [
+                (source, pool.submit(check_files, base_path, source, chunk))
+                for source, files in expected.items()
+                for chunk in (
+                    files[i : i + CHUNK_SIZE] for i in range(0, len(files), CHUNK_SIZE)
+                )
+            ]
+            report.checked = sum(len(files) for files in expected.values())
+            bad_by_source: dict[str, set[str]] = {}
+            for source, future in futures:
+                for path, problem in future.result():
+                    getattr(report, problem).append(path)
+                    bad_by_source.setdefault(source, set()).add(path)
+        logger.info(
+            f"Verified {report.checked} files in {base_path}: "
+            f"{len(report.missing)} missing, {len(report.corrupt)} corrupt, "
+            f"{len(report.unconverted)} unconverted"
+        )
+        for problem in ("missing", "corrupt", "unconverted"):
+            for path in getattr(report, problem):
+                logger.info(f"{problem}: {path}")
+        if repair and bad_by_source:
+            with ProcessingScheduler() as scheduler:
+                for source, names in bad_by_source.items():
+                    for name in names:
+                        index.mark_failed(name)
+                    with zipfile.ZipFile(base_path / source) as z:
+                        extract_zip(
+                            z,
+                            source,
+                            base_path,
+                            scheduler.submit,
+                            index,
+                            names,
+                            sync_filter=sync_filter,
+                        )
+                scheduler.join()
+            logger.info(f"Repaired {len(report.bad)} files in {base_path}")
+    return report
@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import fnmatch
+import logging
+import shutil
+import threading
+import zipfile
+from pathlib import Path
+from typing import IO
+
+from relive_dm.index import ExtractIndex
+from relive_dm.processing import NothingToConvert, get_processor
+
+logger = logging.getLogger(__name__)
+
+
+class AssetFileSystem:
+    """Read-only view of a server's assets served straight from the raw archives.
+
+    Each path resolves to the archive that last wrote it, as recorded in the
+    extract index, so later patches override earlier ones just as they do when
+    extracting. Archives are only opened once a file in them is read. Converted
+    files are produced on demand and cached under cache_path, keyed by the
+    member's CRC so a newer version of an asset is converted again.
+    """
+
+    def __init__(self, base_path: Path, cache_path: Path | None = None):
+        self.base_path = base_path
+        self.cache_path = cache_path or base_path / "cache"
+        with ExtractIndex(base_path) as index:
+            index.ensure_catalog()
+            # Path -> (source, crc)
+            self._members = {
+                path: (source, crc) for path, source, crc, *_ in index.entries()
+            }
+            if not self._members:
+                # Archives copied in by hand rather than downloaded
+                self._members = {
+                    path: (source, info.CRC)
+                    for path, (source, info, _) in index.find_archive_members().items()
+                }
+        self._archives: dict[str, zipfile.ZipFile] = {}
+        self._lock = threading.Lock()
+
+    def list(self, pattern: str = "*") -> list[str]:
+        return sorted(path for path in self._members if fnmatch.fnmatch(path, pattern))
+
+    def exists(self, path: str) -> bool:
+        return path in self._members
+
+    def source(self, path: str) -> str:
+        """Returns the raw archive a path is read from."""
+        return self._member(path)[0]
+
+    def open(self, path: str) -> IO[bytes]:
+        source, _ = self._member(path)
+        return self._archive(source).open(path)
+
+    def read(self, path: str) -> bytes:
+        """Returns the file as it is stored in the archive."""
+        source, _ = self._member(path)
+        return self._archive(source).read(path)
+
+    def read_decoded(self, path: str) -> bytes:
+        """Returns the file as it would be left on disk after extraction, which for
+        encrypted or compressed formats such as .pvr is the decoded data."""
+        processor = get_processor(Path(path))
+        data = self.read(path)
+        if processor is None:
+            return data
+        return processor.transform_source(data)
+
+    def convert(self, path: str) -> Path | None:
+        """Returns the path of the converted file, converting it if not cached.
+
+        Returns None if the file has no processor or can't be converted.
+        """
+        processor = get_processor(Path(path))
+        if processor is None:
+            return None
+        _, crc = self._member(path)
+        cache_file = self.cache_path / f"{crc:08x}" / path
+        output_path = processor.output_path(cache_file)
+        if output_path is not None and output_path.exists():
+            return output_path
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        cache_file.write_bytes(self.read(path))
+        try:
+            return processor.run(cache_file)
+        except NothingToConvert:
+            return None
+
+    def export(self, path: str, out_path: Path, convert: bool = False) -> Path:
+        """Writes a file, or its converted form, to out_path and returns the path
+        written."""
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        if convert:
+            converted = self.convert(path)
+            if converted is not None:
+                out_path = out_path.with_suffix(converted.suffix)
+                shutil.copyfile(converted, out_path)
+                return out_path
+        out_path.write_bytes(self.read_decoded(path))
+        return out_path
+
+    def close(self):
+        with self._lock:
+            for archive in self._archives.values():
+                archive.close()
+            self._archives.clear()
+
+    def __enter__(self) -> AssetFileSystem:
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _member(self, path: str) -> tuple[str, int]:
+        try:
+            return self._members[path]
+        except KeyError:
+            raise FileNotFoundError(path) from None
+
+    def _archive(self, source: str) -> zipfile.ZipFile:
+        with self._lock:
+            if source not in self._archives:
+                self._archives[source] = zipfile.ZipFile(self.base_path / source)
+            return self._archives[source]
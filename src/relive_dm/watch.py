@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+from relive_dm.client import close_client, get_client
+from relive_dm.dlc import MAX_DOWNLOAD_THREADS as DLC_MAX_DOWNLOAD_THREADS
+from relive_dm.dlc import MIN_DOWNLOAD_THREADS as DLC_MIN_DOWNLOAD_THREADS
+from relive_dm.dlc import download_dlc, load_dlc_config
+from relive_dm.filters import SyncFilter
+from relive_dm.index import ExtractIndex
+from relive_dm.masters import MASTER_PREFIX, merge_all_masters
+from relive_dm.patch import MAX_DOWNLOAD_THREADS as PATCH_MAX_DOWNLOAD_THREADS
+from relive_dm.patch import MIN_DOWNLOAD_THREADS as PATCH_MIN_DOWNLOAD_THREADS
+from relive_dm.patch import download_patch, load_patch_config
+from relive_dm.processing import ProcessingScheduler
+from relive_dm.server import ServerInfo, servers
+
+logger = logging.getLogger(__name__)
+
+# Master table CRCs of each server as of the last merge
+STATE_FILE_NAME = "watch_state.json"
+
+
+def master_crcs(base_path: Path) -> dict[str, int]:
+    """Returns the CRC of each extracted master table, keyed by its path relative
+    to the master data directory."""
+    with ExtractIndex(base_path) as index:
+        index.ensure_catalog()
+        return {
+            path.removeprefix(MASTER_PREFIX): crc
+            for path, crc in index.crcs(MASTER_PREFIX).items()
+            if path.endswith(".luac")
+        }
+
+
+class Watcher:
+    """Polls the patch and dlc servers and syncs whatever changed.
+
+    The HTTP client and processing workers stay warm between polls. A poll with
+    no new patch or dlc version costs one request to each endpoint. When master
+    tables change, only those are merged again, and hooks are notified with the
+    list of changed tables.
+
+    Tables are compared against their CRCs at the last merge, which are saved
+    with the tree, so tables synced by a poll that then failed are merged by the
+    next one. Without saved CRCs every table is merged.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        interval: float = 600.0,
+        server_list: list[ServerInfo] | None = None,
+        patch: bool = True,
+        dlc: bool = True,
+        lazy: bool = False,
+        min_downloads: int | None = None,
+        max_downloads: int | None = None,
+        sync_filter: SyncFilter | None = None,
+        webhook: str | None = None,
+        hook_file: Path | None = None,
+    ):
+        self.path = path
+        self.interval = interval
+        self.server_list = server_list if server_list is not None else servers
+        self.patch = patch
+        self.dlc = dlc
+        self.lazy = lazy
+        self.min_downloads = min_downloads
+        self.max_downloads = max_downloads
+        self.webhook = webhook
+        self.hook_file = hook_file
+        # Keep the filter each server was last synced with unless one is given
+        self.sync_filters = {
+            server.name: sync_filter
+            or load_patch_config(path / server.name).sync_filter
+            for server in self.server_list
+        }
+        self.dlc_sync_filters = {
+            server.name: sync_filter or load_dlc_config(path / server.name).sync_filter
+            for server in self.server_list
+        }
+        self.scheduler = ProcessingScheduler()
+        self._stop = threading.Event()
+
+    def run(self, max_polls: int | None = None):
+        """Polls until stopped, or max_polls polls have run."""
+        polls = 0
+        try:
+            while not self._stop.is_set():
+                start = time.monotonic()
+                try:
+                    self.poll()
+                except Exception:
+                    logger.exception("Sync failed, retrying next poll")
+                polls += 1
+                if max_polls is not None and polls >= max_polls:
+                    break
+                self._stop.wait(max(self.interval - (time.monotonic() - start), 0))
+        finally:
+            self.close()
+
+    def stop(self):
+        self._stop.set()
+
+    def close(self):
+        self.scheduler.shutdown()
+        close_client()
+
+    def poll(self) -> list[str]:
+        """Syncs every server once and returns the master tables that changed."""
+        patched = False
+        for server in self.server_list:
+            base_path = self.path / server.name
+            if self.patch:
+                items = download_patch(
+                    server.entry_url,
+                    server.lang_id,
+                    base_path,
+                    self.lazy,
+                    min_download_threads=self.min_downloads
+                    or PATCH_MIN_DOWNLOAD_THREADS,
+                    max_download_threads=self.max_downloads
+                    or PATCH_MAX_DOWNLOAD_THREADS,
+                    sync_filter=self.sync_filters[server.name],
+                    scheduler=self.scheduler,
+                )
+                patched = patched or bool(items)
+            if self.dlc:
+                download_dlc(
+                    server.entry_url,
+                    server.lang_id,
+                    base_path,
+                    self.lazy,
+                    min_download_threads=self.min_downloads or DLC_MIN_DOWNLOAD_THREADS,
+                    max_download_threads=self.max_downloads or DLC_MAX_DOWNLOAD_THREADS,
+                    sync_filter=self.dlc_sync_filters[server.name],
+                    scheduler=self.scheduler,
+                )
+        if not self.patch:
+            return []
+        before = self.load_merged_crcs()
+        after = {
+            server.name: master_crcs(self.path / server.name)
+            for server in self.server_list
+        }
+        masters_path = self.path / "masters"
+        tables: set[str] | None
+        if before is None or not masters_path.exists():
+            # Nothing merged yet, e.g. the tree was synced before watching
+            tables = None
+        elif patched and not any(after.values()):
+            # Trees extracted before the index existed can't be compared
+            tables = None
+        else:
+            tables = {
+                table
+                for name in after
+                for table in set(before.get(name, {})) | set(after[name])
+                if before.get(name, {}).get(table) != after[name].get(table)
+            }
+            if not tables:
+                logger.info("No master tables changed")
+                return []
+        merged = merge_all_masters(
+            [self.path / server.name for server in self.server_list],
+            masters_path,
+            tables,
+        )
+        self.save_merged_crcs(after)
+        if merged:
+            self.notify(merged)
+        return merged
+
+    def load_merged_crcs(self) -> dict[str, dict[str, int]] | None:
+        state_path = self.path / STATE_FILE_NAME
+        if not state_path.exists():
+            return None
+        return json.loads(state_path.read_text())["merged_crcs"]
+
+    def save_merged_crcs(self, crcs: dict[str, dict[str, int]]):
+        state_path = self.path / STATE_FILE_NAME
+        state_path.write_text(json.dumps({"merged_crcs": crcs}, indent=4))
+
+    def notify(self, tables: list[str]):
+        masters_path = self.path / "masters"
+        event: dict[str, Any] = {
+            "event": "masters_changed",
+            "time": datetime.now(timezone.utc).isoformat(),
+            "tables": [
+                {
+                    "table": Path(table).with_suffix("").as_posix(),
+                    "json": (masters_path / table).with_suffix(".json").as_posix(),
+                    "yaml": (masters_path / "yaml" / table)
+                    .with_suffix(".yaml")
+                    .as_posix(),
+                    "msgpack": (masters_path / "msgpack" / table)
+                    .with_suffix(".msgpack")
+                    .as_posix(),
+                }
+                for table in sorted(tables)
+            ],
+            "servers": {
+                server.name: {
+                    "patch_main_id": load_patch_config(
+                        self.path / server.name
+                    ).patch.patch_main_id,
+                    "dlc_ver": load_dlc_config(self.path / server.name).version,
+                }
+                for server in self.server_list
+            },
+        }
+        logger.info(f"{len(tables)} master tables changed")
+        if self.hook_file is not None:
+            self.hook_file.parent.mkdir(parents=True, exist_ok=True)
+            with self.hook_file.open("a", encoding="utf-8") as f:
+                f.write(json.dumps(event) + "\n")
+        if self.webhook is not None:
+            try:
+                get_client().post(self.webhook, json=event).raise_for_status()
+            except Exception as e:
+                logger.warning(f"Failed to notify {self.webhook}: {e!r}")
@@ -0,0 +1,484 @@
+from __future__ import annotations
+
+import concurrent.futures
+import contextlib
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator
+
+from relive_dm.processing import (
+    NothingToConvert,
+    default_resource_limits,
+    get_processor,
+)
+
+logger = logging.getLogger(__name__)
+
+QUEUE_FILE_NAME = "work_queue.sqlite3"
+# Leases are renewed every lease / HEARTBEATS_PER_LEASE seconds
+HEARTBEATS_PER_LEASE = 3
+# Times a job may be leased before it is failed, e.g. if it keeps crashing workers
+MAX_ATTEMPTS = 3
+
+
+@dataclass(frozen=True)
+class Job:
+    path: str
+    token: str
+    attempts: int
+
+
+class WorkQueue:
+    """Durable queue of processing jobs shared by workers through an SQLite file.
+
+    Jobs are keyed by path relative to root, so workers on other hosts can mount
+    the same tree elsewhere. A job's version is the file's size and mtime; a
+    finished job is only queued again when its file changes. Workers lease jobs
+    for a limited time and must renew the lease while working. Jobs whose lease
+    expires, e.g. because the worker crashed, are handed to another worker, and
+    only the holder of the current lease can complete a job.
+
+    SQLite has no clock of its own, so lease expiry is written and checked with
+    each host's time.time(). Hosts' clocks must agree to well within a lease,
+    or a host whose clock runs ahead can take over leases that are still held.
+    """
+
+    def __init__(self, root: Path, timeout: float = 60.0):
+        self.root = root
+        root.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            root / QUEUE_FILE_NAME,
+            isolation_level=None,
+            check_same_thread=False,
+            timeout=timeout,
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                path TEXT PRIMARY KEY,
+                version TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                worker TEXT,
+                token TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                output TEXT,
+                error TEXT,
+                finished_seq INTEGER
+            )
+            """
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, priority)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished_seq)"
+        )
+
+    def relative(self, path: Path) -> str:
+        return path.relative_to(self.root).as_posix()
+
+    def enqueue(self, path: Path, priority: int = 0) -> bool:
+        """Queues a file for processing and returns whether it needs processing.
+
+        A file that was already processed in its current version is not queued
+        again.
+        """
+        stat = path.stat()
+        version = f"{stat.st_size}:{stat.st_mtime_ns}"
+        relative = self.relative(path)
+        with self._transaction() as connection:
+            row = connection.execute(
+                "SELECT version, status FROM jobs WHERE path = ?", (relative,)
+            ).fetchone()
+            if row is not None and row[0] == version and row[1] != "failed":
+                return row[1] not in ("done", "unconvertible")
+            connection.execute(
+                """
+                INSERT OR REPLACE INTO jobs (path, version, priority, status)
+                VALUES (?, ?, ?, 'pending')
+                """,
+                (relative, version, priority),
+            )
+        return True
+
+    def lease(self, worker: str, duration: float) -> Job | None:
+        """Leases the next pending or expired job."""
+        now = time.time()
+        token = uuid.uuid4().hex
+        with self._transaction() as connection:
+            while True:
+                row = connection.execute(
+                    """
+                    SELECT path, attempts FROM jobs
+                    WHERE status = 'pending'
+                        OR (status = 'leased' AND lease_expires < ?)
+                    ORDER BY priority, rowid
+                    LIMIT 1
+                    """,
+                    (now,),
+                ).fetchone()
+                if row is None:
+                    return None
+                path, attempts = row
+                if attempts < MAX_ATTEMPTS:
+                    break
+                self._finish(connection, path, "failed", None, "Too many attempts")
+                logger.warning(f"Giving up on {path} after {attempts} attempts")
+            connection.execute(
+                """
+                UPDATE jobs
+                SET status = 'leased', worker = ?, token = ?, lease_expires = ?,
+                    attempts = attempts + 1
+                WHERE path = ?
+                """,
+                (worker, token, now + duration, path),
+            )
+        return Job(path, token, attempts + 1)
+
+    def renew(self, jobs: list[Job], duration: float) -> list[Job]:
+        """Extends the leases of jobs and returns those whose lease was lost."""
+        lost = []
+        with self._transaction() as connection:
+            for job in jobs:
+                cursor = connection.execute(
+                    """
+                    UPDATE jobs SET lease_expires = ?
+                    WHERE path = ? AND token = ? AND status = 'leased'
+                    """,
+                    (time.time() + duration, job.path, job.token),
+                )
+                if cursor.rowcount == 0:
+                    lost.append(job)
+        return lost
+
+    def complete(self, job: Job, output: Path | None) -> bool:
+        """Marks a leased job as done. Returns False if the lease was lost."""
+        return self._complete(job, "done", output and self.relative(output), error=None)
+
+    def fail(self, job: Job, error: str) -> bool:
+        return self._complete(job, "failed", None, error)
+
+    def unconvertible(self, job: Job, reason: str) -> bool:
+        """Marks a leased job as one that can never be converted, see
+        NothingToConvert."""
+        return self._complete(job, "unconvertible", None, reason)
+
+    def finished_since(
+        self, seq: int
+    ) -> list[tuple[int, str, str, str | None, str | None]]:
+        """Returns (seq, path, status, output, error) of jobs finished after seq."""
+        with self._lock:
+            return self._connection.execute(
+                """
+                SELECT finished_seq, path, status, output, error FROM jobs
+                WHERE finished_seq > ? ORDER BY finished_seq
+                """,
+                (seq,),
+            ).fetchall()
+
+    def status(self, path: str) -> tuple[str, str | None, str | None] | None:
+        """Returns (status, output, error) for a path."""
+        with self._lock:
+            return self._connection.execute(
+                "SELECT status, output, error FROM jobs WHERE path = ?", (path,)
+            ).fetchone()
+
+    def last_finished(self) -> int:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT coalesce(max(finished_seq), 0) FROM jobs"
+            ).fetchone()[0]
+
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            return dict(
+                self._connection.execute(
+                    "SELECT status, count(*) FROM jobs GROUP BY status"
+                ).fetchall()
+            )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def __enter__(self) -> WorkQueue:
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _complete(
+        self, job: Job, status: str, output: str | None, error: str | None
+    ) -> bool:
+        with self._transaction() as connection:
+            row = connection.execute(
+                "SELECT token, status FROM jobs WHERE path = ?", (job.path,)
+            ).fetchone()
+            if row is None or row != (job.token, "leased"):
+                return False
+            self._finish(connection, job.path, status, output, error)
+        return True
+
+    @staticmethod
+    def _finish(
+        connection: sqlite3.Connection,
+        path: str,
+        status: str,
+        output: str | None,
+        error: str | None,
+    ):
+        connection.execute(
+            """
+            UPDATE jobs
+            SET status = ?, output = ?, error = ?, worker = NULL, token = NULL,
+                lease_expires = NULL,
+                finished_seq = (SELECT coalesce(max(finished_seq), 0) + 1 FROM jobs)
+            WHERE path = ?
+            """,
+            (status, output, error, path),
+        )
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Holds the database's write lock, so reads and the writes based on them
+        are atomic across processes."""
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._connection
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+
+def job_priority(path: Path) -> int:
+    processor = get_processor(path)
+    if processor is None:
+        return 0
+    return default_resource_limits()[processor.resource_class].priority
+
+
+class QueueScheduler:
+    """Puts processing jobs on a WorkQueue instead of running them, with the same
+    interface as ProcessingScheduler.
+
+    The futures it returns complete once a worker has finished the job, so the
+    extract index is updated as usual. join() waits for workers to finish every
+    job submitted.
+    """
+
+    def __init__(self, queue: WorkQueue, poll_interval: float = 1.0):
+        self.queue = queue
+        self.poll_interval = poll_interval
+        self._condition = threading.Condition()
+        self._futures: dict[str, concurrent.futures.Future] = {}
+        self._seq = queue.last_finished()
+        self._shutdown = False
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+        self._thread.start()
+
+    def submit(self, path: Path) -> concurrent.futures.Future | None:
+        if get_processor(path) is None:
+            return None
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        relative = self.queue.relative(path)
+        # Registered first, so a worker finishing quickly can't be missed
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("Scheduler has been shut down")
+            self._futures[relative] = future
+        if not self.queue.enqueue(path, job_priority(path)):
+            status = self.queue.status(relative)
+            if status is None:
+                future.set_result(None)
+            else:
+                self._resolve(future, relative, *status)
+            self._forget(relative)
+        return future
+
+    def join(self):
+        """Blocks until workers have finished every submitted job."""
+        last_report = time.monotonic()
+        with self._condition:
+            while self._futures:
+                self._condition.wait(self.poll_interval)
+                if time.monotonic() - last_report > 60:
+                    logger.info(
+                        f"Waiting for workers to finish {len(self._futures)} jobs"
+                    )
+                    last_report = time.monotonic()
+
+    def shutdown(self, wait: bool = True):
+        if wait:
+            self.join()
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def __enter__(self) -> QueueScheduler:
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def _resolve(
+        self,
+        future: concurrent.futures.Future,
+        path: str,
+        status: str,
+        output: str | None,
+        error: str | None,
+    ):
+        if status == "done":
+            future.set_result(None if output is None else self.queue.root / output)
+        elif status == "unconvertible":
+            future.set_exception(NothingToConvert(error))
+        else:
+            logger.warning(f"Failed to process {path}: {error}")
+            future.set_exception(RuntimeError(error))
+
+    def _forget(self, path: str):
+        """Stops waiting for a job, once its future's done callbacks have run, so
+        join() returns only after the extract index has been updated."""
+        with self._condition:
+            self._futures.pop(path, None)
+            self._condition.notify_all()
+
+    def _poll(self):
+        while True:
+            with self._condition:
+                if self._shutdown:
+                    return
+            for seq, path, status, output, error in self.queue.finished_since(
+                self._seq
+            ):
+                self._seq = seq
+                with self._condition:
+                    future = self._futures.get(path)
+                if future is not None:
+                    self._resolve(future, path, status, output, error)
+                    self._forget(path)
+            time.sleep(self.poll_interval)
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class QueueWorker:
+    """Leases jobs from a WorkQueue and processes them until stopped."""
+
+    def __init__(
+        self,
+        queue: WorkQueue,
+        workers: int | None = None,
+        lease: float = 120.0,
+        poll_interval: float = 1.0,
+        worker_id: str | None = None,
+    ):
+        self.queue = queue
+        self.workers = workers or os.cpu_count() or 1
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.worker_id = worker_id or default_worker_id()
+        self.processed = 0
+        self._lock = threading.Lock()
+        self._held: dict[str, Job] = {}
+        self._stop = threading.Event()
+        # Set once every job in progress has finished, to stop heartbeats
+        self._done = threading.Event()
+
+    def run(self, exit_when_empty: bool = False):
+        logger.info(f"Worker {self.worker_id} processing {self.queue.root}")
+        heartbeat = threading.Thread(target=self._heartbeat, daemon=True)
+        heartbeat.start()
+        # Thread.join() isn't used to wait, since on some Python versions a join
+        # interrupted by Ctrl-C marks the thread as finished while it still runs
+        finished = [threading.Event() for _ in range(self.workers)]
+        for done in finished:
+            threading.Thread(target=self._work, args=(exit_when_empty, done)).start()
+        try:
+            for done in finished:
+                done.wait()
+        finally:
+            # When interrupted, jobs in progress are finished, with their leases
+            # renewed, before the caller can close the queue
+            self._stop.set()
+            if not all(done.is_set() for done in finished):
+                logger.info("Stopping once the jobs in progress finish")
+            for done in finished:
+                done.wait()
+            self._done.set()
+            heartbeat.join()
+        logger.info(f"Worker {self.worker_id} processed {self.processed} files")
+
+    def stop(self):
+        self._stop.set()
+
+    def _work(self, exit_when_empty: bool, finished: threading.Event):
+        try:
+            while not self._stop.is_set():
+                job = self.queue.lease(self.worker_id, self.lease)
+                if job is None:
+                    if exit_when_empty and not self._pending():
+                        return
+                    self._stop.wait(self.poll_interval)
+                    continue
+                with self._lock:
+                    self._held[job.path] = job
+                try:
+                    self._process(job)
+                finally:
+                    with self._lock:
+                        self._held.pop(job.path, None)
+        finally:
+            finished.set()
+
+    def _process(self, job: Job):
+        path = self.queue.root / job.path
+        processor = get_processor(path)
+        try:
+            if processor is None:
+                raise ValueError(f"No processor for {job.path}")
+            output = processor.run(path)
+        except NothingToConvert as e:
+            logger.debug(f"Not converting {job.path}: {e}")
+            self.queue.unconvertible(job, str(e))
+            return
+        except Exception as e:
+            logger.warning(f"Failed to process {job.path}: {e!r}")
+            self.queue.fail(job, repr(e))
+            return
+        if output is None:
+            self.queue.fail(job, "Processor failed")
+        elif self.queue.complete(job, output):
+            with self._lock:
+                self.processed += 1
+        else:
+            logger.warning(f"Lost the lease on {job.path}, discarding the result")
+
+    def _pending(self) -> bool:
+        counts = self.queue.counts()
+        return counts.get("pending", 0) + counts.get("leased", 0) > 0
+
+    def _heartbeat(self):
+        while not self._done.wait(self.lease / HEARTBEATS_PER_LEASE):
+            with self._lock:
+                jobs = list(self._held.values())
+            if not jobs:
+                continue
+            for job in self.queue.renew(jobs, self.lease):
+                logger.warning(f"Lease on {job.path} expired before renewal")
@@ -0,0 +1,103 @@
+import email.utils
+import threading
+import time
+import types
+
+import pytest
+
+from relive_dm import concurrency
+from relive_dm.concurrency import ConcurrencyController, retry_after_delay
+
+
+def throttle_burst(controller: ConcurrencyController, requests: int):
+    """Sends requests in parallel that are all throttled."""
+    barrier = threading.Barrier(requests)
+
+    def request():
+        with controller.slot():
+            barrier.wait(5)
+        controller.record_throttled("HTTP 429")
+
+    threads = [threading.Thread(target=request) for _ in range(requests)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_burst_of_throttling_decreases_once():
+    controller = ConcurrencyController(minimum=1, maximum=32, initial=16)
+    throttle_burst(controller, 16)
+    assert controller.limit == 8
+
+
+def test_throttling_after_decrease_decreases_again():
+    controller = ConcurrencyController(minimum=1, maximum=32, initial=16)
+    throttle_burst(controller, 16)
+    throttle_burst(controller, 8)
+    assert controller.limit == 4
+
+
+def test_throttling_without_slot_always_decreases():
+    controller = ConcurrencyController(minimum=1, maximum=32, initial=16)
+    controller.record_throttled("connection reset")
+    controller.record_throttled("connection reset")
+    assert controller.limit == 4
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Makes every window take one second, so throughput follows the limit."""
+    ticks = iter(range(1_000_000))
+    fake_time = types.SimpleNamespace(
+        monotonic=lambda: float(next(ticks)), time=time.time
+    )
+    monkeypatch.setattr(concurrency, "time", fake_time)
+
+
+def complete_window(controller: ConcurrencyController, latency: float):
+    for _ in range(controller.limit):
+        controller.record_success(1024, latency)
+
+
+def test_increases_while_latency_is_steady(clock):
+    controller = ConcurrencyController(minimum=1, maximum=8, initial=2)
+    for _ in range(3):
+        complete_window(controller, 0.1)
+    assert controller.limit == 5
+
+
+def test_latency_rise_decreases(clock):
+    controller = ConcurrencyController(minimum=1, maximum=32, initial=4)
+    complete_window(controller, 0.1)
+    complete_window(controller, 1.0)
+    assert controller.limit == 2
+
+
+def test_one_fast_response_is_forgotten(clock):
+    controller = ConcurrencyController(minimum=1, maximum=64, initial=4)
+    controller.record_success(1024, 0.001)
+    # Steady latency well above the outlier, over more windows than are kept
+    for _ in range(20):
+        complete_window(controller, 0.1)
+    limit = controller.limit
+    complete_window(controller, 0.1)
+    assert controller.limit == limit + 1
+
+
+@pytest.mark.parametrize(
+    "value, delay",
+    [("120", 120.0), (" 5 ", 5.0), ("", None), ("soon", None), ("-1", None)],
+)
+def test_retry_after_seconds(value, delay):
+    assert retry_after_delay(value) == delay
+
+
+def test_retry_after_http_date():
+    value = email.utils.formatdate(time.time() + 30, usegmt=True)
+    delay = retry_after_delay(value)
+    assert delay is not None and 28 <= delay <= 30
+
+
+def test_retry_after_past_date_is_immediate():
+    assert retry_after_delay("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
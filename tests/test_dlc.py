@@ -0,0 +1,74 @@
+import pytest
+
+from benchmarks.fixtures import FixtureParams, generate_fixtures
+from benchmarks.mock_server import MockGameServer
+from relive_dm import download
+from relive_dm.dlc import download_dlc, load_dlc_config
+from relive_dm.download import DownloadError
+
+
+@pytest.fixture(scope="module")
+def game_server(tmp_path_factory):
+    params = FixtureParams(
+        tables=1,
+        rows=5,
+        patches=1,
+        textures=1,
+        texture_size=1024,
+        dlc_categories=2,
+        dlc_entries=3,
+        dlc_entry_size=1024,
+    )
+    fixtures = generate_fixtures(tmp_path_factory.mktemp("fixtures"), params)
+    with MockGameServer(fixtures[:1]) as server:
+        yield server
+
+
+@pytest.mark.parametrize("max_download_threads", [1, 4])
+def test_failed_entries_are_not_recorded(
+    game_server, tmp_path, monkeypatch, max_download_threads
+):
+    (server,) = game_server.servers
+    fetch_zip = download.fetch_zip
+
+    def failing_fetch(url, *args, **kwargs):
+        if url.endswith("_category1_1_a.zip"):
+            raise OSError("connection reset")
+        return fetch_zip(url, *args, **kwargs)
+
+    monkeypatch.setattr(download, "fetch_zip", failing_fetch)
+    with pytest.raises(DownloadError) as e:
+        download_dlc(
+            server.entry_url,
+            server.lang_id,
+            tmp_path,
+            lazy=True,
+            max_download_threads=max_download_threads,
+        )
+    failed = {item.entry for item in e.value.failed}
+    assert "dlc:category1:1:a" in failed
+    if max_download_threads > 1:
+        assert failed == {"dlc:category1:1:a"}
+    config = load_dlc_config(tmp_path)
+    assert config.version == 0
+    downloaded = {
+        f"dlc:{category}:{entry.id}:{entry.version}"
+        for category, entries in config.downloaded.items()
+        for entry in entries
+    }
+    assert len(downloaded) + len(failed) == 6
+    assert not downloaded & failed
+
+    # Only the failed entries are downloaded again
+    monkeypatch.setattr(download, "fetch_zip", fetch_zip)
+    items = download_dlc(
+        server.entry_url,
+        server.lang_id,
+        tmp_path,
+        lazy=True,
+        max_download_threads=max_download_threads,
+    )
+    assert {item.entry for item in items} == failed
+    config = load_dlc_config(tmp_path)
+    assert config.version > 0
+    assert sum(len(entries) for entries in config.downloaded.values()) == 6
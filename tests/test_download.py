@@ -0,0 +1,106 @@
+import time
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from relive_dm import download
+from relive_dm.download import DownloadItem, download_zips
+from relive_dm.index import INDEX_FILE_NAME
+
+# Later archives overwrite some members of earlier ones
+ARCHIVES = {
+    "1.zip": {"a.txt": b"1a", "b.txt": b"1b", "c.txt": b"1c"},
+    "2.zip": {"b.txt": b"2b", "d/e.txt": b"2e"},
+    "3.zip": {"a.txt": b"3a", "d/e.txt": b"3e", "f.txt": b"3f"},
+}
+URL = "http://server.test/patch"
+
+
+class RecordingScheduler:
+    """Records what each processed file contained when it was submitted."""
+
+    def __init__(self, base_path: Path):
+        self.base_path = base_path
+        self.processed: list[tuple[str, bytes]] = []
+
+    def submit(self, path: Path) -> None:
+        self.processed.append(
+            (path.relative_to(self.base_path).as_posix(), path.read_bytes())
+        )
+
+    def join(self):
+        pass
+
+    def shutdown(self, wait: bool = True):
+        pass
+
+
+@pytest.fixture
+def fetched(tmp_path, monkeypatch) -> list[str]:
+    """Serves the archives, with the first one finishing last."""
+    server = tmp_path / "server"
+    server.mkdir()
+    for name, members in ARCHIVES.items():
+        with zipfile.ZipFile(server / name, "w") as z:
+            for member, data in members.items():
+                z.writestr(member, data)
+    completed: list[str] = []
+
+    def fetch_zip(url, base_path, progress=None, controller=None):
+        name = url.rsplit("/", 1)[1]
+        if name == "1.zip":
+            time.sleep(0.2)
+        zip_path = base_path / "raw" / "patch" / name
+        zip_path.parent.mkdir(parents=True, exist_ok=True)
+        zip_path.write_bytes((server / name).read_bytes())
+        completed.append(name)
+        return zip_path
+
+    monkeypatch.setattr(download, "fetch_zip", fetch_zip)
+    return completed
+
+
+def read_tree(base_path: Path) -> dict[str, bytes]:
+    return {
+        relative: path.read_bytes()
+        for path in base_path.glob("**/*")
+        if path.is_file()
+        and not (relative := path.relative_to(base_path).as_posix()).startswith(
+            ("raw/", INDEX_FILE_NAME)
+        )
+    }
+
+
+def run_download(base_path: Path, ordered: bool) -> RecordingScheduler:
+    scheduler = RecordingScheduler(base_path)
+    items = [DownloadItem(f"{URL}/{name}", size) for size, name in enumerate(ARCHIVES)]
+    download_zips(
+        items,
+        base_path,
+        len(items) if ordered else 1,
+        scheduler,
+        ordered=ordered,
+    )
+    return scheduler
+
+
+def test_ordered_matches_sequential_extraction(tmp_path, fetched):
+    sequential = run_download(tmp_path / "sequential", ordered=False)
+    assert fetched == list(ARCHIVES)
+    fetched.clear()
+    ordered = run_download(tmp_path / "ordered", ordered=True)
+    assert fetched[-1] == "1.zip"
+
+    expected = read_tree(tmp_path / "sequential")
+    assert read_tree(tmp_path / "ordered") == expected
+    # Only the final contents of each path are processed
+    assert sorted(ordered.processed) == sorted(expected.items())
+    assert len(sequential.processed) > len(ordered.processed)
+
+    # Nothing is extracted or processed again when the archives are unchanged
+    fetched.clear()
+    rerun = run_download(tmp_path / "ordered", ordered=True)
+    assert sorted(fetched) == sorted(ARCHIVES)
+    assert rerun.processed == []
+    assert read_tree(tmp_path / "ordered") == expected
@@ -0,0 +1,42 @@
+import platform
+import random
+
+import pytest
+
+from relive_dm.images import decode_pvr, encode_pvr, process_pvr
+from relive_dm.processing import NothingToConvert
+
+
+@pytest.fixture
+def texture() -> bytes:
+    rng = random.Random(0)
+    return b"PVR\x03" + rng.randbytes(4096)
+
+
+@pytest.mark.parametrize("key_index", [None, 0, 7, 15])
+def test_round_trip(texture, key_index):
+    encoded = encode_pvr(texture, key_index)
+    assert encoded != texture
+    assert decode_pvr(encoded) == texture
+
+
+def test_uncompressed_data_is_unchanged(texture):
+    assert decode_pvr(texture) == texture
+    assert decode_pvr(b"") == b""
+
+
+def test_rejects_data_too_short_to_encrypt():
+    with pytest.raises(ValueError):
+        encode_pvr(b"", 0)
+
+
+def test_decodes_in_place_where_conversion_is_unsupported(
+    tmp_path, texture, monkeypatch
+):
+    monkeypatch.setattr(platform, "system", lambda: "Darwin")
+    path = tmp_path / "a.pvr"
+    path.write_bytes(encode_pvr(texture, 3))
+    with pytest.raises(NothingToConvert):
+        process_pvr(path)
+    assert path.read_bytes() == texture
+    assert not path.with_suffix(".png").exists()
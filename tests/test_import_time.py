@@ -0,0 +1,24 @@
+import subprocess
+import sys
+
+from benchmarks.import_time import BUDGET_MS, HEAVY_MODULES, measure_import
+
+
+def test_cli_does_not_import_heavy_modules():
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, relive_dm.main; print('\\n'.join(sys.modules))",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imported = set(result.stdout.splitlines())
+    assert [module for module in HEAVY_MODULES if module in imported] == []
+
+
+def test_cli_import_time_within_budget():
+    best = min(measure_import("relive_dm.main")[0] for _ in range(3))
+    assert best < BUDGET_MS
@@ -0,0 +1,210 @@
+import concurrent.futures
+import os
+import sqlite3
+import zipfile
+import zlib
+from pathlib import Path
+
+import pytest
+
+from relive_dm.index import INDEX_FILE_NAME, ExtractIndex
+from relive_dm.processing import NothingToConvert, ProcessingScheduler
+
+SOURCE = "raw/patch/1.zip"
+
+
+@pytest.fixture
+def index(tmp_path):
+    with ExtractIndex(tmp_path) as index:
+        yield index
+
+
+def write(index: ExtractIndex, path: str, data: bytes = b"data") -> Path:
+    full_path = index.base_path / path
+    full_path.parent.mkdir(parents=True, exist_ok=True)
+    full_path.write_bytes(data)
+    return full_path
+
+
+def resolved(result: Path | None = None, error: Exception | None = None):
+    future: concurrent.futures.Future = concurrent.futures.Future()
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+    return future
+
+
+def status(index: ExtractIndex, path: str) -> str | None:
+    entry = index.get(path)
+    return entry and entry[3]
+
+
+def test_pending_until_processed(index):
+    write(index, "a.txt")
+    index.mark_extracted("a.txt", SOURCE, 1, 4)
+    assert status(index, "a.txt") == "pending"
+    assert not index.is_current("a.txt", 1, 4)
+    index.track("a.txt", None)
+    assert status(index, "a.txt") == "done"
+    assert index.is_current("a.txt", 1, 4)
+    assert not index.is_current("a.txt", 2, 4)
+    assert not index.is_current("a.txt", 1, 5)
+
+
+def test_converted_output_must_be_unchanged(index):
+    write(index, "a.pvr")
+    output = write(index, "a.png", b"png")
+    index.mark_extracted("a.pvr", SOURCE, 1, 4)
+    index.track("a.pvr", resolved(output))
+    assert index.get("a.pvr") == (SOURCE, 1, 4, "done", "a.png")
+    assert index.is_current("a.pvr", 1, 4)
+
+    output.write_bytes(b"other")
+    assert not index.is_current("a.pvr", 1, 4)
+    index.mark_processed("a.pvr", output)
+    assert index.is_current("a.pvr", 1, 4)
+
+    output.unlink()
+    assert not index.is_current("a.pvr", 1, 4)
+
+
+def test_source_must_be_unchanged(index):
+    path = write(index, "a.txt")
+    index.mark_extracted("a.txt", SOURCE, 1, 4)
+    index.mark_processed("a.txt", None)
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert not index.is_current("a.txt", 1, 4)
+
+
+def test_failed_is_not_current(index):
+    write(index, "a.pvr")
+    index.mark_extracted("a.pvr", SOURCE, 1, 4)
+    index.track("a.pvr", resolved(None))
+    assert status(index, "a.pvr") == "failed"
+    assert not index.is_current("a.pvr", 1, 4)
+    index.track("a.pvr", resolved(error=RuntimeError("converter crashed")))
+    assert status(index, "a.pvr") == "failed"
+
+
+def test_unconvertible_is_current(index):
+    write(index, "a.pvr", b"")
+    index.mark_extracted("a.pvr", SOURCE, 0, 0)
+    index.track("a.pvr", resolved(error=NothingToConvert("empty")))
+    assert status(index, "a.pvr") == "unconvertible"
+    assert index.is_current("a.pvr", 0, 0)
+    assert not index.is_current("a.pvr", 1, 4)
+
+
+def test_skipped_is_current_only_without_conversion(index):
+    write(index, "a.pvr")
+    index.mark_extracted("a.pvr", SOURCE, 1, 4)
+    index.mark_skipped("a.pvr")
+    assert index.is_current("a.pvr", 1, 4, convert=False)
+    assert not index.is_current("a.pvr", 1, 4, convert=True)
+
+
+@pytest.mark.parametrize("mark", ["mark_virtual", "mark_excluded"])
+def test_left_in_archive_is_not_current(index, mark):
+    getattr(index, mark)("a.txt", SOURCE, 1, 4)
+    assert not index.is_current("a.txt", 1, 4)
+    assert index.paths() == []
+    assert index.paths(extracted=False) == ["a.txt"]
+
+
+def test_catalog_joins_archive_entry(index):
+    write(index, "src/a.txt")
+    index.record_archive(SOURCE, "https://example.com/1.zip", "patch_main:1:1", 10)
+    index.mark_extracted("src/a.txt", SOURCE, 1, 4)
+    index.mark_excluded("src/b.txt", SOURCE, 2, 4)
+    index.mark_extracted("other.txt", "raw/patch/2.zip", 3, 4)
+    entries = index.catalog("src/")
+    assert [(entry.path, entry.entry, entry.status) for entry in entries] == [
+        ("src/a.txt", "patch_main:1:1", "pending"),
+        ("src/b.txt", "patch_main:1:1", "excluded"),
+    ]
+    assert entries[0].server == index.base_path.name
+
+
+def test_upgrades_index_without_stamps(tmp_path):
+    connection = sqlite3.connect(tmp_path / INDEX_FILE_NAME)
+    connection.execute(
+        """
+        CREATE TABLE files (
+            path TEXT PRIMARY KEY,
+            source TEXT NOT NULL,
+            crc INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            output TEXT
+        )
+        """
+    )
+    connection.execute(
+        "INSERT INTO files VALUES ('a.pvr', ?, 1, 4, 'done', 'a.png')", (SOURCE,)
+    )
+    connection.commit()
+    connection.close()
+    with ExtractIndex(tmp_path) as index:
+        write(index, "a.pvr")
+        output = write(index, "a.png")
+        # Without a stamp, existing files are trusted
+        assert index.is_current("a.pvr", 1, 4)
+        output.unlink()
+        assert not index.is_current("a.pvr", 1, 4)
+
+
+def test_empty_texture_is_recorded_as_unconvertible(index):
+    path = write(index, "a.pvr", b"")
+    index.mark_extracted("a.pvr", SOURCE, 0, 0)
+    with ProcessingScheduler(max_workers=1) as scheduler:
+        index.track("a.pvr", scheduler.submit(path))
+    assert status(index, "a.pvr") == "unconvertible"
+    assert index.is_current("a.pvr", 0, 0)
+
+
+def write_zip(base_path: Path, source: str, files: dict[str, bytes], mtime: int):
+    path = base_path / source
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with zipfile.ZipFile(path, "w") as z:
+        for name, data in files.items():
+            z.writestr(name, data)
+    os.utime(path, (mtime, mtime))
+
+
+def test_members_follow_recorded_archive_order(index):
+    # Downloaded in parallel, so the later patch finished first
+    write_zip(index.base_path, "raw/patch/1.zip", {"a.txt": b"1", "b.txt": b"1"}, 2000)
+    write_zip(index.base_path, "raw/patch/2.zip", {"a.txt": b"2"}, 1000)
+    # Predates the catalog, so comes before every recorded archive
+    write_zip(index.base_path, "raw/patch/0.zip", {"a.txt": b"0", "c.txt": b"0"}, 3000)
+    index.record_archive("raw/patch/1.zip", "", "patch_main:1:1", 0)
+    index.record_archive("raw/patch/2.zip", "", "patch_main:2:1", 0)
+    members = index.find_archive_members()
+    assert {path: source for path, (source, _, _) in members.items()} == {
+        "a.txt": "raw/patch/2.zip",
+        "b.txt": "raw/patch/1.zip",
+        "c.txt": "raw/patch/0.zip",
+    }
+    assert all(status is None for _, _, status in members.values())
+
+
+def test_catalogs_legacy_archives_by_mtime(tmp_path):
+    # Extracted before the catalog existed
+    write_zip(tmp_path, "raw/patch/1.zip", {"a.txt": b"1"}, 1000)
+    write_zip(tmp_path, "raw/patch/2.zip", {"a.txt": b"2"}, 2000)
+    (tmp_path / "a.txt").write_bytes(b"2")
+    with ExtractIndex(tmp_path) as index:
+        index.ensure_catalog()
+        assert [source for source, *_ in index.archives()] == [
+            "raw/patch/1.zip",
+            "raw/patch/2.zip",
+        ]
+        assert index.get("a.txt") == (
+            "raw/patch/2.zip",
+            zlib.crc32(b"2"),
+            1,
+            "pending",
+            None,
+        )
@@ -0,0 +1,110 @@
+from typing import Any
+
+import pytest
+
+from relive_dm.lua import (
+    INTERN_MAX_LENGTH,
+    dump_lua_table,
+    read_lua_prototype,
+    read_lua_table,
+)
+
+INTS = [0, 1, -1, 0x7FFF, -0x8000, 0x8000, -0x8001, -70000, 2**31 - 1, -(2**31)]
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        {},
+        {1: "a", 2: "b", 3: "c"},
+        {"id": 1, "name": "Karen", "rate": 0.5, "active": True, "hidden": False},
+        {"ints": {i: value for i, value in enumerate(INTS)}},
+        {value: str(value) for value in INTS},
+        {"nested": {"deeper": {"deepest": {"value": -70000}}}, 1.5: "float key"},
+        # Enough strings that some keys can't be referenced by a TSETS operand
+        {f"key{i}": {"value": i} for i in range(300)},
+        {True: "yes", False: "no"},
+        {"unicode": "舞台少女"},
+    ],
+)
+def test_round_trip(value):
+    assert read_lua_table(dump_lua_table(value)) == value
+
+
+@pytest.mark.parametrize("value", INTS + [0.25, "text", True, False, None])
+def test_round_trip_returned_scalar(value):
+    assert read_lua_table(dump_lua_table(value)) == value
+
+
+def test_nil_entries_are_left_out():
+    assert read_lua_table(dump_lua_table({"a": 1, "b": None})) == {"a": 1}
+
+
+def bytecode(body: bytes) -> bytes:
+    return b"\x1bLJ\x02\x02" + bytes([len(body)]) + body
+
+
+def test_negative_numeric_constant_is_sign_extended():
+    # KNUM 0 0; RET1 0; with the number constant 0xFFFEEE90 << 1
+    data = bytecode(
+        bytes([0, 0, 1, 0, 0, 1, 2])
+        + bytes.fromhex("2a000000 4c000000")
+        + bytes.fromhex("a0baf7ff1f")
+    )
+    assert read_lua_table(data) == -70000
+
+
+def test_negative_template_integer_is_sign_extended():
+    # TDUP 0 0; RET1 0; with the template {v = 0xFFFEEE90}
+    data = bytecode(
+        bytes([0, 0, 1, 0, 1, 0, 2])
+        + bytes.fromhex("35000000 4c000000")
+        + bytes.fromhex("01 00 01 06")
+        + b"v"
+        + bytes.fromhex("03 90ddfbff0f")
+    )
+    assert read_lua_table(data) == {"v": -70000}
+
+
+@pytest.mark.parametrize("value", [2**31, -(2**31) - 1])
+def test_rejects_integers_outside_int32(value):
+    with pytest.raises(ValueError):
+        dump_lua_table({"value": value})
+    with pytest.raises(ValueError):
+        dump_lua_table({"nested": {}, "value": value, "table": {"value": value}})
+
+
+def test_rejects_unsupported_types():
+    with pytest.raises(TypeError):
+        dump_lua_table({"value": [1, 2]})  # type: ignore[dict-item]
+
+
+def test_unchanged_tables_share_their_template():
+    value: dict[Any, Any] = {1: {"id": 1, "name": "a"}, 2: {"id": 2, "sub": {"x": 1}}}
+    prototype = read_lua_prototype(dump_lua_table(value))
+    templates = [c for c in prototype.complex_constants if isinstance(c, dict)]
+    table: Any = prototype.run()
+    # Row 1 is never changed, row 2 has sub set after being copied
+    assert any(table[1] is template for template in templates)
+    assert not any(table[2] is template for template in templates)
+    assert any(table[2]["sub"] is template for template in templates)
+    assert table == value
+    assert prototype.run() == value
+
+
+def test_strings_are_interned_across_tables():
+    strings: dict[str, str] = {}
+    long = "x" * (INTERN_MAX_LENGTH + 1)
+    first: Any = read_lua_table(
+        dump_lua_table({1: {"kind": "normal", "text": long}}), strings
+    )
+    second: Any = read_lua_table(
+        dump_lua_table({2: {"kind": "normal", "text": long}}), strings
+    )
+    assert first == {1: {"kind": "normal", "text": long}}
+    assert second == {2: {"kind": "normal", "text": long}}
+    assert next(iter(first[1])) is next(iter(second[2]))
+    assert first[1]["kind"] is second[2]["kind"]
+    # Long strings are left out
+    assert first[1]["text"] is not second[2]["text"]
+    assert long not in strings
@@ -0,0 +1,57 @@
+from importlib.metadata import EntryPoint
+
+import pytest
+import typer
+from typer.testing import CliRunner
+
+from relive_dm import main
+
+plugin_app = typer.Typer()
+
+
+@plugin_app.command()
+def first():
+    print("first")
+
+
+@plugin_app.command()
+def second():
+    print("second")
+
+
+def greet(name: str):
+    print(f"Hello {name}")
+
+
+@pytest.fixture
+def plugins(monkeypatch):
+    entry_points = {
+        name: EntryPoint(name, f"tests.test_main:{attribute}", "relive_dm.commands")
+        for name, attribute in [("greet", "greet"), ("tools", "plugin_app")]
+    }
+    monkeypatch.setattr(main, "plugin_commands", lambda: entry_points)
+    return entry_points
+
+
+def test_runs_function_plugin(plugins):
+    result = CliRunner().invoke(main.app, ["greet", "world"])
+    assert result.exit_code == 0, result.output
+    assert "Hello world" in result.output
+
+
+def test_runs_typer_app_plugin(plugins):
+    result = CliRunner().invoke(main.app, ["tools", "second"])
+    assert result.exit_code == 0, result.output
+    assert "second" in result.output
+
+
+def test_lists_plugins_after_builtin_commands(plugins):
+    result = CliRunner().invoke(main.app, ["--help"])
+    assert result.exit_code == 0, result.output
+    assert result.output.index("list-servers") < result.output.index("greet")
+    assert "tools" in result.output
+
+
+def test_unknown_command_still_fails(plugins):
+    result = CliRunner().invoke(main.app, ["missing"])
+    assert result.exit_code != 0
@@ -0,0 +1,188 @@
+import json
+from pathlib import Path
+from typing import Any
+
+import msgpack
+import yaml
+
+from relive_dm import masters
+from relive_dm.index import INDEX_FILE_NAME
+from relive_dm.lua import LuaValue, dump_lua_table, read_lua_prototype
+from relive_dm.masters import (
+    convert_dicts_to_lists,
+    get_masters_path,
+    merge_all_masters,
+    merge_masters,
+)
+
+
+def write_table(base_path: Path, table: str, value: LuaValue):
+    path = get_masters_path(base_path) / table
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(dump_lua_table(value))
+
+
+def read_outputs(out_path: Path, table: str) -> tuple:
+    name = Path(table).with_suffix("")
+    return (
+        json.loads((out_path / f"{name}.json").read_text(encoding="utf-8")),
+        yaml.safe_load(
+            (out_path / "yaml" / f"{name}.yaml").read_text(encoding="utf-8")
+        ),
+        msgpack.unpackb(
+            (out_path / "msgpack" / f"{name}.msgpack").read_bytes(),
+            strict_map_key=False,
+        ),
+    )
+
+
+def test_merges_other_servers_one_at_a_time(tmp_path, monkeypatch):
+    servers = [tmp_path / name for name in ["ja", "en", "ko"]]
+    write_table(servers[0], "Chara.luac", {1: {"name": "カレン", "tags": {1: "a"}}})
+    write_table(
+        servers[1],
+        "Chara.luac",
+        {1: {"name": {"en": "Karen"}}, 2: {"name": {"en": "Hikari"}}},
+    )
+    write_table(servers[2], "Chara.luac", {1: {"name": {"ko": "카렌"}}})
+    events = []
+    read_lua_table = masters.read_lua_table
+    merge_masters = masters.merge_masters
+
+    def record_read(data, strings=None):
+        events.append("decode")
+        return read_lua_table(data, strings)
+
+    def record_merge(primary, other, default_key="ja"):
+        events.append("merge")
+        return merge_masters(primary, other, default_key)
+
+    monkeypatch.setattr(masters, "read_lua_table", record_read)
+    monkeypatch.setattr(masters, "merge_masters", record_merge)
+    assert merge_all_masters(servers, tmp_path / "out") == ["Chara.luac"]
+    assert events == ["decode", "merge", "decode", "merge"]
+    expected = {
+        "1": {"name": {"ja": "カレン", "en": "Karen", "ko": "카렌"}, "tags": ["a"]},
+        "2": {"name": {"en": "Hikari"}},
+    }
+    json_data, yaml_data, msgpack_data = read_outputs(tmp_path / "out", "Chara.luac")
+    assert json_data == expected
+    assert yaml_data == {int(k): v for k, v in expected.items()}
+    assert msgpack_data == yaml_data
+
+
+def test_merges_read_only_tree_without_index(tmp_path):
+    source = tmp_path / "source"
+    write_table(source, "Chara.luac", {1: {"name": "Karen"}})
+    write_table(source, "Event/Stage.luac", {1: {"name": "Tokyo"}})
+    for path in [source, *source.rglob("*")]:
+        if path.is_dir():
+            path.chmod(0o555)
+    try:
+        assert merge_all_masters([source], tmp_path / "out") == [
+            "Chara.luac",
+            "Event/Stage.luac",
+        ]
+    finally:
+        for path in [source, *source.rglob("*")]:
+            if path.is_dir():
+                path.chmod(0o755)
+    assert not (source / INDEX_FILE_NAME).exists()
+    assert read_outputs(tmp_path / "out", "Event/Stage.luac")[0] == {
+        "1": {"name": "Tokyo"}
+    }
+
+
+TABLES: dict[str, LuaValue] = {
+    "Chara.luac": {
+        1: {"name": "カレン", "skills": {1: 10, 2: 20}, "stats": {"hp": 100}},
+        2: {"name": "Hikari", "skills": {1: 30}, "stats": {"hp": -70000}},
+        10: {"name": "Mahiru", "rate": 0.25, "enabled": False},
+    },
+    "Config.luac": {"max_level": 80, "motd": "line one\nline two", "ratio": 1.5},
+    "Empty.luac": {},
+    "Nested/Stage.luac": {i: {"id": i, "tags": {1: f"tag{i}"}} for i in range(1, 300)},
+}
+
+
+def write_outputs(tmp_path: Path, name: str, stream: bool, monkeypatch) -> Path:
+    base_path = tmp_path / "ja"
+    for table, value in TABLES.items():
+        write_table(base_path, table, value)
+    if not stream:
+        monkeypatch.setattr(masters, "stream_master", lambda *args: False)
+    streamed = []
+    stream_master = masters.stream_master
+
+    def record_stream(prototype, table, *args):
+        written = stream_master(prototype, table, *args)
+        if written:
+            streamed.append(table)
+        return written
+
+    monkeypatch.setattr(masters, "stream_master", record_stream)
+    out_path = tmp_path / name
+    assert merge_all_masters([base_path], out_path) == sorted(TABLES)
+    assert streamed == (sorted(TABLES) if stream else [])
+    monkeypatch.undo()
+    return out_path
+
+
+def test_streamed_output_matches_in_memory_output(tmp_path, monkeypatch):
+    streamed = write_outputs(tmp_path, "streamed", True, monkeypatch)
+    in_memory = write_outputs(tmp_path, "in_memory", False, monkeypatch)
+    files = sorted(
+        path.relative_to(in_memory) for path in in_memory.rglob("*") if path.is_file()
+    )
+    assert len(files) == 3 * len(TABLES)
+    for path in files:
+        assert (streamed / path).read_bytes() == (in_memory / path).read_bytes(), path
+
+
+def test_streams_table_identical_on_other_servers(tmp_path, monkeypatch):
+    servers = [tmp_path / name for name in ["ja", "en"]]
+    for base_path in servers:
+        write_table(base_path, "Config.luac", {"max_level": 80})
+    write_table(servers[0], "Chara.luac", {1: {"name": "カレン"}})
+    write_table(servers[1], "Chara.luac", {1: {"name": {"en": "Karen"}}})
+    streamed = []
+    stream_master = masters.stream_master
+
+    def record_stream(prototype, table, *args):
+        streamed.append(table)
+        return stream_master(prototype, table, *args)
+
+    monkeypatch.setattr(masters, "stream_master", record_stream)
+    assert merge_all_masters(servers, tmp_path / "out") == ["Chara.luac", "Config.luac"]
+    assert streamed == ["Config.luac"]
+    assert read_outputs(tmp_path / "out", "Config.luac")[0] == {"max_level": 80}
+    assert read_outputs(tmp_path / "out", "Chara.luac")[0] == {
+        "1": {"name": {"ja": "カレン", "en": "Karen"}}
+    }
+
+
+def test_merging_leaves_shared_rows_unchanged():
+    value: dict[Any, Any] = {
+        1: {"name": "カレン", "tags": {1: "a"}},
+        2: {"name": "まひる"},
+        3: {"name": "ひかり", "tags": {1: "b", 2: "c"}},
+    }
+    prototype = read_lua_prototype(dump_lua_table(value))
+    first: Any = prototype.run()
+    second: Any = prototype.run()
+    # Rows without tags, and the tags themselves, are the constant templates
+    assert first[2] is second[2]
+    assert first[1]["tags"] is second[1]["tags"]
+    merged = convert_dicts_to_lists(
+        merge_masters(
+            first,
+            {1: {"name": {"en": "Karen"}}, 2: {"name": {"en": "Mahiru"}}},
+        )
+    )
+    assert merged == {
+        1: {"name": {"ja": "カレン", "en": "Karen"}, "tags": ["a"]},
+        2: {"name": {"ja": "まひる", "en": "Mahiru"}},
+        3: {"name": "ひかり", "tags": ["b", "c"]},
+    }
+    assert second == value
+    assert prototype.run() == value
@@ -0,0 +1,97 @@
+import json
+import math
+import time
+
+import pytest
+
+from relive_dm.metrics import Histogram, MetricsExporter, MetricsRegistry
+
+
+@pytest.fixture
+def registry() -> MetricsRegistry:
+    registry = MetricsRegistry()
+    registry.inc("relive_dm_downloads_total", status="ok")
+    registry.inc("relive_dm_downloads_total", 2, status="error")
+    registry.set("relive_dm_download_concurrency", 4)
+    registry.observe("relive_dm_process_seconds", 0.001, suffix=".pvr")
+    registry.observe("relive_dm_process_seconds", 0.3, suffix=".pvr")
+    registry.observe("relive_dm_process_seconds", 500, suffix=".pvr")
+    registry.observe("relive_dm_process_seconds", 0.02, suffix='a"b')
+    return registry
+
+
+def test_prometheus_format(registry):
+    lines = registry.to_prometheus().splitlines()
+    assert lines[:4] == [
+        "# HELP relive_dm_downloads_total Archive downloads by outcome",
+        "# TYPE relive_dm_downloads_total counter",
+        'relive_dm_downloads_total{status="error"} 2.0',
+        'relive_dm_downloads_total{status="ok"} 1.0',
+    ]
+    assert "# TYPE relive_dm_download_concurrency gauge" in lines
+    assert "relive_dm_download_concurrency 4.0" in lines
+    assert "# TYPE relive_dm_process_seconds histogram" in lines
+    buckets = [line for line in lines if line.startswith("relive_dm_process_seconds")]
+    pvr = [line for line in buckets if 'suffix=".pvr"' in line]
+    # Buckets are cumulative, and a value on a bound falls in that bucket
+    assert pvr[0] == 'relive_dm_process_seconds_bucket{suffix=".pvr",le="0.001"} 1'
+    assert 'relive_dm_process_seconds_bucket{suffix=".pvr",le="0.5"} 2' in pvr
+    assert 'relive_dm_process_seconds_bucket{suffix=".pvr",le="120.0"} 2' in pvr
+    assert pvr[-3:] == [
+        'relive_dm_process_seconds_bucket{suffix=".pvr",le="+Inf"} 3',
+        'relive_dm_process_seconds_sum{suffix=".pvr"} 500.301',
+        'relive_dm_process_seconds_count{suffix=".pvr"} 3',
+    ]
+    assert 'relive_dm_process_seconds_count{suffix="a\\"b"} 1' in buckets
+    assert registry.to_prometheus().endswith("\n")
+
+
+def test_empty_registry_renders_nothing():
+    assert MetricsRegistry().to_prometheus() == "\n"
+
+
+def test_quantile_in_first_bucket():
+    histogram = Histogram()
+    histogram.observe(0.0004)
+    histogram.observe(0.0008)
+    # Interpolated from zero up to the largest value seen
+    assert histogram.quantile(0.5) == pytest.approx(0.0004)
+    assert histogram.quantile(1.0) == pytest.approx(0.0008)
+
+
+def test_quantile_in_infinite_bucket():
+    histogram = Histogram()
+    histogram.observe(200)
+    histogram.observe(300)
+    assert histogram.buckets[-1] == math.inf
+    # The infinite bucket is bounded by the largest value seen
+    assert histogram.quantile(0.5) == pytest.approx(210)
+    assert histogram.quantile(1.0) == 300
+    assert histogram.quantile(0.0) == 120
+
+
+def test_quantile_without_observations():
+    assert Histogram().quantile(0.5) == 0.0
+
+
+def test_exporter_writes_textfile(registry, tmp_path):
+    textfile_path = tmp_path / "metrics" / "relive_dm.prom"
+    report_path = tmp_path / "report.json"
+    exporter = MetricsExporter(textfile_path, report_path, 0.01, registry)
+    with exporter:
+        deadline = time.monotonic() + 5
+        while not textfile_path.exists() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert textfile_path.exists()
+        registry.inc("relive_dm_downloads_total", status="ok")
+    text = textfile_path.read_text()
+    # The file written when stopping has every update
+    assert 'relive_dm_downloads_total{status="ok"} 2.0\n' in text
+    assert "# TYPE relive_dm_last_update_time_seconds gauge\n" in text
+    assert text == registry.to_prometheus()
+    assert [path.name for path in textfile_path.parent.iterdir()] == [
+        textfile_path.name
+    ]
+    report = json.loads(report_path.read_text())
+    assert report["status"] == "ok"
+    assert report["stages"]["process:suffix=.pvr"]["count"] == 3
@@ -0,0 +1,85 @@
+import os
+
+import pytest
+
+from benchmarks.fixtures import FixtureParams, generate_fixtures
+from benchmarks.mock_server import (
+    MIN_APP_VER,
+    PRIVACY_POLICY_VER,
+    TERMS_OF_SERVICE_VER,
+    MockGameServer,
+)
+from relive_dm.patch import (
+    MAX_VERSION_STEP,
+    AppVersion,
+    download_patch,
+    load_patch_config,
+    save_patch_config,
+    search_version_component,
+)
+
+
+def search(threshold: int, rejected: int, batch_size: int):
+    probed: list[int] = []
+
+    def probe_all(versions: list[AppVersion]) -> list[bool]:
+        probed.extend(version[2] for version in versions)
+        return [version[2] >= threshold for version in versions]
+
+    found = search_version_component(
+        lambda n: (1, 0, n), rejected, probe_all, batch_size
+    )
+    return found, probed
+
+
+@pytest.mark.parametrize("batch_size", [1, 4, 16])
+def test_finds_smallest_accepted_value_up_to_limit(batch_size):
+    rejected = 50
+    for threshold in range(rejected + 1, rejected + MAX_VERSION_STEP + 1):
+        found, probed = search(threshold, rejected, batch_size)
+        assert found == (1, 0, threshold)
+        assert len(probed) == len(set(probed))
+
+
+@pytest.mark.parametrize("batch_size", [1, 4, 16])
+def test_gives_up_after_probing_limit(batch_size):
+    rejected = 50
+    found, probed = search(rejected + MAX_VERSION_STEP + 1, rejected, batch_size)
+    assert found is None
+    assert max(probed) == rejected + MAX_VERSION_STEP
+
+
+@pytest.fixture(scope="module")
+def game_server(tmp_path_factory):
+    params = FixtureParams(
+        tables=1, rows=5, patches=2, textures=1, dlc_categories=1, dlc_entries=1
+    )
+    fixtures = generate_fixtures(tmp_path_factory.mktemp("fixtures"), params)
+    with MockGameServer(fixtures[:1]) as server:
+        yield server
+
+
+def test_dry_run_saves_nothing_after_app_update(game_server, tmp_path):
+    (server,) = game_server.servers
+    base_path = tmp_path / server.name
+    # The default app version is older than the server requires
+    items = download_patch(server.entry_url, server.lang_id, base_path, dry_run=True)
+    assert items
+    assert not base_path.exists()
+
+
+def test_dry_run_saves_nothing_without_updates(game_server, tmp_path):
+    (server,) = game_server.servers
+    base_path = tmp_path / server.name
+    base_path.mkdir()
+    config = load_patch_config(base_path)
+    config.app_config.app_ver = MIN_APP_VER
+    config.terms_of_service_ver = TERMS_OF_SERVICE_VER
+    config.privacy_policy_ver = PRIVACY_POLICY_VER
+    config.patch.patch_main_id = config.patch.patch_main_localize_id = 1000
+    save_patch_config(base_path, config)
+    config_path = base_path / "patch_config.json"
+    os.utime(config_path, ns=(0, 0))
+    items = download_patch(server.entry_url, server.lang_id, base_path, dry_run=True)
+    assert items == []
+    assert config_path.stat().st_mtime_ns == 0
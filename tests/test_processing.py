@@ -0,0 +1,128 @@
+import threading
+from pathlib import Path
+from typing import Callable
+
+import pytest
+
+from relive_dm import processing
+from relive_dm.processing import (
+    ProcessingScheduler,
+    Processor,
+    ResourceClass,
+    ResourceLimit,
+)
+
+
+class Recorder:
+    """Handler that records the files it runs and how many run at once."""
+
+    def __init__(self, release: threading.Event | None = None):
+        self.release = release
+        self.started = threading.Event()
+        self.lock = threading.Lock()
+        self.order: list[str] = []
+        self.running = 0
+        self.max_running = 0
+
+    def __call__(self, path: Path) -> Path:
+        with self.lock:
+            self.order.append(path.name)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        self.started.set()
+        if self.release is not None:
+            assert self.release.wait(5)
+        with self.lock:
+            self.running -= 1
+        return path
+
+
+@pytest.fixture
+def register(monkeypatch):
+    def register(
+        suffix: str, handler: Callable[[Path], Path], resource_class: ResourceClass
+    ):
+        monkeypatch.setitem(
+            processing.processors, suffix, Processor(handler, resource_class)
+        )
+
+    return register
+
+
+def test_limits_workers_per_resource_class(register):
+    release = threading.Event()
+    cpu = Recorder(release)
+    io = Recorder(release)
+    register(".cpu", cpu, ResourceClass.CPU)
+    register(".io", io, ResourceClass.IO)
+    limits = {
+        ResourceClass.CPU: ResourceLimit(workers=2, priority=0),
+        ResourceClass.IO: ResourceLimit(workers=3, priority=1),
+    }
+    with ProcessingScheduler(max_workers=8, limits=limits) as scheduler:
+        futures = [scheduler.submit(Path(f"{i}.cpu")) for i in range(6)]
+        futures += [scheduler.submit(Path(f"{i}.io")) for i in range(6)]
+        # Give idle workers the chance to take more jobs than they may
+        threading.Event().wait(0.2)
+        release.set()
+    assert all(future is not None and future.done() for future in futures)
+    assert cpu.max_running == 2
+    assert io.max_running == 3
+
+
+def test_runs_lowest_priority_value_first(register):
+    release = threading.Event()
+    blocker = Recorder(release)
+    recorder = Recorder()
+    register(".block", blocker, ResourceClass.IO)
+    register(".sub", recorder, ResourceClass.SUBPROCESS)
+    register(".cpu", recorder, ResourceClass.CPU)
+    register(".io", recorder, ResourceClass.IO)
+    with ProcessingScheduler(max_workers=1) as scheduler:
+        scheduler.submit(Path("first.block"))
+        assert blocker.started.wait(5)
+        for name in ["a.io", "b.cpu", "c.sub", "d.io", "e.cpu", "f.sub"]:
+            scheduler.submit(Path(name))
+        release.set()
+    assert recorder.order == ["c.sub", "f.sub", "b.cpu", "e.cpu", "a.io", "d.io"]
+
+
+def test_round_robins_suffixes_within_class(register):
+    release = threading.Event()
+    blocker = Recorder(release)
+    recorder = Recorder()
+    register(".block", blocker, ResourceClass.CPU)
+    register(".a", recorder, ResourceClass.CPU)
+    register(".b", recorder, ResourceClass.CPU)
+    with ProcessingScheduler(max_workers=1) as scheduler:
+        scheduler.submit(Path("first.block"))
+        assert blocker.started.wait(5)
+        for name in ["1.a", "2.a", "3.a", "4.b", "5.b"]:
+            scheduler.submit(Path(name))
+        release.set()
+    assert recorder.order == ["1.a", "4.b", "2.a", "5.b", "3.a"]
+
+
+def test_failed_job_sets_exception(register):
+    def fail(path: Path) -> Path:
+        raise ValueError(path.name)
+
+    register(".fail", fail, ResourceClass.IO)
+    with ProcessingScheduler(max_workers=2) as scheduler:
+        future = scheduler.submit(Path("x.fail"))
+        assert future is not None
+        with pytest.raises(ValueError, match="x.fail"):
+            future.result(5)
+
+
+def test_unknown_suffix_is_not_scheduled():
+    with ProcessingScheduler(max_workers=1) as scheduler:
+        assert scheduler.submit(Path("readme.txt")) is None
+
+
+def test_rejects_jobs_after_shutdown(register):
+    register(".io", Recorder(), ResourceClass.IO)
+    scheduler = ProcessingScheduler(max_workers=1)
+    scheduler.shutdown()
+    with pytest.raises(RuntimeError):
+        scheduler.submit(Path("late.io"))
@@ -0,0 +1,42 @@
+import threading
+
+from relive_dm.profiling import PipelineProfiler, profile_stage
+
+
+def test_traced_stages_run_concurrently(tmp_path):
+    barrier = threading.Barrier(2)
+
+    def decode(name: str):
+        with profile_stage("merge.decode", name, 1024):
+            # Both items have to be inside the stage at once to get past this
+            barrier.wait(5)
+            bytearray(1024 * 1024)
+
+    with PipelineProfiler() as profiler:
+        threads = [threading.Thread(target=decode, args=(name,)) for name in ["a", "b"]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    peaks = sorted(item.peak_bytes is not None for item in profiler.items)
+    assert peaks == [False, True]
+    profiler.write_report(tmp_path)
+    report = (tmp_path / "profile_report.txt").read_text()
+    assert "=== merge.decode: 2 items" in report
+    assert "Memory held at the end of the item with the highest peak" in report
+
+
+def test_untraced_stage_records_timings(tmp_path):
+    with PipelineProfiler() as profiler:
+        with profile_stage("download", "1.zip", 10):
+            sum(range(1000))
+    [item] = profiler.items
+    assert (item.stage, item.item, item.size, item.peak_bytes) == (
+        "download",
+        "1.zip",
+        10,
+        None,
+    )
+    profiler.write_report(tmp_path)
+    assert (tmp_path / "download.prof").exists()
+    assert "function calls" in (tmp_path / "profile_report.txt").read_text()
@@ -0,0 +1,77 @@
+import json
+from typing import Any
+
+import pytest
+
+from relive_dm.lua import dump_lua_table, read_lua_table
+from relive_dm.repack import Framing, encode_edit, json_to_lua
+from relive_dm.xxtea import decrypt_xxtea_if_header
+
+ORIGINAL: dict[Any, Any] = {
+    1: {"name": "Karen", "rate": 0.5, "skills": {1: 10, 2: -70000}},
+    "2": "string key that looks like an integer",
+    False: "bool key",
+    1.5: "float key",
+    "nested": {2: {"enabled": False}},
+}
+
+
+def exported(value: Any) -> Any:
+    """Returns a value as it reads back after being exported as JSON."""
+    return json.loads(json.dumps(value, ensure_ascii=False))
+
+
+def test_round_trips_exported_table():
+    assert json_to_lua(exported(ORIGINAL), ORIGINAL) == ORIGINAL
+
+
+def test_new_keys_are_typed_without_original():
+    value = {"12": "a", "-5": "b", "007": "c", "1e3": "d", "name": "e", "": "f"}
+    assert json_to_lua(value) == {
+        12: "a",
+        -5: "b",
+        "007": "c",
+        "1e3": "d",
+        "name": "e",
+        "": "f",
+    }
+
+
+def test_keys_follow_original_where_it_has_them():
+    original: dict[Any, Any] = {"10": {"id": 1}, 20: {"id": 2}}
+    edited = {"10": {"id": 3}, "20": {"id": 4}, "30": {"id": 5}}
+    assert json_to_lua(edited, original) == {
+        "10": {"id": 3},
+        20: {"id": 4},
+        30: {"id": 5},
+    }
+
+
+def test_lists_become_tables_indexed_from_one():
+    # Merged masters turn list-like tables into lists
+    assert json_to_lua({"1": {"skills": [10, 20, {"a": [1]}]}}) == {
+        1: {"skills": {1: 10, 2: 20, 3: {"a": {1: 1}}}}
+    }
+    assert json_to_lua([]) == {}
+
+
+@pytest.mark.parametrize("value", ["text", 3, -70000, 0.25, True, None])
+def test_scalars_are_unchanged(value):
+    assert json_to_lua(value) == value
+
+
+@pytest.mark.parametrize("framing", [Framing(), Framing(xxtea=True)])
+def test_encodes_json_edit_as_original_bytecode(tmp_path, framing):
+    edited = exported(ORIGINAL)
+    edited["1"]["skills"]["2"] = -80000
+    edited["nested"]["3"] = {"enabled": True}
+    edit_path = tmp_path / "Chara.json"
+    edit_path.write_text(json.dumps(edited), encoding="utf-8")
+    data = encode_edit(edit_path, "Chara.luac", framing, dump_lua_table(ORIGINAL))
+    assert data.startswith(b"XXTEA") == framing.xxtea
+    table = read_lua_table(decrypt_xxtea_if_header(data))
+    assert table == {
+        **ORIGINAL,
+        1: {**ORIGINAL[1], "skills": {1: 10, 2: -80000}},
+        "nested": {2: {"enabled": False}, 3: {"enabled": True}},
+    }
@@ -0,0 +1,67 @@
+from pathlib import Path
+
+import pytest
+
+from relive_dm.variants import VariantConfig, generate_variants, load_manifest
+
+Image = pytest.importorskip("PIL.Image")
+
+CONFIG = VariantConfig(sizes=[16, 256])
+
+
+def write_png(path: Path, color: tuple[int, int, int] = (255, 0, 0)):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Image.new("RGB", (64, 32), color).save(path, format="PNG")
+
+
+@pytest.fixture
+def tree(tmp_path) -> Path:
+    write_png(tmp_path / "images" / "a.png")
+    write_png(tmp_path / "images" / "b.png", (0, 0, 255))
+    return tmp_path
+
+
+def test_generates_variants(tree):
+    report = generate_variants(tree, CONFIG, max_workers=1)
+    assert report.generated == 2
+    assert not report.failed
+    asset = load_manifest(tree).assets["images/a.png"]
+    assert (asset.width, asset.height) == (64, 32)
+    assert asset.variants == {
+        "full": "variants/images/a.full.webp",
+        "16": "variants/images/a.16.webp",
+        "256": "variants/images/a.full.webp",
+    }
+    with Image.open(tree / asset.variants["16"]) as thumbnail:
+        assert thumbnail.size == (16, 8)
+
+
+def test_skips_unchanged_sources(tree):
+    generate_variants(tree, CONFIG, max_workers=1)
+    write_png(tree / "images" / "b.png", (0, 255, 0))
+    report = generate_variants(tree, max_workers=1)
+    assert (report.generated, report.unchanged) == (1, 1)
+
+
+def test_removes_variants_of_deleted_sources(tree):
+    generate_variants(tree, CONFIG, max_workers=1)
+    variants = load_manifest(tree).assets["images/a.png"].variants
+    (tree / "images" / "a.png").unlink()
+    generate_variants(tree, max_workers=1)
+    assert "images/a.png" not in load_manifest(tree).assets
+    assert not any((tree / path).exists() for path in variants.values())
+
+
+def test_keeps_variants_when_a_source_fails(tree):
+    generate_variants(tree, CONFIG, max_workers=1)
+    variants = load_manifest(tree).assets["images/a.png"].variants
+    (tree / "images" / "a.png").write_bytes(b"not a png")
+    report = generate_variants(tree, max_workers=1)
+    assert report.failed == ["images/a.png"]
+    assert load_manifest(tree).assets["images/a.png"].variants == variants
+    assert all((tree / path).exists() for path in variants.values())
+
+    # Retried once the source is fixed
+    write_png(tree / "images" / "a.png", (0, 255, 0))
+    report = generate_variants(tree, max_workers=1)
+    assert (report.generated, report.unchanged, report.failed) == (1, 1, [])
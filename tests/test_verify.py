@@ -0,0 +1,80 @@
+import zipfile
+
+import pytest
+
+from relive_dm import download
+from relive_dm.download import extract_existing, extract_zip
+from relive_dm.filters import SyncFilter
+from relive_dm.index import ExtractIndex
+from relive_dm.patch import load_patch_config, save_patch_config
+from relive_dm.verify import verify_tree
+
+SOURCE = "raw/patch/1.zip"
+FILES = {"a.pvr": b"texture", "b.txt": b"text"}
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """A tree extracted with conversion of .pvr files turned off."""
+    sync_filter = SyncFilter(skip_conversion={".pvr"})
+    config = load_patch_config(tmp_path)
+    config.sync_filter = sync_filter
+    save_patch_config(tmp_path, config)
+    (tmp_path / SOURCE).parent.mkdir(parents=True)
+    with zipfile.ZipFile(tmp_path / SOURCE, "w") as z:
+        for name, data in FILES.items():
+            z.writestr(name, data)
+    with ExtractIndex(tmp_path) as index, zipfile.ZipFile(tmp_path / SOURCE) as z:
+        index.record_archive(SOURCE, "", "patch_main:1:1", 0)
+        extract_zip(
+            z, SOURCE, tmp_path, unexpected_conversion, index, None, False, sync_filter
+        )
+    return tmp_path
+
+
+def unexpected_conversion(path):
+    assert path.suffix != ".pvr", f"{path} was converted"
+
+
+def status(base_path, path: str) -> str | None:
+    with ExtractIndex(base_path) as index:
+        entry = index.get(path)
+    return entry and entry[3]
+
+
+@pytest.mark.parametrize("suffix", [".pvr", "pvr", ".PVR", " pvr"])
+def test_skip_conversion_suffixes_are_normalized(suffix):
+    sync_filter = SyncFilter(skip_conversion={suffix})
+    assert sync_filter.skip_conversion == {".pvr"}
+    assert not sync_filter.converts(".pvr")
+    assert sync_filter.converts(".ckb")
+
+
+def test_skipped_files_are_not_unconverted(tree):
+    assert status(tree, "a.pvr") == "skipped"
+    report = verify_tree(tree, repair=False, max_workers=1)
+    assert report.checked == 2
+    assert report.bad == []
+
+
+def test_repair_keeps_conversion_skipped(tree):
+    (tree / "a.pvr").write_bytes(b"damaged")
+    report = verify_tree(tree, max_workers=1)
+    assert report.corrupt == ["a.pvr"]
+    assert (tree / "a.pvr").read_bytes() == FILES["a.pvr"]
+    assert status(tree, "a.pvr") == "skipped"
+    assert not (tree / "a.png").exists()
+
+
+def test_extract_existing_runs_once_per_filter(tree, monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        download, "extract_zip", lambda z, source, *args, **kwargs: calls.append(source)
+    )
+    wider = SyncFilter()
+    # Patch and dlc downloads both apply the new filter to the shared tree
+    extract_existing(tree, wider)
+    extract_existing(tree, SyncFilter.model_validate_json(wider.model_dump_json()))
+    assert calls == [SOURCE]
+    extract_existing(tree, SyncFilter(skip_conversion={".ckb"}))
+    assert calls == [SOURCE, SOURCE]
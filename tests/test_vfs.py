@@ -0,0 +1,75 @@
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from relive_dm import vfs
+from relive_dm.download import extract_zip
+from relive_dm.index import ExtractIndex
+from relive_dm.vfs import AssetFileSystem
+
+
+def add_archive(base_path: Path, source: str, files: dict[str, bytes]):
+    """Adds an archive to a lazily synced tree, as downloading does."""
+    with ExtractIndex(base_path) as index:
+        path = base_path / source
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with zipfile.ZipFile(path, "w") as z:
+            for name, data in files.items():
+                z.writestr(name, data)
+        index.record_archive(source, "", None, path.stat().st_size)
+        with zipfile.ZipFile(path) as z:
+            extract_zip(z, source, base_path, lambda _: None, index, lazy=True)
+
+
+@pytest.fixture
+def tree(tmp_path):
+    add_archive(tmp_path, "raw/patch/1.zip", {"a.txt": b"old", "b.txt": b"b"})
+    add_archive(tmp_path, "raw/patch/2.zip", {"a.txt": b"new"})
+    return tmp_path
+
+
+def test_later_archives_override_earlier(tree):
+    with AssetFileSystem(tree) as fs:
+        assert fs.list() == ["a.txt", "b.txt"]
+        assert fs.read("a.txt") == b"new"
+        assert fs.source("a.txt") == "raw/patch/2.zip"
+        with fs.open("b.txt") as f:
+            assert f.read() == b"b"
+        assert not (tree / "a.txt").exists()
+
+
+def test_opens_archives_only_when_read(tree, monkeypatch):
+    opened = []
+
+    class RecordingZipFile(zipfile.ZipFile):
+        def __init__(self, file, *args, **kwargs):
+            opened.append(Path(file).name)
+            super().__init__(file, *args, **kwargs)
+
+    monkeypatch.setattr(vfs.zipfile, "ZipFile", RecordingZipFile)
+    with AssetFileSystem(tree) as fs:
+        assert fs.exists("b.txt")
+        assert opened == []
+        fs.read("b.txt")
+        fs.read("b.txt")
+        assert opened == ["1.zip"]
+
+
+def test_missing_file(tree):
+    with AssetFileSystem(tree) as fs:
+        assert not fs.exists("c.txt")
+        with pytest.raises(FileNotFoundError):
+            fs.read("c.txt")
+
+
+def test_falls_back_to_archives_without_index(tmp_path):
+    source = tmp_path / "raw" / "patch" / "1.zip"
+    source.parent.mkdir(parents=True)
+    with zipfile.ZipFile(source, "w") as z:
+        z.writestr("a.txt", b"a")
+    with ExtractIndex(tmp_path) as index:
+        # Copied in by hand after the catalog was created
+        index.ensure_catalog()
+    with AssetFileSystem(tmp_path) as fs:
+        assert fs.read("a.txt") == b"a"
@@ -0,0 +1,81 @@
+import json
+import zlib
+from pathlib import Path
+
+import pytest
+
+from relive_dm import watch
+from relive_dm.index import ExtractIndex
+from relive_dm.lua import LuaValue, dump_lua_table
+from relive_dm.masters import MASTER_PREFIX
+from relive_dm.server import ServerInfo
+from relive_dm.watch import Watcher
+
+SERVER = ServerInfo("jp_ja", "https://example.com/", 1)
+
+
+def write_table(base_path: Path, table: str, value: LuaValue):
+    """Writes a master table as if it had been extracted."""
+    data = dump_lua_table(value)
+    path = MASTER_PREFIX + table
+    (base_path / path).parent.mkdir(parents=True, exist_ok=True)
+    (base_path / path).write_bytes(data)
+    with ExtractIndex(base_path) as index:
+        index.mark_extracted(path, "raw/patch/1.zip", zlib.crc32(data), len(data))
+        index.mark_processed(path, None)
+
+
+@pytest.fixture
+def updates() -> list[dict[str, LuaValue]]:
+    """Tables each following patch download extracts."""
+    return []
+
+
+@pytest.fixture
+def watcher(tmp_path, monkeypatch, updates):
+    def download_patch(entry_url, lang_id, base_path, *args, **kwargs):
+        if not updates:
+            return []
+        for table, value in updates.pop(0).items():
+            write_table(base_path, table, value)
+        return ["patch"]
+
+    monkeypatch.setattr(watch, "download_patch", download_patch)
+    write_table(tmp_path / SERVER.name, "Chara.luac", {1: {"name": "Karen"}})
+    write_table(tmp_path / SERVER.name, "Stage.luac", {1: {"name": "Tokyo"}})
+    watcher = Watcher(tmp_path, server_list=[SERVER], dlc=False)
+    yield watcher
+    watcher.close()
+
+
+def merged(watcher: Watcher, table: str) -> dict:
+    return json.loads((watcher.path / "masters" / table).read_text(encoding="utf-8"))
+
+
+def test_merges_every_table_without_saved_crcs(watcher):
+    assert watcher.poll() == ["Chara.luac", "Stage.luac"]
+    assert watcher.poll() == []
+
+
+def test_merges_only_changed_tables(watcher, updates):
+    watcher.poll()
+    updates.append({"Chara.luac": {1: {"name": "Hikari"}}})
+    assert watcher.poll() == ["Chara.luac"]
+    assert merged(watcher, "Chara.json") == {"1": {"name": "Hikari"}}
+
+
+def test_merges_tables_synced_by_a_failed_poll(watcher, updates, monkeypatch):
+    watcher.poll()
+    updates.append({"Chara.luac": {1: {"name": "Hikari"}}})
+    merge_all_masters = watch.merge_all_masters
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(watch, "merge_all_masters", fail)
+    with pytest.raises(OSError):
+        watcher.poll()
+    monkeypatch.setattr(watch, "merge_all_masters", merge_all_masters)
+    # Nothing new to download, but the table synced by the failed poll is merged
+    assert watcher.poll() == ["Chara.luac"]
+    assert merged(watcher, "Chara.json") == {"1": {"name": "Hikari"}}
@@ -0,0 +1,157 @@
+import os
+import signal
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from relive_dm import processing
+from relive_dm.index import ExtractIndex
+from relive_dm.processing import Processor, ResourceClass
+from relive_dm.workqueue import MAX_ATTEMPTS, QueueScheduler, QueueWorker, WorkQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    with WorkQueue(tmp_path) as queue:
+        yield queue
+
+
+def write(queue: WorkQueue, name: str, data: bytes = b"data") -> Path:
+    path = queue.root / name
+    path.write_bytes(data)
+    return path
+
+
+def test_lease_and_complete(queue):
+    path = write(queue, "a.lua")
+    assert queue.enqueue(path)
+    job = queue.lease("w1", 60)
+    assert job is not None and (job.path, job.attempts) == ("a.lua", 1)
+    assert queue.lease("w2", 60) is None
+    assert queue.renew([job], 60) == []
+    assert queue.complete(job, path)
+    assert queue.status("a.lua") == ("done", "a.lua", None)
+    assert queue.finished_since(0) == [(1, "a.lua", "done", "a.lua", None)]
+    # Done in its current version, so not queued again
+    assert not queue.enqueue(path)
+    assert queue.lease("w1", 60) is None
+
+
+def test_changed_file_is_queued_again(queue):
+    path = write(queue, "a.lua")
+    queue.enqueue(path)
+    job = queue.lease("w1", 60)
+    assert job is not None
+    queue.complete(job, path)
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert queue.enqueue(path)
+    assert queue.status("a.lua") == ("pending", None, None)
+
+
+def test_expired_lease_is_handed_over(queue):
+    queue.enqueue(write(queue, "a.lua"))
+    stale = queue.lease("w1", -1)
+    assert stale is not None
+    job = queue.lease("w2", 60)
+    assert job is not None and job.attempts == 2
+    # Only the current holder can renew or record a result
+    assert queue.renew([stale, job], 60) == [stale]
+    assert not queue.complete(stale, None)
+    assert not queue.fail(stale, "late")
+    assert queue.complete(job, None)
+    assert queue.status("a.lua") == ("done", None, None)
+
+
+def test_gives_up_after_max_attempts(queue):
+    queue.enqueue(write(queue, "a.lua"))
+    for _ in range(MAX_ATTEMPTS):
+        assert queue.lease("w1", -1) is not None
+    assert queue.lease("w1", 60) is None
+    assert queue.status("a.lua") == ("failed", None, "Too many attempts")
+    # A failed job is queued again even if its file didn't change
+    assert queue.enqueue(queue.root / "a.lua")
+
+
+def test_lowest_priority_value_first(queue):
+    queue.enqueue(write(queue, "a.lua"), priority=2)
+    queue.enqueue(write(queue, "b.lua"), priority=1)
+    leased = [queue.lease("w1", 60) for _ in range(2)]
+    assert [job and job.path for job in leased] == ["b.lua", "a.lua"]
+
+
+@pytest.fixture
+def register(monkeypatch):
+    def register(suffix: str, handler):
+        monkeypatch.setitem(
+            processing.processors, suffix, Processor(handler, ResourceClass.IO)
+        )
+
+    return register
+
+
+def test_scheduler_futures_follow_workers(queue, register):
+    register(".x", lambda path: path.with_suffix(".out"))
+    path = write(queue, "a.x")
+    worker = QueueWorker(queue, workers=2, poll_interval=0.05)
+    with QueueScheduler(queue, poll_interval=0.05) as scheduler:
+        future = scheduler.submit(path)
+        assert future is not None
+        worker.run(exit_when_empty=True)
+        assert future.result(5) == queue.root / "a.out"
+        # Already done, so resolved without a worker
+        again = scheduler.submit(path)
+        assert again is not None and again.result(0) == queue.root / "a.out"
+    assert worker.processed == 1
+
+
+def test_interrupted_worker_finishes_jobs_in_progress(queue, register):
+    started = threading.Event()
+
+    def slow(path: Path) -> Path:
+        started.set()
+        # Ctrl-C while this job is in progress
+        signal.pthread_kill(threading.main_thread().ident or 0, signal.SIGINT)
+        time.sleep(0.3)
+        return path
+
+    register(".slow", slow)
+    queue.enqueue(write(queue, "a.slow"))
+    queue.enqueue(write(queue, "b.slow"))
+    worker = QueueWorker(queue, workers=1, poll_interval=0.05)
+    with pytest.raises(KeyboardInterrupt):
+        worker.run()
+    assert started.is_set()
+    assert queue.status("a.slow") == ("done", "a.slow", None)
+    # No new job was started after the interrupt
+    assert queue.status("b.slow") == ("pending", None, None)
+    assert worker.processed == 1
+
+
+def test_join_returns_once_index_is_updated(tmp_path, register):
+    register(".x", lambda path: path.with_suffix(".out"))
+    names = [f"{i}.x" for i in range(20)]
+    with WorkQueue(tmp_path) as queue, ExtractIndex(tmp_path) as index:
+        worker = QueueWorker(queue, workers=4, poll_interval=0.01)
+        worker_thread = threading.Thread(target=worker.run)
+        worker_thread.start()
+        try:
+            with QueueScheduler(queue, poll_interval=0.01) as scheduler:
+                for name in names:
+                    path = write(queue, name)
+                    index.mark_extracted(name, "raw/patch/1.zip", 1, 4)
+                    future = scheduler.submit(path)
+                    assert future is not None
+                    # Slow callbacks ahead of the index's widen the window
+                    future.add_done_callback(lambda future: time.sleep(0.02))
+                    index.track(name, future)
+                scheduler.join()
+                statuses = [index.get(name) for name in names]
+        finally:
+            worker.stop()
+            worker_thread.join()
+    assert statuses == [
+        ("raw/patch/1.zip", 1, 4, "done", name.replace(".x", ".out")) for name in names
+    ]